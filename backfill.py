@@ -0,0 +1,140 @@
+# backfill.py - 過去ログのBump取り込み（複数チャンネル並列・途中から再開可能）
+
+import asyncio
+import logging
+import time
+import discord
+import database as db
+import ingest
+from config import BACKFILL_CONCURRENCY, BACKFILL_CHECKPOINT_EVERY
+
+
+class ChannelProgress:
+    """1チャンネル分の進捗（checkpoint に保存する値と同じ）"""
+
+    def __init__(self, channel, checkpoint=None):
+        self.channel = channel
+        self.before_id = checkpoint['before_id'] if checkpoint else None
+        self.scanned = checkpoint['scanned'] if checkpoint else 0
+        self.found = checkpoint['found'] if checkpoint else 0
+        self.completed = checkpoint['completed'] if checkpoint else False
+        self.status = "完了済み" if self.completed else "待機中"
+
+    async def save(self):
+        await db.save_backfill_checkpoint(
+            self.channel.id, self.channel.guild.id if self.channel.guild else 0,
+            self.before_id, self.scanned, self.found, self.completed,
+        )
+
+
+class Backfill:
+    """複数チャンネルの履歴を同時 BACKFILL_CONCURRENCY 件まで並列に読み、Bumpを取り込む。
+
+    Bumpはメッセージの日時どおりに db.import_bump_history でまとめて記録する
+    （連続日数・週間ランキングもその日時で数える）。
+
+    - 各チャンネルは新しい順に読み、BACKFILL_CHECKPOINT_EVERY 件ごとに
+      「ここより古いメッセージは未処理」という位置(before_id)をDBに保存する
+    - 中断しても次回は保存した位置から続きを読む（読み終えたチャンネルは飛ばす）
+    - 位置を保存するのはその手前までのBumpの書き込みが終わってから。
+      それでも重複した分はメッセージIDの重複排除で数えない
+    - メモリ上のランキングは全チャンネルを読み終えてから1回だけ作り直す
+    """
+
+    def __init__(self, channels, extract_user_id, limit: int,
+                 concurrency: int = BACKFILL_CONCURRENCY):
+        self.channels = channels
+        self.extract_user_id = extract_user_id  # message -> user_id / None
+        self.limit = limit  # 1チャンネルで今回読む最大件数
+        self.concurrency = concurrency
+        self.progress = []
+        self.started = None
+        self.scanned = 0   # 今回読んだメッセージ数
+        self.recorded = 0  # 今回新しく記録したBump数
+        self.skipped = 0   # 記録済みだったBump数
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started if self.started else 0.0
+
+    @property
+    def rate(self) -> float:
+        """1秒あたりに読んだメッセージ数"""
+        return self.scanned / self.elapsed if self.elapsed > 0 else 0.0
+
+    async def run(self, restart: bool = False):
+        """全チャンネルを取り込む。restart=True なら保存済みの位置を捨てて最初から読む"""
+        self.started = time.perf_counter()
+        if restart:
+            await db.reset_backfill_checkpoints([c.id for c in self.channels])
+        checkpoints = await db.get_backfill_checkpoints([c.id for c in self.channels])
+        self.progress = [ChannelProgress(c, checkpoints.get(c.id)) for c in self.channels]
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def worker(progress: ChannelProgress):
+            async with semaphore:
+                await self._scan(progress)
+
+        await asyncio.gather(*(worker(p) for p in self.progress if not p.completed))
+        if self.recorded:
+            # チェックポイントごとには読み直さず、最後に1回だけランキングを作り直す
+            async with ingest.get_queue().exclusive():
+                await db.load_leaderboards()
+        logging.info(
+            f"過去ログ取り込み完了: {len(self.channels)}チャンネル / {self.scanned}件 "
+            f"({self.rate:.0f}件/秒) / 記録{self.recorded}件 / 記録済み{self.skipped}件"
+        )
+
+    async def _scan(self, progress: ChannelProgress):
+        channel = progress.channel
+        progress.status = "読み込み中"
+        events = []
+        since_checkpoint = 0
+        read = 0
+        before = discord.Object(id=progress.before_id) if progress.before_id else None
+
+        try:
+            async for message in channel.history(limit=self.limit, before=before):
+                read += 1
+                self.scanned += 1
+                progress.scanned += 1
+                since_checkpoint += 1
+
+                user_id = self.extract_user_id(message)
+                if user_id is not None:
+                    events.append({
+                        'message_id': message.id,
+                        'user_id': user_id,
+                        'guild_id': message.guild.id if message.guild else None,
+                        'channel_id': channel.id,
+                        'bumped_at': message.created_at,
+                    })
+
+                progress.before_id = message.id
+                if since_checkpoint >= BACKFILL_CHECKPOINT_EVERY:
+                    await self._checkpoint(progress, events)
+                    events = []
+                    since_checkpoint = 0
+
+            # limit 未満で尽きたらこのチャンネルは最後まで読んだ
+            progress.completed = read < self.limit
+            await self._checkpoint(progress, events)
+            progress.status = "完了" if progress.completed else "今回分終了"
+        except discord.Forbidden:
+            progress.status = "エラー"
+            logging.warning(f"過去ログ取り込み: #{channel} の履歴を読む権限がありません")
+        except Exception as e:
+            progress.status = "エラー"
+            logging.error(f"過去ログ取り込みエラー (#{channel}): {e}", exc_info=True)
+
+    async def _checkpoint(self, progress: ChannelProgress, events: list):
+        """ここまでのBumpを書き込み終えてから位置を保存する"""
+        if events:
+            # ライブのBump書き込みと重ならないよう、書き込みキューを止めて取り込む
+            async with ingest.get_queue().exclusive():
+                result = await db.import_bump_history(events, reload_leaderboards=False)
+            self.recorded += result['recorded']
+            self.skipped += result['duplicates']
+            progress.found += result['recorded']
+        await progress.save()
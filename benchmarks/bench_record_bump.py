@@ -0,0 +1,199 @@
+# benchmarks/bench_record_bump.py - Bump1件の記録のラウンドトリップ数・レイテンシ比較
+#
+# 使い方:
+#   DATABASE_URL=postgres://... python benchmarks/bench_record_bump.py --iterations 500
+#
+# 専用スキーマ(bumpkun_bench)にテーブルを作って計測し、最後にスキーマごと削除する。
+# 本番テーブルには一切書き込まない。
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import os
+import ssl
+import statistics
+import sys
+import time
+
+import asyncpg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db  # noqa: E402
+from config import DATABASE_URL  # noqa: E402
+
+BENCH_SCHEMA = "bumpkun_bench"
+
+
+class CountingConnection(asyncpg.Connection):
+    """クエリ発行回数(=ラウンドトリップ数)を数える接続クラス
+
+    BEGIN/COMMIT とプール返却時のリセットクエリも execute 経由なので含まれる。
+    """
+
+    round_trips = 0
+
+    async def execute(self, *args, **kwargs):
+        CountingConnection.round_trips += 1
+        return await super().execute(*args, **kwargs)
+
+    async def fetch(self, *args, **kwargs):
+        CountingConnection.round_trips += 1
+        return await super().fetch(*args, **kwargs)
+
+    async def fetchrow(self, *args, **kwargs):
+        CountingConnection.round_trips += 1
+        return await super().fetchrow(*args, **kwargs)
+
+    async def fetchval(self, *args, **kwargs):
+        CountingConnection.round_trips += 1
+        return await super().fetchval(*args, **kwargs)
+
+
+async def legacy_record_bump(user_id: int) -> dict:
+    """比較用: 変更前の record_bump（SELECT → UPDATE/INSERT → 週間UPSERT → SELECT）"""
+    pool = await db.get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            today = datetime.date.today()
+            week_start = today - datetime.timedelta(days=today.weekday())
+
+            row = await conn.fetchrow(
+                'SELECT bump_count, last_bump_date, current_streak, max_streak FROM users WHERE user_id = $1',
+                user_id
+            )
+
+            if row:
+                old_count = row['bump_count']
+                last_date = row['last_bump_date']
+                streak = row['current_streak']
+                max_streak = row['max_streak']
+
+                if last_date is not None:
+                    days_diff = (today - last_date).days
+                    if days_diff == 1:
+                        streak += 1
+                    elif days_diff == 0:
+                        pass
+                    else:
+                        streak = 1
+                else:
+                    streak = 1
+
+                new_count = old_count + 1
+                is_new_record = streak > max_streak
+                new_max = max(streak, max_streak)
+
+                await conn.execute('''
+                    UPDATE users SET
+                        bump_count = $1,
+                        last_bump_date = $2,
+                        current_streak = $3,
+                        max_streak = $4
+                    WHERE user_id = $5
+                ''', new_count, today, streak, new_max, user_id)
+            else:
+                new_count = 1
+                streak = 1
+                new_max = 1
+                is_new_record = True
+
+                await conn.execute('''
+                    INSERT INTO users (user_id, bump_count, last_bump_date, current_streak, max_streak)
+                    VALUES ($1, 1, $2, 1, 1)
+                ''', user_id, today)
+
+            await conn.execute('''
+                INSERT INTO weekly_bumps (user_id, week_start, bump_count)
+                VALUES ($1, $2, 1)
+                ON CONFLICT (user_id, week_start) DO UPDATE
+                SET bump_count = weekly_bumps.bump_count + 1;
+            ''', user_id, week_start)
+
+            weekly_count = await conn.fetchval(
+                'SELECT bump_count FROM weekly_bumps WHERE user_id = $1 AND week_start = $2',
+                user_id, week_start
+            )
+
+            return {
+                'bump_count': new_count,
+                'current_streak': streak,
+                'max_streak': new_max,
+                'weekly_count': weekly_count or 1,
+                'is_new_streak_record': is_new_record and streak > 1,
+            }
+
+
+_message_ids = itertools.count(1)
+
+
+async def current_record_bump(user_id: int) -> dict:
+    """本番と同じ経路: 書き込みキューが1件ずつ書き出したときの db.record_bump_events"""
+    event = {
+        'message_id': next(_message_ids),
+        'user_id': user_id,
+        'guild_id': None,
+        'channel_id': 0,
+        'bumped_at': datetime.datetime.now(datetime.timezone.utc),
+    }
+    results, _ = await db.record_bump_events([event])
+    return results[user_id]
+
+
+async def _run(name, func, iterations, users):
+    CountingConnection.round_trips = 0
+    latencies = []
+    for i in range(iterations):
+        user_id = 1_000_000 + (i % users)
+        started = time.perf_counter()
+        await func(user_id)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    latencies.sort()
+    p50 = statistics.median(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    trips = CountingConnection.round_trips / iterations
+    print(f"{name:<8} round_trips/bump={trips:.1f}  p50={p50:.2f}ms  p99={p99:.2f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Bump記録のベンチマーク")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--users", type=int, default=50, help="Bumpさせるユーザー数")
+    args = parser.parse_args()
+
+    if not DATABASE_URL:
+        raise SystemExit("DATABASE_URL が設定されていません")
+
+    ctx = ssl.create_default_context(purpose=ssl.Purpose.SERVER_AUTH)
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+
+    setup_conn = await asyncpg.connect(dsn=DATABASE_URL, ssl=ctx)
+    await setup_conn.execute(f'DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE')
+    await setup_conn.execute(f'CREATE SCHEMA {BENCH_SCHEMA}')
+
+    # database.py のグローバルプールをベンチ用スキーマ向けに差し替える
+    db._global_pool = await asyncpg.create_pool(
+        dsn=DATABASE_URL,
+        ssl=ctx,
+        statement_cache_size=0,
+        min_size=1,
+        max_size=1,
+        connection_class=CountingConnection,
+        server_settings={'search_path': BENCH_SCHEMA},
+    )
+    try:
+        await db.init_db()
+        await _run("legacy", legacy_record_bump, args.iterations, args.users)
+        await db._global_pool.execute('TRUNCATE users, weekly_bumps')
+        await _run("current", current_record_bump, args.iterations, args.users)
+    finally:
+        await db.close_pool()
+        await setup_conn.execute(f'DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE')
+        await setup_conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -3,9 +3,16 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
+import asyncio
+import io
 import logging
 import database as db
-from config import DISBOARD_BOT_ID
+import ingest
+import outbound
+import querystats
+import profiling
+from backfill import Backfill
+from config import DISBOARD_BOT_ID, BACKFILL_PROGRESS_INTERVAL_SECONDS, PROFILE_MAX_SECONDS
 
 
 class AdminCog(commands.Cog):
@@ -14,56 +21,424 @@ class AdminCog(commands.Cog):
 
     @app_commands.command(
         name="scan_history",
-        description="【管理者用/一度きり】過去のBump履歴をスキャンして登録します。",
+        description="【管理者用】過去のBump履歴をスキャンして登録します（中断しても続きから再開できます）。",
     )
+    @app_commands.describe(
+        scope="スキャンするチャンネル",
+        limit="1チャンネルあたり今回読むメッセージ数",
+        restart="保存済みの再開位置を捨てて最新から読み直す",
+    )
+    @app_commands.choices(scope=[
+        app_commands.Choice(name="このチャンネル", value="channel"),
+        app_commands.Choice(name="サーバーの全テキストチャンネル", value="guild"),
+    ])
     @app_commands.checks.has_permissions(administrator=True)
+    @profiling.profiled("/scan_history")
     async def scan_history(
         self,
         interaction: discord.Interaction,
-        limit: app_commands.Range[int, 1, 10000] = 1000,
+        scope: app_commands.Choice[str] = None,
+        limit: app_commands.Range[int, 1, 100000] = 1000,
+        restart: bool = False,
     ):
         try:
             await interaction.response.defer(ephemeral=True, thinking=True)
 
-            if await db.is_scan_completed():
+            # イベントログ導入前のスキャン分はメッセージIDが残っていないので、再スキャンすると二重になる
+            if await db.get_setting('scan_before_event_log') == 'true':
                 await interaction.followup.send(
                     "**エラー：過去ログのスキャンは既に完了しています！**", ephemeral=True
                 )
                 return
 
-            found_bumps = 0
-            async for message in interaction.channel.history(limit=limit):
-                user_id = _extract_bump_user_id(message)
-                if user_id is not None:
-                    await db.record_bump(user_id)
-                    found_bumps += 1
+            if scope is not None and scope.value == "guild" and interaction.guild is not None:
+                me = interaction.guild.me
+                channels = [
+                    c for c in interaction.guild.text_channels
+                    if c.permissions_for(me).read_message_history
+                ]
+            else:
+                channels = [interaction.channel]
+
+            # 記録済みのメッセージはメモリ上かDBのメッセージID一意制約で弾かれるので、
+            # 何度スキャンしても二重には数えない
+            backfill = Backfill(channels, _extract_bump_user_id, limit)
+            status = await interaction.followup.send(
+                f"{len(channels)}チャンネルのスキャンを開始します…", ephemeral=True, wait=True
+            )
+            task = asyncio.create_task(backfill.run(restart=restart))
+            while not task.done():
+                await asyncio.wait({task}, timeout=BACKFILL_PROGRESS_INTERVAL_SECONDS)
+                if not task.done():
+                    status = await _update_progress(status, _backfill_progress_text(backfill))
+            await task
+
+            if backfill.recorded:
+                await db.mark_scan_as_completed()
+            text = _backfill_progress_text(backfill, finished=True)
+            if await _update_progress(status, text) is None:
+                await interaction.followup.send(text, ephemeral=True)
+
+        except Exception as e:
+            logging.error(f"scan_history エラー: {e}", exc_info=True)
+            await _safe_error_reply(interaction, "スキャン中にエラーが発生しました。しばらく待ってから再試行してください。")
+
+    @scan_history.error
+    async def on_scan_history_error(
+        self, interaction: discord.Interaction, error: app_commands.AppCommandError
+    ):
+        if isinstance(error, app_commands.MissingPermissions):
+            await _safe_error_reply(interaction, "このコマンドはサーバーの管理者しか使えません。")
+        else:
+            logging.error(f"scan_history コマンドエラー: {error}", exc_info=True)
+            await _safe_error_reply(interaction, "スキャン中にエラーが発生しました。しばらく待ってから再試行してください。")
+
+    @app_commands.command(
+        name="reconcile_counters",
+        description="【管理者用】合計Bump数の集計を元データから数え直し、ずれを修正します。",
+    )
+    @app_commands.checks.has_permissions(administrator=True)
+    @profiling.profiled("/reconcile_counters")
+    async def reconcile_counters(self, interaction: discord.Interaction):
+        try:
+            await interaction.response.defer(ephemeral=True, thinking=True)
+            drift = await db.reconcile_counters()
+
+            if not drift:
+                await interaction.followup.send("集計にずれはありませんでした。✅", ephemeral=True)
+                return
+
+            lines = [
+                f"`{d['scope']}:{d['scope_key'] or '-'}` {d['stored']} → **{d['actual']}**"
+                for d in drift[:20]
+            ]
+            if len(drift) > 20:
+                lines.append(f"…ほか {len(drift) - 20} 件")
+            await interaction.followup.send(
+                f"**{len(drift)}件**のずれを修正しました。\n" + "\n".join(lines), ephemeral=True
+            )
+
+        except Exception as e:
+            logging.error(f"reconcile_counters エラー: {e}", exc_info=True)
+            await _safe_error_reply(interaction, "集計の数え直し中にエラーが発生しました。")
+
+    @reconcile_counters.error
+    async def on_reconcile_counters_error(
+        self, interaction: discord.Interaction, error: app_commands.AppCommandError
+    ):
+        if isinstance(error, app_commands.MissingPermissions):
+            await _safe_error_reply(interaction, "このコマンドはサーバーの管理者しか使えません。")
+        else:
+            logging.error(f"reconcile_counters コマンドエラー: {error}", exc_info=True)
+            await _safe_error_reply(interaction, "集計の数え直し中にエラーが発生しました。")
+
+    @app_commands.command(
+        name="detach_old_events",
+        description="【管理者用】古いBumpイベントログを月単位で切り離します（集計・ランキングは残ります）。",
+    )
+    @app_commands.describe(keep_months="残す月数（今月を含まない）")
+    @app_commands.checks.has_permissions(administrator=True)
+    @profiling.profiled("/detach_old_events")
+    async def detach_old_events(
+        self,
+        interaction: discord.Interaction,
+        keep_months: app_commands.Range[int, 1, 120] = 12,
+    ):
+        try:
+            await interaction.response.defer(ephemeral=True, thinking=True)
+            detached = await db.detach_old_event_partitions(keep_months)
+            if not detached:
+                await interaction.followup.send("切り離す古いイベントログはありませんでした。", ephemeral=True)
+                return
+            await interaction.followup.send(
+                f"**{len(detached)}か月分**のイベントログを切り離しました。\n"
+                + "\n".join(f"- `{name}` → `{name}_archived`" for name in detached),
+                ephemeral=True,
+            )
+        except Exception as e:
+            logging.error(f"detach_old_events エラー: {e}", exc_info=True)
+            await _safe_error_reply(interaction, "イベントログの切り離し中にエラーが発生しました。")
+
+    @detach_old_events.error
+    async def on_detach_old_events_error(
+        self, interaction: discord.Interaction, error: app_commands.AppCommandError
+    ):
+        if isinstance(error, app_commands.MissingPermissions):
+            await _safe_error_reply(interaction, "このコマンドはサーバーの管理者しか使えません。")
+        else:
+            logging.error(f"detach_old_events コマンドエラー: {error}", exc_info=True)
+            await _safe_error_reply(interaction, "イベントログの切り離し中にエラーが発生しました。")
+
+    @app_commands.command(
+        name="bot_stats",
+        description="【管理者用】キャッシュなどの内部統計を表示します。",
+    )
+    @app_commands.checks.has_permissions(administrator=True)
+    @profiling.profiled("/bot_stats")
+    async def show_bot_stats(self, interaction: discord.Interaction):
+        cache = db.get_user_cache_stats()
+        embed = discord.Embed(title="🛠️ BUMPくん 内部統計", color=discord.Color.dark_grey())
+        embed.add_field(
+            name="ユーザー状態キャッシュ",
+            value=(
+                f"ヒット: **{cache['hits']}** / ミス: **{cache['misses']}**"
+                f"（ヒット率 {cache['hit_rate']:.1%}）\n"
+                f"件数: {cache['size']} / {cache['max_size']}"
+            ),
+            inline=False,
+        )
+
+        sender = outbound.get_dispatcher().stats()
+        depth = " / ".join(f"{name}: {n}" for name, n in sender['depth'].items())
+        embed.add_field(
+            name="送信キュー",
+            value=(
+                f"待ち: {depth}（{sender['channels']}チャンネル処理中）\n"
+                f"送信: {sender['sent']} / 編集: {sender['edited']}"
+                f" / まとめた編集: {sender['coalesced']} / 失敗: {sender['failed']}"
+            ),
+            inline=False,
+        )
+
+        ranking = self.bot.get_cog("RankingCog")
+        if ranking is not None:
+            members = ranking.resolver.stats()
+            embed.add_field(
+                name="メンバー解決（ランキング）",
+                value=(
+                    f"REST: **{members['rest_calls']}**回 / キャッシュ: {members['cache_hits']}"
+                    f" / 退出済みスキップ: {members['missing_hits']}\n"
+                    f"表示名: {members['names']}件 / 退出記録: {members['missing']}件"
+                ),
+                inline=False,
+            )
+
+        bump = self.bot.get_cog("BumpCog")
+        if bump is not None:
+            bumps = bump.stats()
+            modes = " / ".join(f"{mode}: {n}" for mode, n in bumps['modes'].items())
+            embed.add_field(
+                name="Bump演出",
+                value=(
+                    f"Bump: **{bumps['bumps']}**回 / API呼び出し: {bumps['api_calls']}回"
+                    f" (平均 {bumps['api_calls_per_bump']:.1f}回)"
+                    f" / 重複スキップ: {ingest.get_queue().duplicates}回\n"
+                    f"演出モード: {modes}"
+                ),
+                inline=False,
+            )
+
+        reminder = self.bot.get_cog("ReminderCog")
+        if reminder is not None:
+            countdowns = reminder.countdowns.stats()
+            embed.add_field(
+                name="カウントアップ",
+                value=(
+                    f"更新中: **{countdowns['active']}**件 / 編集: {countdowns['edits']}回"
+                    f" / 変化なしでスキップ: {countdowns['skipped']}回"
+                ),
+                inline=False,
+            )
+
+        slowest = profiling.stats()[:5]
+        if slowest:
+            embed.add_field(
+                name="処理時間（平均の長い順）",
+                value="\n".join(
+                    f"{r['name']}: 平均 {r['avg_ms']:.0f}ms（REST {r['avg_rest_ms']:.0f} / DB {r['avg_db_ms']:.0f}）"
+                    f" / 最大 {r['max_ms']:.0f}ms / {r['calls']}回"
+                    for r in slowest
+                ),
+                inline=False,
+            )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @show_bot_stats.error
+    async def on_bot_stats_error(
+        self, interaction: discord.Interaction, error: app_commands.AppCommandError
+    ):
+        if isinstance(error, app_commands.MissingPermissions):
+            await _safe_error_reply(interaction, "このコマンドはサーバーの管理者しか使えません。")
+        else:
+            logging.error(f"bot_stats コマンドエラー: {error}", exc_info=True)
+            await _safe_error_reply(interaction, "統計の表示中にエラーが発生しました。")
+
+    @app_commands.command(
+        name="slot_mode",
+        description="【管理者用】Bump時のスロット演出の出し方を変更します。",
+    )
+    @app_commands.describe(mode="full: 1リールずつ表示 / single: 結果だけ表示 / embed: 結果をEmbedに統合")
+    @app_commands.choices(mode=[
+        app_commands.Choice(name="full（1リールずつ表示）", value="full"),
+        app_commands.Choice(name="single（結果だけ表示）", value="single"),
+        app_commands.Choice(name="embed（結果をEmbedに統合）", value="embed"),
+    ])
+    @app_commands.checks.has_permissions(administrator=True)
+    @profiling.profiled("/slot_mode")
+    async def slot_mode(self, interaction: discord.Interaction, mode: app_commands.Choice[str]):
+        bump = self.bot.get_cog("BumpCog")
+        if bump is None or interaction.guild_id is None:
+            await interaction.response.send_message("このサーバーでは変更できません。", ephemeral=True)
+            return
+        try:
+            await bump.set_slot_mode(interaction.guild_id, mode.value)
+            await interaction.response.send_message(
+                f"スロット演出を **{mode.name}** に変更しました。\n"
+                "※チャンネルが混み合っているときは自動で軽い演出になります。",
+                ephemeral=True,
+            )
+        except Exception as e:
+            logging.error(f"slot_mode エラー: {e}", exc_info=True)
+            await _safe_error_reply(interaction, "演出モードの変更中にエラーが発生しました。")
+
+    @slot_mode.error
+    async def on_slot_mode_error(
+        self, interaction: discord.Interaction, error: app_commands.AppCommandError
+    ):
+        if isinstance(error, app_commands.MissingPermissions):
+            await _safe_error_reply(interaction, "このコマンドはサーバーの管理者しか使えません。")
+        else:
+            logging.error(f"slot_mode コマンドエラー: {error}", exc_info=True)
+            await _safe_error_reply(interaction, "演出モードの変更中にエラーが発生しました。")
 
-            if found_bumps == 0:
+    @app_commands.command(
+        name="slow_queries",
+        description="【管理者用】起動後に遅かったDBクエリの上位を表示します。",
+    )
+    @app_commands.describe(
+        top="表示する件数",
+        query="指定したクエリの直近の遅いSQLと実行計画を表示（未取得ならその場で取得）",
+    )
+    @app_commands.checks.has_permissions(administrator=True)
+    @profiling.profiled("/slow_queries")
+    async def slow_queries(
+        self,
+        interaction: discord.Interaction,
+        top: app_commands.Range[int, 1, 25] = 10,
+        query: str = None,
+    ):
+        try:
+            await interaction.response.defer(ephemeral=True, thinking=True)
+            stats = querystats.get_stats()
+
+            if query is not None:
+                sql, args, plan = stats.get_plan(query)
+                if sql is None:
+                    await interaction.followup.send(
+                        f"`{query}` は遅いクエリとして記録されていません。", ephemeral=True
+                    )
+                    return
+                if plan is None:
+                    plan = await db.capture_plan(query, sql, args)
+                text = f"-- {query}\n{sql.strip()}\n\n{plan}"
                 await interaction.followup.send(
-                    f"{limit}件のメッセージをスキャンしましたが、Bump履歴は見つかりませんでした。",
+                    f"`{query}` の実行計画（{db.explain_command(sql)}）",
+                    file=discord.File(io.BytesIO(text.encode('utf-8')), filename=f"{query}.txt"),
                     ephemeral=True,
                 )
                 return
 
-            await db.mark_scan_as_completed()
+            rows = stats.top(top, key='max_ms')
+            if not rows:
+                await interaction.followup.send("まだクエリの記録がありません。", ephemeral=True)
+                return
+            lines = ["クエリ名 | 回数 | p50 / p95 / p99 / 最大 (ms) | 接続待ちp95 | 遅い回数"]
+            for r in rows:
+                lines.append(
+                    f"{r['name']} | {r['calls']} | {r['p50_ms']:.1f} / {r['p95_ms']:.1f} / "
+                    f"{r['p99_ms']:.1f} / {r['max_ms']:.1f} | {r['wait_p95_ms']:.1f} | "
+                    f"{r['slow']}{' 📄' if r['has_plan'] else ''}"
+                )
             await interaction.followup.send(
-                f"スキャン完了！**{found_bumps}件**のBumpを記録しました。\n**安全装置が作動しました。**",
+                f"**遅いDBクエリ TOP{len(rows)}**（最大実行時間順・📄は実行計画あり）\n```\n"
+                + "\n".join(lines)[:1800] + "\n```",
                 ephemeral=True,
             )
+        except Exception as e:
+            logging.error(f"slow_queries エラー: {e}", exc_info=True)
+            await _safe_error_reply(interaction, "クエリ統計の表示中にエラーが発生しました。")
+
+    @slow_queries.error
+    async def on_slow_queries_error(
+        self, interaction: discord.Interaction, error: app_commands.AppCommandError
+    ):
+        if isinstance(error, app_commands.MissingPermissions):
+            await _safe_error_reply(interaction, "このコマンドはサーバーの管理者しか使えません。")
+        else:
+            logging.error(f"slow_queries コマンドエラー: {error}", exc_info=True)
+            await _safe_error_reply(interaction, "クエリ統計の表示中にエラーが発生しました。")
+
+    @app_commands.command(
+        name="profile",
+        description="【管理者用】指定秒数だけプロファイラーを動かし、結果をファイルで返します。",
+    )
+    @app_commands.describe(seconds="計測する秒数（その間に動いたすべての処理が対象）")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def profile(
+        self,
+        interaction: discord.Interaction,
+        seconds: app_commands.Range[int, 1, PROFILE_MAX_SECONDS] = 10,
+    ):
+        try:
+            await interaction.response.defer(ephemeral=True, thinking=True)
+            try:
+                text = await profiling.sample(seconds)
+            except RuntimeError:
+                await interaction.followup.send("別のプロファイルを実行中です。終わってからもう一度試してね。", ephemeral=True)
+                return
 
+            lines = ["処理名 | 回数 | 平均 / 最大 (ms) | 平均REST / 平均DB (ms) | 遅い回数"]
+            for r in profiling.stats():
+                lines.append(
+                    f"{r['name']} | {r['calls']} | {r['avg_ms']:.1f} / {r['max_ms']:.1f} | "
+                    f"{r['avg_rest_ms']:.1f} / {r['avg_db_ms']:.1f} | {r['slow']}"
+                )
+            text = "# 起動後の処理ごとの内訳\n" + "\n".join(lines) + "\n\n" + text
+            await interaction.followup.send(
+                f"{seconds}秒間のプロファイル結果です。",
+                file=discord.File(io.BytesIO(text.encode('utf-8')), filename="profile.txt"),
+                ephemeral=True,
+            )
         except Exception as e:
-            logging.error(f"scan_history エラー: {e}", exc_info=True)
-            await _safe_error_reply(interaction, "スキャン中にエラーが発生しました。しばらく待ってから再試行してください。")
+            logging.error(f"profile エラー: {e}", exc_info=True)
+            await _safe_error_reply(interaction, "プロファイルの取得中にエラーが発生しました。")
 
-    @scan_history.error
-    async def on_scan_history_error(
+    @profile.error
+    async def on_profile_error(
         self, interaction: discord.Interaction, error: app_commands.AppCommandError
     ):
         if isinstance(error, app_commands.MissingPermissions):
             await _safe_error_reply(interaction, "このコマンドはサーバーの管理者しか使えません。")
         else:
-            logging.error(f"scan_history コマンドエラー: {error}", exc_info=True)
-            await _safe_error_reply(interaction, "スキャン中にエラーが発生しました。しばらく待ってから再試行してください。")
+            logging.error(f"profile コマンドエラー: {error}", exc_info=True)
+            await _safe_error_reply(interaction, "プロファイルの取得中にエラーが発生しました。")
+
+
+def _backfill_progress_text(backfill: Backfill, finished: bool = False) -> str:
+    head = "✅ スキャン完了！" if finished else "🔄 スキャン中…"
+    lines = [
+        f"{head} {backfill.elapsed:.0f}秒 / {backfill.scanned}件 ({backfill.rate:.0f}件/秒)",
+        f"記録: **{backfill.recorded}件** / 記録済みでスキップ: {backfill.skipped}件",
+    ]
+    for p in backfill.progress[:15]:
+        lines.append(f"- #{p.channel.name}: {p.status}（累計{p.scanned}件 / Bump {p.found}件）")
+    if len(backfill.progress) > 15:
+        lines.append(f"…ほか{len(backfill.progress) - 15}チャンネル")
+    if finished and any(p.status == "今回分終了" for p in backfill.progress):
+        lines.append("※読み切れなかったチャンネルは、もう一度実行すると続きから読みます。")
+    return "\n".join(lines)
+
+
+async def _update_progress(message, text: str):
+    """進捗メッセージを書き換える。interactionの期限(15分)切れなどで失敗したら None を返す"""
+    if message is None:
+        return None
+    try:
+        await message.edit(content=text)
+        return message
+    except discord.HTTPException as e:
+        logging.warning(f"スキャン進捗の更新に失敗: {e}")
+        return None
 
 
 def _extract_bump_user_id(message: discord.Message):
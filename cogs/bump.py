@@ -6,11 +6,17 @@ import random
 import datetime
 import asyncio
 import logging
+import time
 import database as db
+import ingest
+import lifecycle
+import metrics
+import outbound
+import profiling
 from config import (
     DISBOARD_BOT_ID, BUMP_COOLDOWN_HOURS,
-    SLOT_MACHINES,
-    THANKS_MESSAGES, MILESTONES,
+    SLOT_MACHINES, SLOT_MODE_DEFAULT,
+    THANKS_MESSAGES, MILESTONES, PROFILE_BUMP_SLOW_MS,
     get_bump_title, get_streak_badge,
 )
 
@@ -38,9 +44,85 @@ def _detect_bump(message: discord.Message):
     return user
 
 
+# 演出モード → スロット演出にかかるAPI呼び出し回数（重い順）
+SLOT_MODE_COSTS = {"full": 4, "single": 2, "embed": 0}
+SLOT_MODE_NAMES = {"full": "フル演出", "single": "1回編集", "embed": "Embedに統合"}
+
+
+def _judge_slot(slot: list, jackpot_messages: dict) -> str:
+    """スロット結果の判定メッセージ"""
+    if slot[0] == slot[1] == slot[2]:
+        return jackpot_messages.get(slot[0], "🎉 **揃った！** 🎉")
+    if slot[0] == slot[1] or slot[1] == slot[2] or slot[0] == slot[2]:
+        return "おしい！あと一歩だったね！"
+    return "残念！次のBumpでリベンジだ！"
+
+
+class _StageTimer:
+    """Bump検知からの各段階の所要時間と、Discord API呼び出し回数を記録する（ログ用）"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.api_calls = 0
+
+    def mark(self, stage: str):
+        self.stages[stage] = (time.perf_counter() - self.started) * 1000
+
+    def send(self, channel, **kwargs):
+        self.api_calls += 1
+        return outbound.send(channel, **kwargs)
+
+    def edit(self, message, **kwargs):
+        self.api_calls += 1
+        return outbound.edit(message, **kwargs)
+
+    def summary(self) -> str:
+        stages = " / ".join(f"{stage} {ms:.0f}ms" for stage, ms in self.stages.items())
+        return f"{stages} / API {self.api_calls}回"
+
+
 class BumpCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self._slot_modes = {}  # guild_id -> 演出モード（settingsテーブルのキャッシュ）
+        self.bumps = 0
+        self.api_calls = 0
+        self.mode_counts = {mode: 0 for mode in SLOT_MODE_COSTS}
+
+    def stats(self) -> dict:
+        return {
+            'bumps': self.bumps,
+            'api_calls': self.api_calls,
+            'api_calls_per_bump': self.api_calls / self.bumps if self.bumps else 0.0,
+            'modes': dict(self.mode_counts),
+        }
+
+    async def get_slot_mode(self, guild_id) -> str:
+        """サーバーに設定された演出モード"""
+        if guild_id is None:
+            return SLOT_MODE_DEFAULT
+        if guild_id not in self._slot_modes:
+            mode = await db.get_setting(f"slot_mode:{guild_id}")
+            self._slot_modes[guild_id] = mode if mode in SLOT_MODE_COSTS else SLOT_MODE_DEFAULT
+        return self._slot_modes[guild_id]
+
+    async def set_slot_mode(self, guild_id: int, mode: str):
+        await db.set_setting(f"slot_mode:{guild_id}", mode)
+        self._slot_modes[guild_id] = mode
+
+    async def _choose_slot_mode(self, guild_id, channel_id: int) -> str:
+        """設定モードを上限に、チャンネルのレート制限の残りで払えるモードを選ぶ。
+        演出のあとに結果Embedを1回送る分も残しておく。
+        """
+        configured = await self.get_slot_mode(guild_id)
+        dispatcher = outbound.get_dispatcher()
+        budget = dispatcher.remaining(channel_id) - dispatcher.queue_depth(channel_id) - 1
+        modes = list(SLOT_MODE_COSTS)
+        for mode in modes[modes.index(configured):]:
+            if SLOT_MODE_COSTS[mode] <= budget:
+                return mode
+        return "embed"
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
@@ -48,104 +130,202 @@ class BumpCog(commands.Cog):
         if user is None:
             return
 
+        # 終了処理中は新しいBumpを始めない（claim しないので、次のプロセスや /scan_history で拾える）
+        if not lifecycle.get_lifecycle().accepting:
+            logging.warning(f"Bump検知（終了処理中のためスキップ）: {user.name} ({user.id}) / message {message.id}")
+            return
+
+        # 再接続や二重起動で同じメッセージが2回届いても、DBに触る前に捨てる
+        if not ingest.claim(message.id):
+            logging.info(f"Bump検知（処理済みのためスキップ）: {user.name} ({user.id}) / message {message.id}")
+            return
+
+        with lifecycle.get_lifecycle().track("bump"):
+            await self._handle_bump(message, user)
+
+    # Bump以外のメッセージは計測しない（件数と平均がBumpの処理時間を表すように）
+    @profiling.profiled("bump.handle", slow_ms=PROFILE_BUMP_SLOW_MS)
+    async def _handle_bump(self, message: discord.Message, user):
         logging.info(f"Bump検知: {user.name} ({user.id})")
+        timer = _StageTimer()
+        channel = message.channel
+        guild_id = message.guild.id if message.guild else None
+        next_time = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=BUMP_COOLDOWN_HOURS)
 
+        # 記録・リマインダー設定・スロット演出は互いに待たずに同時に始める。
+        # リマインダーは演出や記録が失敗しても設定されるよう独立したタスクにする
+        # 演出モードはタスクを作る前に決める（設定の読み込みに失敗しても記録とリマインダーは必ず走らせる）
         try:
-            result = await db.record_bump(user.id)
-            count = result['bump_count']
-            streak = result['current_streak']
-            max_streak = result['max_streak']
-            weekly = result['weekly_count']
-            is_new_record = result['is_new_streak_record']
-
-            # --- スロットマシン演出(2種類からランダムに選択) ---
-            machine = random.choice(SLOT_MACHINES)
-            machine_name = machine["name"]
-            reels = machine["reels"]
-            jackpot_messages = machine["jackpot_messages"]
-
-            slot = [random.choice(reels) for _ in range(3)]
-            msg = await message.channel.send(f"{user.name} さんの{machine_name}！\n`[ ? | ? | ? ]`")
-            await asyncio.sleep(1)
-            await msg.edit(content=f"{user.name} さんの{machine_name}！\n`[ {slot[0]} | ? | ? ]`")
-            await asyncio.sleep(1)
-            await msg.edit(content=f"{user.name} さんの{machine_name}！\n`[ {slot[0]} | {slot[1]} | ? ]`")
-            await asyncio.sleep(1)
-            await msg.edit(content=f"{user.name} さんの{machine_name}！\n`[ {slot[0]} | {slot[1]} | {slot[2]} ]`")
-
-            # スロット結果判定
-            if slot[0] == slot[1] == slot[2]:
-                slot_msg = jackpot_messages.get(slot[0], "🎉 **揃った！** 🎉")
-            elif slot[0] == slot[1] or slot[1] == slot[2] or slot[0] == slot[2]:
-                slot_msg = "おしい！あと一歩だったね！"
-            else:
-                slot_msg = "残念！次のBumpでリベンジだ！"
-
-            # --- Embed構築 ---
-            title = get_bump_title(count)
-            streak_badge = get_streak_badge(streak)
-            next_time = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=BUMP_COOLDOWN_HOURS)
-
-            embed = discord.Embed(
-                title=f"{title}　{user.display_name}",
-                description=slot_msg,
-                color=discord.Color.gold() if slot[0] == slot[1] == slot[2] else discord.Color.blue(),
-            )
-            embed.set_thumbnail(url=user.display_avatar.url)
+            mode = await self._choose_slot_mode(guild_id, channel.id)
+        except Exception as e:
+            logging.error(f"演出モードの取得エラー（{SLOT_MODE_DEFAULT} で続行）: {e}", exc_info=True)
+            mode = SLOT_MODE_DEFAULT
+        machine = random.choice(SLOT_MACHINES)
+        slot = [random.choice(machine["reels"]) for _ in range(3)]
+        record_task = asyncio.create_task(self._record(message, user.id, guild_id, timer))
+        reminder_task = asyncio.create_task(self._set_reminder(message, next_time, timer))
+        first_frame = []  # 演出の最初のメッセージの送信Future（記録できなかったときに消す）
+        animation_task = asyncio.create_task(
+            self._play_slot(channel, user, machine, slot, mode, timer, first_frame)
+        )
 
-            # 統計フィールド
-            stats_text = (
-                f"累計: **{count}回**\n"
-                f"今週: **{weekly}回**"
-            )
-            embed.add_field(name="📊 Bump記録", value=stats_text, inline=True)
-
-            # Streak表示
-            streak_text = f"連続: **{streak}日**"
-            if streak_badge:
-                streak_text += f"\n{streak_badge}"
-            if max_streak > 1:
-                streak_text += f"\n自己ベスト: **{max_streak}日**"
-            embed.add_field(name="🔥 連続記録", value=streak_text, inline=True)
-
-            # 次のBump時刻
-            embed.add_field(
-                name="⏰ 次のBump",
-                value=f"<t:{int(next_time.timestamp())}:R>",
-                inline=False,
-            )
+        try:
+            try:
+                result = await record_task
+            except Exception as e:
+                logging.error(f"Bump処理エラー: {e}", exc_info=True)
+                await self._discard_slot(animation_task, first_frame, timer)
+                await timer.send(channel, content="Bumpは検知できたけど、記録中にエラーが起きたみたい…ごめんね！")
+                return
 
-            # お礼メッセージ
-            embed.set_footer(text=random.choice(THANKS_MESSAGES))
-
-            await asyncio.sleep(2)
-            await message.channel.send(embed=embed)
-
-            # --- マイルストーン通知 ---
-            if count in MILESTONES:
-                milestone_embed = discord.Embed(
-                    title="🎉🎉 Congratulation!! 🎉🎉",
-                    description=(
-                        f"{user.mention} ついに累計 **{count}回** のBumpを達成！\n"
-                        f"**{title}** に昇格！"
-                    ),
-                    color=discord.Color.yellow(),
-                )
-                await message.channel.send(embed=milestone_embed)
-
-            # --- 連続記録の自己ベスト更新通知 ---
-            if is_new_record:
-                await message.channel.send(
-                    f"🔥 {user.mention} 連続Bump記録更新！ **{streak}日連続** おめでとう！"
-                )
-
-            # リマインダー設定
-            await db.set_reminder(message.channel.id, next_time)
-            logging.info(f"リマインダー設定: {next_time.strftime('%Y-%m-%d %H:%M:%S UTC')}")
+            if result is None:
+                # 別のプロセスが先に記録済み（デプロイ中の二重起動など）
+                logging.info(f"Bump記録済みのため演出を中止: message {message.id}")
+                await self._discard_slot(animation_task, first_frame, timer)
+                return
 
+            try:
+                await animation_task
+            except Exception as e:
+                # 演出が失敗しても結果のEmbedは出す
+                logging.error(f"スロット演出エラー: {e}", exc_info=True)
+
+            await self._send_results(channel, user, machine, slot, mode, result, next_time, timer)
         except Exception as e:
             logging.error(f"Bump処理エラー: {e}", exc_info=True)
-            await message.channel.send("Bumpは検知できたけど、記録中にエラーが起きたみたい…ごめんね！")
+        finally:
+            await asyncio.gather(reminder_task, return_exceptions=True)
+            self.bumps += 1
+            self.api_calls += timer.api_calls
+            self.mode_counts[mode] += 1
+            metrics.BUMPS.inc(mode)
+            for stage, ms in timer.stages.items():
+                metrics.BUMP_STAGE_SECONDS.observe(ms / 1000, stage)
+            logging.info(f"Bump処理時間 ({user.id}, {mode}): {timer.summary()}")
+
+    async def _record(self, message: discord.Message, user_id: int, guild_id,
+                      timer: _StageTimer) -> dict:
+        result = await ingest.record_bump(
+            user_id, guild_id, message.channel.id, message.id, message.created_at
+        )
+        timer.mark("record")
+        return result
+
+    async def _set_reminder(self, message: discord.Message, next_time: datetime.datetime,
+                            timer: _StageTimer):
+        """リマインダー設定（ReminderCog のスケジューラーにも通知する）"""
+        try:
+            reminder = await db.set_reminder(
+                message.guild.id if message.guild else 0, message.channel.id, next_time
+            )
+            self.bot.dispatch("reminder_set", dict(reminder))
+            timer.mark("reminder")
+            logging.info(f"リマインダー設定: {next_time.strftime('%Y-%m-%d %H:%M:%S UTC')}")
+        except Exception as e:
+            logging.error(f"リマインダー設定エラー: {e}", exc_info=True)
+
+    async def _play_slot(self, channel, user, machine: dict, slot: list, mode: str,
+                         timer: _StageTimer, first_frame: list):
+        """スロットマシン演出(2種類からランダムに選択)。embedモードでは何も送らない。
+        最初のメッセージの送信Futureを first_frame に入れる（演出を止めても送信は止まらないため）
+        """
+        if mode == "embed":
+            return
+        machine_name = machine["name"]
+        first_frame.append(timer.send(channel, content=f"{user.name} さんの{machine_name}！\n`[ ? | ? | ? ]`"))
+        msg = await asyncio.shield(first_frame[0])
+        if mode == "full":
+            await asyncio.sleep(1)
+            await timer.edit(msg, content=f"{user.name} さんの{machine_name}！\n`[ {slot[0]} | ? | ? ]`")
+            await asyncio.sleep(1)
+            await timer.edit(msg, content=f"{user.name} さんの{machine_name}！\n`[ {slot[0]} | {slot[1]} | ? ]`")
+        await asyncio.sleep(1)
+        await timer.edit(msg, content=f"{user.name} さんの{machine_name}！\n`[ {slot[0]} | {slot[1]} | {slot[2]} ]`")
+        timer.mark("slot")
+        await asyncio.sleep(2)
+
+    async def _discard_slot(self, animation_task: asyncio.Task, first_frame: list, timer: _StageTimer):
+        """演出を止め、送ってしまった最初のメッセージを消す（他のプロセスが記録済みのときなど）"""
+        animation_task.cancel()
+        await asyncio.gather(animation_task, return_exceptions=True)
+        if not first_frame:
+            return
+        try:
+            msg = await first_frame[0]
+            timer.api_calls += 1
+            await msg.delete()
+        except Exception as e:
+            logging.warning(f"スロット演出メッセージの削除に失敗: {e}")
+
+    async def _send_results(self, channel, user, machine: dict, slot: list, mode: str,
+                            result: dict, next_time: datetime.datetime, timer: _StageTimer):
+        count = result['bump_count']
+        streak = result['current_streak']
+        max_streak = result['max_streak']
+        weekly = result['weekly_count']
+        is_new_record = result['is_new_streak_record']
+
+        # --- Embed構築 ---
+        title = get_bump_title(count)
+        streak_badge = get_streak_badge(streak)
+
+        description = _judge_slot(slot, machine["jackpot_messages"])
+        if mode == "embed":
+            # スロット用メッセージを出していないので、結果をEmbedに載せる
+            description = f"{machine['name']}\n`[ {slot[0]} | {slot[1]} | {slot[2]} ]`\n{description}"
+
+        embed = discord.Embed(
+            title=f"{title}　{user.display_name}",
+            description=description,
+            color=discord.Color.gold() if slot[0] == slot[1] == slot[2] else discord.Color.blue(),
+        )
+        embed.set_thumbnail(url=user.display_avatar.url)
+
+        # 統計フィールド
+        stats_text = (
+            f"累計: **{count}回**\n"
+            f"今週: **{weekly}回**"
+        )
+        embed.add_field(name="📊 Bump記録", value=stats_text, inline=True)
+
+        # Streak表示
+        streak_text = f"連続: **{streak}日**"
+        if streak_badge:
+            streak_text += f"\n{streak_badge}"
+        if max_streak > 1:
+            streak_text += f"\n自己ベスト: **{max_streak}日**"
+        embed.add_field(name="🔥 連続記録", value=streak_text, inline=True)
+
+        # 次のBump時刻
+        embed.add_field(
+            name="⏰ 次のBump",
+            value=f"<t:{int(next_time.timestamp())}:R>",
+            inline=False,
+        )
+
+        # お礼メッセージ
+        embed.set_footer(text=random.choice(THANKS_MESSAGES))
+
+        await timer.send(channel, embed=embed)
+        timer.mark("embed")
+
+        # --- マイルストーン通知 ---
+        if count in MILESTONES:
+            milestone_embed = discord.Embed(
+                title="🎉🎉 Congratulation!! 🎉🎉",
+                description=(
+                    f"{user.mention} ついに累計 **{count}回** のBumpを達成！\n"
+                    f"**{title}** に昇格！"
+                ),
+                color=discord.Color.yellow(),
+            )
+            await timer.send(channel, embed=milestone_embed)
+
+        # --- 連続記録の自己ベスト更新通知 ---
+        if is_new_record:
+            await timer.send(
+                channel, content=f"🔥 {user.mention} 連続Bump記録更新！ **{streak}日連続** おめでとう！"
+            )
 
 
 async def setup(bot: commands.Bot):
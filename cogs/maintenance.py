@@ -0,0 +1,47 @@
+# cogs/maintenance.py - 定期メンテナンス（日付が変わったら連続記録の途切れた人をリセット）
+
+import datetime
+import logging
+import time
+from discord.ext import commands, tasks
+import database as db
+import profiling
+from config import BOT_TIMEZONE
+
+
+class MaintenanceCog(commands.Cog):
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+
+    async def cog_load(self):
+        self.daily.start()
+
+    async def cog_unload(self):
+        self.daily.cancel()
+
+    @profiling.profiled("maintenance.decay_streaks")
+    async def decay_streaks(self):
+        started = time.perf_counter()
+        try:
+            count = await db.decay_streaks()
+            logging.info(
+                f"連続記録リセット: {count}人 ({(time.perf_counter() - started) * 1000:.0f}ms)"
+            )
+        except Exception as e:
+            logging.error(f"連続記録リセットエラー: {e}", exc_info=True)
+
+    # BOT_TIMEZONE の日付が変わった直後に1回
+    @tasks.loop(time=datetime.time(hour=0, minute=0, second=5, tzinfo=BOT_TIMEZONE))
+    async def daily(self):
+        await self.decay_streaks()
+
+    @daily.before_loop
+    async def before_daily(self):
+        # 停止中に日付をまたいだ分を取り戻すため、起動時にも1回実行する（何度実行しても同じ結果）。
+        # ランキングの読み込み前に実行すると、メモリ上の連続日数がリセット前のまま残るので待つ
+        await db.wait_leaderboards_loaded()
+        await self.decay_streaks()
+
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(MaintenanceCog(bot))
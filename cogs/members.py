@@ -0,0 +1,66 @@
+# cogs/members.py - サーバー在籍状態の追跡（ランキングから退出者を除外するため）
+
+import discord
+from discord.ext import commands
+import logging
+import database as db
+import profiling
+
+
+class MembersCog(commands.Cog):
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+
+    def _resolver(self):
+        ranking = self.bot.get_cog("RankingCog")
+        return ranking.resolver if ranking is not None else None
+
+    async def _sync(self, guild: discord.Guild):
+        """サーバーのメンバー一覧で在籍状態をまとめて合わせる（停止中の参加・退出も反映される）"""
+        try:
+            if not guild.chunked:
+                await guild.chunk()
+            joined, departed = await db.sync_guild_members(guild.id, [m.id for m in guild.members])
+            logging.info(
+                f"在籍状態の同期: {guild.name} メンバー{guild.member_count}人 / "
+                f"参加扱い{joined}人 / 退出扱い{departed}人"
+            )
+        except Exception as e:
+            logging.error(f"在籍状態の同期エラー ({guild.name}): {e}", exc_info=True)
+
+    # 起動・再接続（RESUMEできなかったとき）・障害からの復帰のたびにサーバーごとに呼ばれる
+    @commands.Cog.listener()
+    @profiling.profiled("members.on_guild_available")
+    async def on_guild_available(self, guild: discord.Guild):
+        await self._sync(guild)
+
+    @commands.Cog.listener()
+    @profiling.profiled("members.on_guild_join")
+    async def on_guild_join(self, guild: discord.Guild):
+        await self._sync(guild)
+
+    @commands.Cog.listener()
+    @profiling.profiled("members.on_member_join")
+    async def on_member_join(self, member: discord.Member):
+        try:
+            await db.set_member_active(member.guild.id, member.id, True)
+            resolver = self._resolver()
+            if resolver is not None:
+                resolver.forget(member.guild.id, member.id)
+        except Exception as e:
+            logging.error(f"参加記録エラー: {e}", exc_info=True)
+
+    @commands.Cog.listener()
+    @profiling.profiled("members.on_member_remove")
+    async def on_member_remove(self, member: discord.Member):
+        try:
+            await db.set_member_active(member.guild.id, member.id, False)
+            resolver = self._resolver()
+            if resolver is not None:
+                resolver.mark_missing(member.guild.id, member.id)
+        except Exception as e:
+            logging.error(f"退出記録エラー: {e}", exc_info=True)
+
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(MembersCog(bot))
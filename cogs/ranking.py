@@ -3,73 +3,281 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
+import asyncio
+import datetime
 import logging
+import time
 import database as db
-from config import RANKING_LIMIT, RANKING_EXCLUDED_NAMES, get_bump_title, get_streak_badge
+import profiling
+from config import (
+    RANKING_LIMIT, RANKING_EXCLUDED_NAMES,
+    MEMBER_FETCH_CONCURRENCY, MEMBER_NAME_TTL_SECONDS, MEMBER_MISSING_TTL_SECONDS,
+    get_bump_title, get_streak_badge,
+)
 
-# 退出者・除外対象を差し引いてもTOP{RANKING_LIMIT}を埋められるよう、候補を多めに取得する
-RANKING_CANDIDATE_POOL = RANKING_LIMIT * 5 + len(RANKING_EXCLUDED_NAMES)
+# 退出者はサーバーごとの在籍状態(guild_members)で除外済みなので、表示名での除外対象の分だけ多めに取得する
+RANKING_CANDIDATE_POOL = RANKING_LIMIT + len(RANKING_EXCLUDED_NAMES)
+# 在籍記録が古いなどで解決できない人が続いたときに、次の候補を読みに行く最大ページ数
+RANKING_MAX_PAGES = 5
 
 
-class RankingCog(commands.Cog):
-    def __init__(self, bot: commands.Bot):
-        self.bot = bot
+class MemberResolver:
+    """ランキング表示用に user_id → (表示名, アバターURL) を解決する。
 
-    async def _resolve_ranked_users(self, guild, records, limit):
-        """レコードを解決し、サーバー在籍者だけをlimit件返す。
+    1. ゲートウェイのメンバーキャッシュ(guild.get_member)
+    2. 表示名キャッシュ（MEMBER_NAME_TTL_SECONDS で期限切れ）
+    3. 退出・削除済みの記録（MEMBER_MISSING_TTL_SECONDS の間は再取得しない）
+    4. それでも分からなければ fetch_member を同時 MEMBER_FETCH_CONCURRENCY 件まで並列で呼ぶ
 
-        fetch_userはグローバル検索のため、すでにサーバーを退出した人も
-        引けてしまう。guildが分かる場合はfetch_memberで在籍を確認し、
-        退出者・削除済みアカウントはランキングから除外する。
-        """
-        resolved = []
-        for record in records:
+    fetch_userはグローバル検索のため、すでにサーバーを退出した人も
+    引けてしまう。guildが分かる場合はfetch_memberで在籍を確認する。
+    """
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self._names = {}    # (guild_id, user_id) -> (期限, 表示名, アバターURL)
+        self._missing = {}  # (guild_id, user_id) -> 期限
+        self._semaphore = asyncio.Semaphore(MEMBER_FETCH_CONCURRENCY)
+        self.rest_calls = 0
+        self.cache_hits = 0
+        self.missing_hits = 0
+
+    def stats(self) -> dict:
+        return {
+            'rest_calls': self.rest_calls,
+            'cache_hits': self.cache_hits,
+            'missing_hits': self.missing_hits,
+            'names': len(self._names),
+            'missing': len(self._missing),
+        }
+
+    def forget(self, guild_id, user_id: int):
+        """表示名・退出記録を捨てる（再参加・名前変更時など）"""
+        self._names.pop((guild_id, user_id), None)
+        self._missing.pop((guild_id, user_id), None)
+
+    def mark_missing(self, guild_id, user_id: int):
+        """退出したユーザーとして記録する"""
+        self._names.pop((guild_id, user_id), None)
+        self._missing[(guild_id, user_id)] = time.monotonic() + MEMBER_MISSING_TTL_SECONDS
+
+    def _remember(self, key, user):
+        name = user.display_name
+        if name.startswith("deleted_user_"):
+            # 削除済みアカウント(Discordのプレースホルダー名)は退出扱い
+            self._missing[key] = time.monotonic() + MEMBER_MISSING_TTL_SECONDS
+            return None
+        info = (name, user.display_avatar.url)
+        self._names[key] = (time.monotonic() + MEMBER_NAME_TTL_SECONDS, *info)
+        return info
+
+    def _cached(self, guild, user_id: int):
+        """キャッシュで分かれば ('ok', info) / ('missing', None)、分からなければ (None, None)"""
+        key = (guild.id if guild else None, user_id)
+        now = time.monotonic()
+
+        member = guild.get_member(user_id) if guild is not None else None
+        if member is not None:
+            self.cache_hits += 1
+            info = self._remember(key, member)
+            return ('ok' if info else 'missing'), info
+
+        entry = self._names.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self.cache_hits += 1
+                return 'ok', entry[1:]
+            del self._names[key]
+
+        expires = self._missing.get(key)
+        if expires is not None:
+            if expires > now:
+                self.missing_hits += 1
+                return 'missing', None
+            del self._missing[key]
+
+        return None, None
+
+    async def _fetch(self, guild, user_id: int):
+        key = (guild.id if guild else None, user_id)
+        async with self._semaphore:
+            self.rest_calls += 1
             try:
                 if guild is not None:
-                    # サーバーに今も在籍している人だけを対象にする
-                    user = await guild.fetch_member(record['user_id'])
+                    user = await guild.fetch_member(user_id)
                 else:
-                    user = await self.bot.fetch_user(record['user_id'])
-                name = user.display_name
+                    user = await self.bot.fetch_user(user_id)
             except discord.NotFound:
-                continue  # 退出済み or 存在しないアカウント → 除外
+                # 退出済み or 存在しないアカウント → しばらく再取得しない
+                self._missing[key] = time.monotonic() + MEMBER_MISSING_TTL_SECONDS
+                return None
             except discord.HTTPException:
-                continue  # 取得失敗時も安全側で除外
+                return None  # 一時的な取得失敗はキャッシュせず、今回だけ除外
+        return self._remember(key, user)
+
+    async def resolve_one(self, guild, user_id: int):
+        """1人分を解決して (表示名, アバターURL) を返す。在籍していなければNone"""
+        status, info = self._cached(guild, user_id)
+        if status is not None:
+            return info
+        return await self._fetch(guild, user_id)
+
+    async def resolve(self, guild, records, limit, label: str = ""):
+        """レコードを順位順に解決し、サーバー在籍者だけを (record, 表示名, アバターURL) でlimit件返す"""
+        started = time.perf_counter()
+        rest_before = self.rest_calls
+        resolved = []
+        pending = list(records)
+
+        while pending and len(resolved) < limit:
+            # 足りない件数分だけ先頭から取り出し、キャッシュにない分はまとめて並列取得する
+            window, pending = pending[:limit - len(resolved)], pending[limit - len(resolved):]
+            infos = [self._cached(guild, r['user_id']) for r in window]
+            fetch_idx = [i for i, (status, _) in enumerate(infos) if status is None]
+            fetched = await asyncio.gather(*(self._fetch(guild, window[i]['user_id']) for i in fetch_idx))
+            for i, info in zip(fetch_idx, fetched):
+                infos[i] = ('ok' if info else 'missing', info)
+
+            for record, (_, info) in zip(window, infos):
+                if info is None or info[0] in RANKING_EXCLUDED_NAMES:
+                    continue
+                resolved.append((record, info[0], info[1]))
+                if len(resolved) >= limit:
+                    break
+
+        logging.info(
+            f"メンバー解決{f' {label}' if label else ''}: {len(resolved)}件 / "
+            f"REST {self.rest_calls - rest_before}回 / {(time.perf_counter() - started) * 1000:.0f}ms"
+        )
+        return resolved
 
-            if name in RANKING_EXCLUDED_NAMES or name.startswith("deleted_user_"):
-                continue  # 削除済みアカウント(Discordのプレースホルダー名)を除外
 
-            resolved.append((record, name))
-            if len(resolved) >= limit:
-                break
+def _parse_date(text: str) -> datetime.date:
+    return datetime.datetime.strptime(text.strip(), "%Y-%m-%d").date()
 
-        return resolved
 
-    @app_commands.command(name="bump_top", description="累計Bumpランキング（TOP10）を表示します。")
-    async def bump_top(self, interaction: discord.Interaction):
+def _period_range(period: str, today: datetime.date):
+    """期間の種類から (開始日, 終了日の翌日, 表示名) を返す"""
+    if period == "month":
+        start = today.replace(day=1)
+        end = (start.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+        return start, end, f"{start.year}年{start.month}月"
+    if period == "year":
+        start = today.replace(month=1, day=1)
+        return start, start.replace(year=start.year + 1), f"{start.year}年"
+    if period == "last_week":
+        end = today - datetime.timedelta(days=today.weekday())
+        start = end - datetime.timedelta(days=7)
+        return start, end, f"先週（{start:%m/%d}〜{end - datetime.timedelta(days=1):%m/%d}）"
+    raise ValueError(period)
+
+
+class RankingCog(commands.Cog):
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.resolver = MemberResolver(bot)
+
+    async def _resolve_ranked_users(self, guild, fetch_page, limit, label: str = ""):
+        """fetch_page(件数, offset) で順位順に候補を読み、サーバー在籍者だけをlimit件返す。
+        解決できない人（退出直後・削除済みアカウントなど）で足りなければ次のページを読む。
+        """
+        ranked = []
+        offset = 0
+        for _ in range(RANKING_MAX_PAGES):
+            records = await fetch_page(RANKING_CANDIDATE_POOL, offset)
+            ranked += await self.resolver.resolve(guild, records, limit - len(ranked), label)
+            if len(ranked) >= limit or len(records) < RANKING_CANDIDATE_POOL:
+                break
+            offset += len(records)
+        return ranked
+
+    @app_commands.command(name="bump_top", description="Bumpランキング（TOP10）を表示します。期間も指定できます。")
+    @app_commands.describe(
+        period="集計期間（省略すると累計）",
+        start="期間の開始日 YYYY-MM-DD（指定するとこの日から集計）",
+        end="期間の終了日 YYYY-MM-DD（この日を含む。省略すると今日まで）",
+    )
+    @app_commands.choices(period=[
+        app_commands.Choice(name="累計", value="all"),
+        app_commands.Choice(name="今月", value="month"),
+        app_commands.Choice(name="今年", value="year"),
+        app_commands.Choice(name="先週", value="last_week"),
+    ])
+    @profiling.profiled("/bump_top")
+    async def bump_top(
+        self,
+        interaction: discord.Interaction,
+        period: app_commands.Choice[str] = None,
+        start: str = None,
+        end: str = None,
+    ):
+        # 期間の指定を先に確かめる（日付の書式ミスはその場で本人にだけ返す）
+        today = db.local_today()
+        period_range = None
+        try:
+            if start is not None or end is not None:
+                first = _parse_date(start) if start else today
+                last = _parse_date(end) if end else today
+                if first > last:
+                    first, last = last, first
+                period_range = (first, last + datetime.timedelta(days=1), f"{first:%Y/%m/%d}〜{last:%Y/%m/%d}")
+            elif period is not None and period.value != "all":
+                period_range = _period_range(period.value, today)
+        except ValueError:
+            await interaction.response.send_message(
+                "日付は `2025-01-31` のように YYYY-MM-DD で指定してね！", ephemeral=True
+            )
+            return
+
         try:
             await interaction.response.defer()
-            top_users = await db.get_top_users(RANKING_CANDIDATE_POOL)
-            server_total = await db.get_total_bumps()
+            guild_id = interaction.guild_id
+            if period_range is None:
+                async def fetch_page(limit, offset):
+                    rows = db.get_cached_top_users(guild_id, limit, offset)
+                    if rows is None:
+                        rows = await db.get_top_users(guild_id, limit, offset)
+                    return rows
+
+                if guild_id is None:
+                    server_total = await db.get_total_bumps()
+                else:
+                    server_total = await db.get_guild_total_bumps(guild_id)
+                heading = "🏆 BUMPランキングボード TOP10 🏆"
+                total_label = "サーバー合計Bump"
+            else:
+                period_start, period_end, label = period_range
+                async def fetch_page(limit, offset):
+                    return await db.get_period_top_users(guild_id, period_start, period_end, limit, offset)
 
-            ranked = await self._resolve_ranked_users(interaction.guild, top_users, RANKING_LIMIT)
+                server_total = await db.get_period_total_bumps(period_start, period_end, guild_id)
+                heading = f"🏆 BUMPランキング TOP10【{label}】 🏆"
+                total_label = "期間中の合計Bump"
+
+            ranked = await self._resolve_ranked_users(
+                interaction.guild, fetch_page, RANKING_LIMIT, "/bump_top"
+            )
 
             if not ranked:
-                await interaction.followup.send("まだ誰もBumpしていません。君が最初のヒーローになろう！")
+                if period_range is None:
+                    await interaction.followup.send("まだ誰もBumpしていません。君が最初のヒーローになろう！")
+                else:
+                    await interaction.followup.send(f"【{period_range[2]}】にBumpした人はいません。")
                 return
 
             embed = discord.Embed(
-                title="🏆 BUMPランキングボード TOP10 🏆",
-                description=f"サーバー合計Bump: **{server_total}** 回！",
+                title=heading,
+                description=f"{total_label}: **{server_total}** 回！",
                 color=discord.Color.gold(),
             )
 
             rank_emojis = ["🥇", "🥈", "🥉"] + [f"**{i}位**" for i in range(4, RANKING_LIMIT + 1)]
 
-            for i, (record, name) in enumerate(ranked):
+            for i, (record, name, _avatar) in enumerate(ranked):
                 bumps = record['bump_count']
                 streak = record.get('current_streak', 0)
-                title = get_bump_title(bumps)
+                # 称号は累計回数に対するものなので、期間ランキングでは付けない
+                title = get_bump_title(bumps) if period_range is None else ""
 
                 value = f"> **{bumps}** 回"
                 if streak >= 3:
@@ -77,7 +285,7 @@ class RankingCog(commands.Cog):
                     value += f"　{badge}({streak}日連続)"
 
                 embed.add_field(
-                    name=f"{rank_emojis[i]} {name}　{title}",
+                    name=f"{rank_emojis[i]} {name}　{title}".rstrip("　"),
                     value=value,
                     inline=False,
                 )
@@ -92,12 +300,23 @@ class RankingCog(commands.Cog):
             await _safe_error_reply(interaction, "ランキングの表示中にエラーが起きました。")
 
     @app_commands.command(name="bump_weekly", description="今週のBumpランキングを表示します。")
+    @profiling.profiled("/bump_weekly")
     async def bump_weekly(self, interaction: discord.Interaction):
         try:
             await interaction.response.defer()
-            weekly = await db.get_weekly_top_users(RANKING_CANDIDATE_POOL)
+            guild_id = interaction.guild_id
+
+            async def fetch_page(limit, offset):
+                rows = db.get_cached_weekly_top_users(guild_id, limit, offset)
+                if rows is None:
+                    rows = await db.get_weekly_top_users(guild_id, limit, offset)
+                return rows
 
-            ranked = await self._resolve_ranked_users(interaction.guild, weekly, RANKING_LIMIT)
+            weekly_total = await db.get_weekly_total_bumps(guild_id)
+
+            ranked = await self._resolve_ranked_users(
+                interaction.guild, fetch_page, RANKING_LIMIT, "/bump_weekly"
+            )
 
             if not ranked:
                 await interaction.followup.send("今週はまだ誰もBumpしていません！")
@@ -105,13 +324,13 @@ class RankingCog(commands.Cog):
 
             embed = discord.Embed(
                 title="📅 今週のBUMPランキング 📅",
-                description="月曜日〜日曜日の集計",
+                description=f"月曜日〜日曜日の集計（今週の合計: **{weekly_total}** 回）",
                 color=discord.Color.green(),
             )
 
             rank_emojis = ["🥇", "🥈", "🥉"] + [f"**{i}位**" for i in range(4, RANKING_LIMIT + 1)]
 
-            for i, (record, name) in enumerate(ranked):
+            for i, (record, name, _avatar) in enumerate(ranked):
                 bumps = record['bump_count']
                 streak = record.get('current_streak', 0)
 
@@ -125,14 +344,10 @@ class RankingCog(commands.Cog):
                     inline=False,
                 )
 
-            # 1位のユーザーをMVP表示
-            try:
-                mvp_id = ranked[0][0]['user_id']
-                mvp = await self.bot.fetch_user(mvp_id)
-                embed.set_thumbnail(url=mvp.display_avatar.url)
-                embed.set_footer(text=f"🌟 今週のMVP: {ranked[0][1]}")
-            except Exception:
-                pass
+            # 1位のユーザーをMVP表示（解決済みのアバターを使うので追加のRESTは不要）
+            _, mvp_name, mvp_avatar = ranked[0]
+            embed.set_thumbnail(url=mvp_avatar)
+            embed.set_footer(text=f"🌟 今週のMVP: {mvp_name}")
 
             await interaction.followup.send(embed=embed)
 
@@ -143,6 +358,7 @@ class RankingCog(commands.Cog):
             await _safe_error_reply(interaction, "週間ランキングの表示中にエラーが起きました。")
 
     @app_commands.command(name="bump_user", description="指定したユーザーの詳細Bump統計を表示します。")
+    @profiling.profiled("/bump_user")
     async def bump_user(self, interaction: discord.Interaction, user: discord.User):
         try:
             await interaction.response.defer()
@@ -163,6 +379,10 @@ class RankingCog(commands.Cog):
             embed.add_field(name="現在の連続", value=f"**{stats['current_streak']}** 日 {badge}", inline=True)
             embed.add_field(name="最長連続", value=f"**{stats['max_streak']}** 日", inline=True)
 
+            rank = db.get_user_rank(user.id, interaction.guild_id)
+            if rank is not None:
+                embed.add_field(name="順位", value=f"**{rank[0]}** 位 / {rank[1]}人中", inline=True)
+
             await interaction.followup.send(embed=embed)
 
         except discord.NotFound:
@@ -172,10 +392,11 @@ class RankingCog(commands.Cog):
             await _safe_error_reply(interaction, "統計の表示中にエラーが起きました。")
 
     @app_commands.command(name="bump_time", description="次のBumpリマインド時刻を表示します。")
+    @profiling.profiled("/bump_time")
     async def bump_time(self, interaction: discord.Interaction):
         try:
             await interaction.response.defer()
-            reminder = await db.get_reminder()
+            reminder = await db.get_reminder(interaction.guild_id or 0)
             if reminder:
                 remind_at = reminder['remind_at']
                 await interaction.followup.send(
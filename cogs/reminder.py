@@ -4,104 +4,359 @@ import discord
 from discord.ext import commands, tasks
 import datetime
 import asyncio
+import heapq
+import itertools
 import logging
 import database as db
+import lifecycle
+import outbound
+import profiling
+
+# 1回目のリマインドから2回目（経過時間のお知らせ）までの間隔
+SECOND_REMINDER_DELAY = datetime.timedelta(minutes=30)
+
+
+# 1回の確保で取り出すリマインダーの上限（超えた分はすぐ次の確保で取る）
+CLAIM_BATCH_SIZE = 100
+
+# 送信に失敗したリマインダーを送り直すまでの間隔と、あきらめるまでの回数
+RETRY_DELAY = datetime.timedelta(minutes=1)
+MAX_SEND_ATTEMPTS = 3
+
+# カウントアップ表示を続ける時間
+COUNTDOWN_DURATION = datetime.timedelta(hours=2)
+
+
+class CountdownManager:
+    """2回目のリマインダーの「経過時間」表示を1つのティッカーでまとめて更新する。
+
+    更新中のメッセージは countdowns テーブルに残すので、再起動後も続きから更新する。
+    各メッセージは message_id から決まる秒だけずらして毎分1回編集する。編集は送信キュー
+    (outbound)に最低優先度で預けるので、Bump結果の送信を邪魔せずチャンネルごとの
+    レート制限内に収まる。表示が変わらない回は編集しない。
+    """
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self._entries = {}  # message_id -> entry dict
+        self._pending = set()  # 送信キューに預けた編集の完了待ち
+        self.edits = 0
+        self.skipped = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {'active': len(self._entries), 'edits': self.edits, 'skipped': self.skipped}
+
+    async def add(self, message: discord.Message, start_at: datetime.datetime):
+        guild_id = message.guild.id if message.guild else 0
+        await db.add_countdown(guild_id, message.channel.id, message.id, start_at)
+        self._track(message, start_at, message.content)
+
+    async def resume(self):
+        """再起動前から続いているカウントアップを読み込み直す"""
+        rows = await db.get_countdowns()
+        for row in rows:
+            channel = self.bot.get_channel(row['channel_id'])
+            if channel is None:
+                await db.remove_countdown(row['message_id'])
+                continue
+            self._track(channel.get_partial_message(row['message_id']), row['start_at'], None)
+        if rows:
+            logging.info(f"カウントアップ再開: {len(self._entries)}件")
+
+    def _track(self, message, start_at: datetime.datetime, content):
+        # message_id から決まる 0〜59秒 のずらしで、同時に始まった分も編集時刻を分散させる
+        phase = message.id % 60
+        now_utc = datetime.datetime.now(datetime.timezone.utc)
+        self._entries[message.id] = {
+            'message': message,
+            'channel_id': message.channel.id,
+            'start_at': start_at,
+            'content': content,
+            'next_at': now_utc + datetime.timedelta(seconds=30 + phase),
+        }
+        if not self.ticker.is_running() and lifecycle.get_lifecycle().accepting:
+            self.ticker.start()
+
+    async def _stop(self, message_id: int, reason: str):
+        self._entries.pop(message_id, None)
+        logging.info(f"カウントアップ: {reason}で停止")
+        try:
+            await db.remove_countdown(message_id)
+        except Exception as e:
+            logging.error(f"カウントアップ削除エラー: {e}")
+
+    @tasks.loop(seconds=1)
+    @profiling.profiled("countdown.ticker")
+    async def ticker(self):
+        if not self._entries:
+            return
+
+        now_utc = datetime.datetime.now(datetime.timezone.utc)
+        for message_id, entry in list(self._entries.items()):
+            if entry['next_at'] > now_utc:
+                continue
+
+            elapsed = now_utc - entry['start_at']
+            if elapsed >= COUNTDOWN_DURATION:
+                await self._stop(message_id, "2時間経過")
+                continue
+
+            entry['next_at'] += datetime.timedelta(minutes=1)
+            content = _second_reminder_text(elapsed)
+            if content == entry['content']:
+                self.skipped += 1
+                continue
+
+            entry['content'] = content
+            task = asyncio.create_task(self._edit(message_id, entry['message'], content))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    async def _edit(self, message_id: int, message, content: str):
+        try:
+            with lifecycle.get_lifecycle().track("countdown"):
+                await outbound.edit(message, outbound.PRIORITY_COUNTDOWN, content=content)
+            self.edits += 1
+        except discord.NotFound:
+            await self._stop(message_id, "メッセージ削除")
+        except discord.Forbidden:
+            await self._stop(message_id, "権限不足")
+        except Exception as e:
+            logging.error(f"カウントアップ更新エラー: {e}")
+
+    @ticker.error
+    async def on_ticker_error(self, error):
+        logging.error(f"カウントアップティッカーエラー: {error}", exc_info=error)
 
 
 class ReminderCog(commands.Cog):
+    """リマインダーを期限ちょうどに送るスケジューラー。
+
+    1分ごとにDBを見に行く代わりに、期限順のヒープを持って一番近い期限に
+    loop.call_at でタイマーを1つだけ掛ける。タイマーが鳴ったら期限の来た分を
+    db.claim_due_reminders でまとめて確保し、並行して送る。確保はDB上で
+    status更新/行削除と同時に行うので、再起動や複数プロセスでも二重送信しない。
+    送信に失敗したら db.release_reminder で確保前の段階に戻し、少し待って送り直す。
+    サーバー・チャンネルごとに何件でも同時に予約できる。
+    """
+
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self._heap = []       # (期限, 連番, reminder_id)
+        self._scheduled = {}  # reminder_id -> (期限, guild_id)。ヒープ内の古い要素の判定にも使う
+        self._seq = itertools.count()
+        self._attempts = {}   # reminder_id -> 送信に失敗した回数
+        self._timer = None
+        self._claiming = False
+        self._tasks = set()
+        self.countdowns = CountdownManager(bot)
 
     async def cog_load(self):
-        """Cog読み込み時にタスクを開始"""
-        if not self.reminder_task.is_running():
-            self.reminder_task.start()
-            logging.info("リマインダータスク開始")
+        """Cog読み込み時に未送信のリマインダーとカウントアップを読み込む"""
+        self._spawn(self._load_pending())
 
     async def cog_unload(self):
-        """Cog終了時にタスクを停止"""
-        self.reminder_task.cancel()
+        """Cog終了時にタイマーを止める"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self.countdowns.ticker.cancel()
+        for task in list(self._tasks):
+            task.cancel()
 
-    @tasks.loop(minutes=1)
-    async def reminder_task(self):
-        try:
-            reminder = await db.get_reminder()
-            if not reminder:
-                return
-
-            now_utc = datetime.datetime.now(datetime.timezone.utc)
-            remind_at = reminder['remind_at']
-            channel_id = reminder['channel_id']
-            status = reminder.get('status', 'waiting')
-
-            if status == 'waiting' and now_utc >= remind_at:
-                try:
-                    channel = self.bot.get_channel(channel_id) or await self.bot.fetch_channel(channel_id)
-                    if channel:
-                        await channel.send("⏰ そろそろBumpの時間だよ！`/bump` をお願いします！")
-                        logging.info(f"1st リマインダー送信: ch={channel_id}")
-                        await db.update_reminder_status(channel_id, 'notified_1st')
-                except Exception as e:
-                    logging.error(f"1st リマインダー送信失敗: {e}")
-
-            elif status == 'notified_1st' and now_utc >= (remind_at + datetime.timedelta(minutes=30)):
-                try:
-                    channel = self.bot.get_channel(channel_id) or await self.bot.fetch_channel(channel_id)
-                    if channel:
-                        elapsed = now_utc - remind_at
-                        elapsed_str = _format_elapsed(elapsed)
-
-                        text = (
-                            f"前回のBumpから **{elapsed_str}** が経過しました。\n"
-                            "サーバーの宣伝のため、お時間のある時にBumpをお願いいたします。🙇‍♂️"
-                        )
-                        sent = await channel.send(text)
-                        logging.info(f"2nd リマインダー送信: ch={channel_id}")
-
-                        # バックグラウンドでカウントアップ更新
-                        asyncio.create_task(self._countdown_loop(sent, remind_at))
-                        await db.clear_reminder()
-                except Exception as e:
-                    logging.error(f"2nd リマインダー送信失敗: {e}")
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
 
+    async def _load_pending(self):
+        await self.bot.wait_until_ready()
+        try:
+            reminders = await db.get_pending_reminders()
+            for reminder in reminders:
+                self.schedule(dict(reminder))
+            logging.info(f"リマインダー読み込み: {len(reminders)}件")
         except Exception as e:
-            logging.error(f"リマインダータスクエラー: {e}", exc_info=True)
+            logging.error(f"リマインダー読み込みエラー: {e}", exc_info=True)
+        try:
+            await self.countdowns.resume()
+        except Exception as e:
+            logging.error(f"カウントアップ読み込みエラー: {e}", exc_info=True)
 
-    @reminder_task.before_loop
-    async def before_reminder_task(self):
-        await self.bot.wait_until_ready()
+    @commands.Cog.listener()
+    @profiling.profiled("reminder.on_reminder_set")
+    async def on_reminder_set(self, reminder: dict):
+        """BumpCog が db.set_reminder した直後に呼ばれる（bot.dispatch('reminder_set', ...)）"""
+        # set_reminder は同じサーバーの既存リマインダーを置き換える
+        for reminder_id, (_, guild_id) in list(self._scheduled.items()):
+            if guild_id == reminder['guild_id']:
+                del self._scheduled[reminder_id]
+        self.schedule(reminder)
+        logging.info(
+            f"リマインダー予約: guild={reminder['guild_id']} "
+            f"{reminder['remind_at'].strftime('%Y-%m-%d %H:%M:%S UTC')}"
+        )
+
+    @commands.Cog.listener()
+    async def on_drain(self):
+        """終了処理の開始時に呼ばれる（bot.dispatch('drain')）。タイマーとティッカーを止める。
+        送信中のリマインダーと送信キューに預けた編集は lifecycle で待たれる
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self.countdowns.ticker.stop()
+
+    # --- タイマー ---
+
+    def schedule(self, reminder: dict, due: datetime.datetime = None):
+        """reminder の status に応じて次に送る時刻を予約する（due を渡すとその時刻）"""
+        if due is None:
+            due = reminder['remind_at']
+            if reminder['status'] == 'notified_1st':
+                due += SECOND_REMINDER_DELAY
+        self._scheduled[reminder['id']] = (due, reminder['guild_id'])
+        heapq.heappush(self._heap, (due, next(self._seq), reminder['id']))
+        self._arm()
+
+    def _is_current(self, due, reminder_id) -> bool:
+        entry = self._scheduled.get(reminder_id)
+        return entry is not None and entry[0] == due
+
+    def _arm(self):
+        """一番近い期限にタイマーを掛け直す"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        # 置き換え・送信済みの古い要素を捨てる
+        while self._heap and not self._is_current(self._heap[0][0], self._heap[0][2]):
+            heapq.heappop(self._heap)
+        # 終了処理中は新しく送らない（未送信のものはDBに残り、次の起動で読み込まれる）
+        if not self._heap or self._claiming or not lifecycle.get_lifecycle().accepting:
+            return
+
+        loop = asyncio.get_running_loop()
+        now_utc = datetime.datetime.now(datetime.timezone.utc)
+        delay = max(0.0, (self._heap[0][0] - now_utc).total_seconds())
+        self._timer = loop.call_at(loop.time() + delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        now_utc = datetime.datetime.now(datetime.timezone.utc)
+        fired = {}  # reminder_id -> guild_id（確保に失敗したら予約し直す分）
+        while self._heap and self._heap[0][0] <= now_utc:
+            due, _, reminder_id = heapq.heappop(self._heap)
+            if self._is_current(due, reminder_id):
+                fired[reminder_id] = self._scheduled.pop(reminder_id)[1]
+        self._claiming = True
+        self._spawn(self._dispatch_due(fired))
 
-    async def _countdown_loop(self, message: discord.Message, start_time: datetime.datetime):
-        """メッセージをリアルタイムで更新してカウントアップを表示"""
+    # --- 送信 ---
+
+    @profiling.profiled("reminder.dispatch_due")
+    async def _dispatch_due(self, fired: dict = None):
+        """期限の来たリマインダーを確保して並行に送る。
+        確保に失敗したら、タイマーで取り出した分（fired）を RETRY_DELAY 後に予約し直す
+        """
         try:
-            while True:
-                await asyncio.sleep(60)
-                try:
-                    now_utc = datetime.datetime.now(datetime.timezone.utc)
-                    elapsed = now_utc - start_time
-
-                    # 2時間経過で停止
-                    if elapsed.total_seconds() >= 7200:
-                        logging.info("カウントアップ: 2時間経過で停止")
+            # 確保したものは送り切らないと次の起動で送られないので、終了処理でも待ってもらう
+            with lifecycle.get_lifecycle().track("reminder"):
+                while True:
+                    claimed = await db.claim_due_reminders(SECOND_REMINDER_DELAY, CLAIM_BATCH_SIZE)
+                    if claimed:
+                        await asyncio.gather(*(self._deliver(dict(r)) for r in claimed))
+                    if len(claimed) < CLAIM_BATCH_SIZE or not lifecycle.get_lifecycle().accepting:
                         break
+        except Exception as e:
+            logging.error(f"リマインダー確保エラー: {e}", exc_info=True)
+            retry_at = datetime.datetime.now(datetime.timezone.utc) + RETRY_DELAY
+            for reminder_id, guild_id in (fired or {}).items():
+                # 確保中に置き換えられた・予約し直されたものはそちらを優先する
+                if reminder_id not in self._scheduled:
+                    self._scheduled[reminder_id] = (retry_at, guild_id)
+                    heapq.heappush(self._heap, (retry_at, next(self._seq), reminder_id))
+        finally:
+            self._claiming = False
+            self._arm()
+
+    async def _deliver(self, reminder: dict):
+        try:
+            if reminder['status'] == 'waiting':
+                await self._send_first(reminder)
+                # 2回目を予約
+                self.schedule({**reminder, 'status': 'notified_1st'})
+            else:
+                await self._send_second(reminder)
+            self._attempts.pop(reminder['id'], None)
+        except (discord.NotFound, discord.Forbidden) as e:
+            # チャンネルが消えた・権限がない: 送り直しても届かないので送信済みとして扱う
+            self._attempts.pop(reminder['id'], None)
+            logging.warning(f"リマインダー送信不可（ch={reminder['channel_id']}）: {e}")
+        except Exception as e:
+            logging.error(f"リマインダー送信エラー: {e}", exc_info=True)
+            await self._release(reminder)
+
+    async def _release(self, reminder: dict):
+        """送信に失敗したリマインダーをDB上で確保前に戻し、RETRY_DELAY 後に送り直す"""
+        attempts = self._attempts.pop(reminder['id'], 0) + 1
+        if attempts >= MAX_SEND_ATTEMPTS:
+            logging.error(f"リマインダー送信をあきらめました（{attempts}回失敗）: ch={reminder['channel_id']}")
+            return
+        try:
+            released = await db.release_reminder(reminder)
+        except Exception as e:
+            logging.error(f"リマインダーの戻しエラー: {e}", exc_info=True)
+            return
+        if released is None:
+            # 確保後に新しいリマインダーが登録された
+            return
+        self._attempts[reminder['id']] = attempts
+        self.schedule(dict(released), datetime.datetime.now(datetime.timezone.utc) + RETRY_DELAY)
+
+    async def _get_channel(self, channel_id: int):
+        return self.bot.get_channel(channel_id) or await self.bot.fetch_channel(channel_id)
+
+    # 送信に失敗したら例外をそのまま上げる（_deliver が確保を戻して送り直す）
+    async def _send_first(self, reminder: dict):
+        channel_id = reminder['channel_id']
+        channel = await self._get_channel(channel_id)
+        if channel:
+            await outbound.send(
+                channel, outbound.PRIORITY_REMINDER,
+                content="⏰ そろそろBumpの時間だよ！`/bump` をお願いします！",
+            )
+            logging.info(f"1st リマインダー送信: ch={channel_id}")
+
+    async def _send_second(self, reminder: dict):
+        channel_id = reminder['channel_id']
+        remind_at = reminder['remind_at']
+        channel = await self._get_channel(channel_id)
+        if not channel:
+            return
+        now_utc = datetime.datetime.now(datetime.timezone.utc)
+        sent = await outbound.send(
+            channel, outbound.PRIORITY_REMINDER,
+            content=_second_reminder_text(now_utc - remind_at),
+        )
+        logging.info(f"2nd リマインダー送信: ch={channel_id}")
 
-                    elapsed_str = _format_elapsed(elapsed)
-                    content = (
-                        f"前回のBumpから **{elapsed_str}** が経過しました。\n"
-                        "サーバーの宣伝のため、お時間のある時にBumpをお願いいたします。🙇‍♂️"
-                    )
-                    await message.edit(content=content)
-                except discord.NotFound:
-                    logging.info("カウントアップ: メッセージ削除で停止")
-                    break
-                except discord.Forbidden:
-                    logging.warning("カウントアップ: 権限不足で停止")
-                    break
-                except Exception as e:
-                    logging.error(f"カウントアップ更新エラー: {e}")
-                    break
+        # 以降はカウントアップ管理に任せて毎分更新（送信済みなので失敗しても送り直さない）
+        try:
+            await self.countdowns.add(sent, remind_at)
         except Exception as e:
-            logging.error(f"カウントアップループエラー: {e}")
+            logging.error(f"カウントアップ登録失敗: {e}")
+
+
+def _second_reminder_text(elapsed: datetime.timedelta) -> str:
+    return (
+        f"前回のBumpから **{_format_elapsed(elapsed)}** が経過しました。\n"
+        "サーバーの宣伝のため、お時間のある時にBumpをお願いいたします。🙇‍♂️"
+    )
 
 
 def _format_elapsed(td: datetime.timedelta) -> str:
@@ -1,6 +1,7 @@
 # config.py - 設定値を一箇所にまとめる
 
 import os
+from zoneinfo import ZoneInfo
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,16 +11,57 @@ TOKEN = os.environ.get('DISCORD_BOT_TOKEN')
 DATABASE_URL = os.environ.get('DATABASE_URL')
 PORT = int(os.environ.get('PORT', 10000))
 
+# DB接続プール。起動時に DB_POOL_WARM_SIZE 本まで接続してから受け付けを始める
+DB_POOL_WARM_SIZE = int(os.environ.get('DB_POOL_WARM_SIZE', 3))
+DB_POOL_MAX_SIZE = 10
+
+# 日付・週の区切り（streak・週間ランキング・期間ランキング）に使うタイムゾーン
+BOT_TIMEZONE_NAME = os.environ.get('BOT_TIMEZONE', 'Asia/Tokyo')
+BOT_TIMEZONE = ZoneInfo(BOT_TIMEZONE_NAME)
+
 # --- DISBOARD ---
 DISBOARD_BOT_ID = 302050872383242240
 BUMP_COOLDOWN_HOURS = 2
 
+# --- Bump書き込みキュー ---
+# Bumpはユーザーごとにまとめて一括で書き込む。件数か経過時間のどちらかで書き出す
+BUMP_FLUSH_MAX_BATCH = 100        # この件数たまったら即書き込み
+BUMP_FLUSH_INTERVAL_SECONDS = 0.5  # 最初の1件からこの秒数で書き込み
+BUMP_DEDUP_WINDOW = 10000          # 直近に処理したDISBOARDメッセージIDを覚えておく件数
+
+# --- 過去ログ取り込み (/scan_history) ---
+BACKFILL_CONCURRENCY = 3                 # 同時に読むチャンネル数
+BACKFILL_CHECKPOINT_EVERY = 500          # この件数読むごとに再開位置を保存
+BACKFILL_PROGRESS_INTERVAL_SECONDS = 5   # 進捗メッセージの更新間隔
+
+# --- ユーザー状態キャッシュ ---
+USER_CACHE_SIZE = 5000  # LRUで保持するユーザー数の上限
+
+# --- 終了処理 ---
+# SIGTERM から処理中のBump・編集・書き込みを待つ最大秒数（ホスティング側の猶予より短くする）
+SHUTDOWN_DRAIN_TIMEOUT_SECONDS = 20
+
+# --- DBクエリの計測 ---
+SLOW_QUERY_MS = 200                     # これ以上かかったクエリをログに残し、実行計画を取る
+SLOW_QUERY_PLAN_INTERVAL_SECONDS = 600  # 同じクエリの実行計画はこの間隔より頻繁に取らない
+QUERY_STATS_WINDOW = 1000               # パーセンタイル計算に使う直近の回数
+
+# --- 処理ごとの計測 (profiling.py) ---
+PROFILE_SLOW_MS = 3000        # これ以上かかったコマンド・リスナー・定期タスクを内訳付きでログに残す
+PROFILE_BUMP_SLOW_MS = 10000  # Bump処理はスロット演出の待ちを含むので別の基準にする
+PROFILE_MAX_SECONDS = 60      # /profile で計測できる最大秒数
+
 # --- ランキング ---
 RANKING_LIMIT = 10  # v2では5だったのを10に拡張
 
 # ランキングから除外する表示名(削除済みアカウントは自動で除外されます)
 RANKING_EXCLUDED_NAMES = ["もちづき"]
 
+# ランキング表示時のメンバー解決
+MEMBER_FETCH_CONCURRENCY = 5        # 同時に投げるREST(fetch_member)の上限
+MEMBER_NAME_TTL_SECONDS = 600       # 表示名キャッシュの有効期限
+MEMBER_MISSING_TTL_SECONDS = 21600  # 退出・削除済みユーザーを再取得しない期間
+
 # --- スロットマシン(2種類からランダム) ---
 SLOT_MACHINES = [
     {
@@ -48,6 +90,12 @@ SLOT_MACHINES = [
     },
 ]
 
+# --- スロット演出モード ---
+# full: 1回送信+3回編集で1リールずつ表示 / single: 1回送信+1回編集で結果表示
+# embed: スロット用メッセージを出さず、結果をBump記録のEmbedに載せる
+# サーバーごとに /slot_mode で変更可。チャンネルのレート制限が残り少ないときは自動で軽いモードに落とす
+SLOT_MODE_DEFAULT = "full"
+
 # --- 称号 (bump_count → 称号) ---
 BUMP_TITLES = [
     (1000, "BUMPの創造主♾️"),
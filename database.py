@@ -1,13 +1,26 @@
 # database.py - v3: 連続記録(Streak)・週間MVP対応
 
 import os
+import asyncio
 import asyncpg
+import contextlib
 import datetime
 import ssl
 import logging
-from config import DATABASE_URL
+import re
+import time
+from config import DATABASE_URL, DB_POOL_WARM_SIZE, DB_POOL_MAX_SIZE, USER_CACHE_SIZE, BOT_TIMEZONE, BOT_TIMEZONE_NAME, SLOW_QUERY_MS
+from user_cache import UserStateCache
+import leaderboard
+import metrics
+import migrations
+import profiling
+import querystats
 
 _global_pool = None
+_user_cache = UserStateCache(USER_CACHE_SIZE)
+# load_leaderboards が1回終わったら立てる（メモリ上のランキングを書き換える処理はこれを待つ）
+_leaderboards_loaded = asyncio.Event()
 
 
 async def get_pool():
@@ -29,8 +42,8 @@ async def get_pool():
             ssl=ctx,
             statement_cache_size=0,
             timeout=30,
-            min_size=1,
-            max_size=10,
+            min_size=min(DB_POOL_WARM_SIZE, DB_POOL_MAX_SIZE),
+            max_size=DB_POOL_MAX_SIZE,
             command_timeout=60,
         )
         logging.info("✅ グローバルDB接続プール作成完了")
@@ -40,13 +53,214 @@ async def get_pool():
         raise
 
 
-async def close_pool():
-    """接続プールを閉じる"""
+class TimedConnection:
+    """接続のラッパー。fetch / execute などの実行時間をクエリ名ごとに記録する。
+    SLOW_QUERY_MS を超えたらログに残し、実行計画をバックグラウンドで取得する。
+    transaction() など記録しないメソッドはそのまま元の接続に渡す。
+    """
+
+    def __init__(self, conn, name: str):
+        self._conn = conn
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._conn, attr)
+
+    async def _timed(self, method: str, sql, args, kwargs):
+        started = time.perf_counter()
+        error = False
+        try:
+            return await getattr(self._conn, method)(sql, *args, **kwargs)
+        except Exception:
+            error = True
+            raise
+        finally:
+            ms = (time.perf_counter() - started) * 1000
+            querystats.get_stats().record(self._name, ms, error)
+            profiling.add_db(ms / 1000)
+            metrics.DB_QUERY_SECONDS.observe(ms / 1000, self._name)
+            if ms >= SLOW_QUERY_MS and not error:
+                _on_slow_query(self._name, method, sql, args, ms)
+
+    async def fetch(self, sql, *args, **kwargs):
+        return await self._timed('fetch', sql, args, kwargs)
+
+    async def fetchrow(self, sql, *args, **kwargs):
+        return await self._timed('fetchrow', sql, args, kwargs)
+
+    async def fetchval(self, sql, *args, **kwargs):
+        return await self._timed('fetchval', sql, args, kwargs)
+
+    async def execute(self, sql, *args, **kwargs):
+        return await self._timed('execute', sql, args, kwargs)
+
+    async def executemany(self, sql, *args, **kwargs):
+        return await self._timed('executemany', sql, args, kwargs)
+
+    async def copy_records_to_table(self, table, **kwargs):
+        return await self._timed('copy_records_to_table', table, (), kwargs)
+
+
+@contextlib.asynccontextmanager
+async def acquire(name: str):
+    """プールから接続を借りる。name はクエリ統計・スロークエリログでの名前。
+    DBに触る関数はすべてここを通す（借りるまでの待ち時間と各クエリの時間を記録する）。
+    """
+    pool = await get_pool()
+    started = time.perf_counter()
+    async with pool.acquire() as conn:
+        wait = time.perf_counter() - started
+        metrics.DB_ACQUIRE_WAIT_SECONDS.observe(wait)
+        querystats.get_stats().record_wait(name, wait * 1000)
+        profiling.add_db(wait)
+        yield TimedConnection(conn, name)
+
+
+# 実行計画の取得中のタスク（ガベージコレクション対策で参照を持っておく）
+_plan_tasks = set()
+
+
+def _on_slow_query(name: str, method: str, sql, args, ms: float):
+    logging.warning(f"遅いクエリ: {name} {ms:.0f}ms")
+    # EXPLAIN できるSQLだけ実行計画を取る（COPY・DDL・DOブロックなどは対象外）
+    if method in ('copy_records_to_table', 'executemany') or not _is_explainable(sql):
+        return
+    if not querystats.get_stats().mark_slow(name, sql, args):
+        return
+    task = asyncio.create_task(capture_plan(name, sql, args))
+    _plan_tasks.add(task)
+    task.add_done_callback(_plan_tasks.discard)
+
+
+def _is_explainable(sql) -> bool:
+    if not isinstance(sql, str):
+        return False
+    head = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+    return head in ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+
+# EXPLAIN ANALYZE で実際に実行してよいSQLの形（許可リスト）。
+# SELECT / WITH で始まり、書き込み・ロックのキーワードを含まず、呼んでいる関数がすべて
+# 副作用のない組み込み関数のものだけ。それ以外（pg_advisory_lock などを SELECT で呼ぶものも）は
+# 実行せずに推定の計画だけを取る
+_READ_ONLY_HEADS = ('SELECT', 'WITH')
+_WRITE_KEYWORDS = re.compile(
+    r'\b(INSERT|UPDATE|DELETE|MERGE|INTO|LOCK|SHARE|NOWAIT|COPY|TRUNCATE|CALL|DO)\b', re.IGNORECASE
+)
+_CALL = re.compile(r'\b([A-Za-z_][A-Za-z0-9_.]*)\s*\(')
+_READ_ONLY_CALLS = frozenset({
+    # 「キーワード (」の形（関数呼び出しではない）
+    'select', 'from', 'where', 'and', 'or', 'not', 'in', 'exists', 'as', 'on', 'join',
+    'over', 'any', 'all', 'values', 'by', 'when', 'then', 'else', 'case', 'distinct',
+    # 副作用のない組み込み関数
+    'count', 'sum', 'min', 'max', 'avg', 'coalesce', 'nullif', 'greatest', 'least',
+    'array_agg', 'string_agg', 'row_number', 'rank', 'dense_rank', 'lag', 'lead',
+    'date_trunc', 'generate_series', 'unnest', 'to_char', 'to_regclass', 'extract',
+    'lower', 'upper', 'length', 'abs', 'round', 'floor', 'ceil', 'array_length', 'cardinality',
+})
+
+
+def _is_read_only(sql: str) -> bool:
+    body = sql.strip().rstrip(';')
+    if not body or ';' in body:
+        return False
+    if body.split(None, 1)[0].upper() not in _READ_ONLY_HEADS:
+        return False
+    if _WRITE_KEYWORDS.search(body):
+        return False
+    return all(name.lower() in _READ_ONLY_CALLS for name in _CALL.findall(body))
+
+
+def explain_command(sql: str) -> str:
+    """実行計画を取るときの EXPLAIN。読み取りだけのSQL（_is_read_only）は ANALYZE で
+    実際に実行して計測し、それ以外は実行せずに推定の計画だけを取る（ロールバックしても
+    ロックやシーケンスの消費、関数の副作用は残るため）
+    """
+    if _is_read_only(sql):
+        return 'EXPLAIN (ANALYZE, BUFFERS)'
+    return 'EXPLAIN'
+
+
+async def capture_plan(name: str, sql: str, args=()) -> str:
+    """
+    実行計画を取り（explain_command）、クエリ統計に保存してログに出す。
+    args は遅かったときのパラメーター（$1, $2 ... に渡す）。
+    念のため読み取りだけのSQLでもトランザクション内で実行してロールバックする。
+    """
+    pool = await get_pool()
+    try:
+        async with pool.acquire() as conn:
+            tx = conn.transaction()
+            await tx.start()
+            try:
+                rows = await conn.fetch(f'{explain_command(sql)} {sql}', *args, timeout=60)
+            finally:
+                await tx.rollback()
+        plan = "\n".join(r[0] for r in rows)
+    except Exception as e:
+        plan = f"(実行計画を取得できませんでした: {e})"
+    querystats.get_stats().set_plan(name, plan)
+    logging.warning(f"遅いクエリの実行計画: {name}\n{sql.strip()}\n{plan}")
+    return plan
+
+
+def get_pool_stats() -> dict:
+    """接続プールの状態（作成前なら None）"""
+    if _global_pool is None:
+        return None
+    size = _global_pool.get_size()
+    return {
+        'size': size,
+        'in_use': size - _global_pool.get_idle_size(),
+        'max_size': _global_pool.get_max_size(),
+    }
+
+
+async def warm_pool(size: int = DB_POOL_WARM_SIZE) -> int:
+    """size 本の接続を同時に借りて SELECT 1 を通す（接続・TLSの確立を起動中に済ませる）。
+    最初のBumpが接続の確立を待たないよう、受け付けを始める前に呼ぶ。使えた本数を返す
+    """
+    pool = await get_pool()
+    size = min(size, pool.get_max_size())
+    async with contextlib.AsyncExitStack() as stack:
+        # 同時に借りないと同じ接続が使い回される
+        results = await asyncio.gather(
+            *(stack.enter_async_context(pool.acquire()) for _ in range(size)),
+            return_exceptions=True,
+        )
+        conns = [c for c in results if not isinstance(c, BaseException)]
+        await asyncio.gather(*(c.execute('SELECT 1') for c in conns))
+    for error in results:
+        if isinstance(error, BaseException):
+            logging.warning(f"DB接続の事前確立に一部失敗: {error}")
+            break
+    return len(conns)
+
+
+async def ping(timeout: float = 2.0) -> bool:
+    """DBに接続して応答があるか（/ready 用）。プールが埋まっていて借りられない場合も False"""
+    async def _ping():
+        async with acquire('ping') as conn:
+            await conn.fetchval('SELECT 1')
+
+    try:
+        await asyncio.wait_for(_ping(), timeout)
+        return True
+    except Exception as e:
+        logging.warning(f"DB応答確認に失敗: {e}")
+        return False
+
+
+async def close_pool(timeout: float = None):
+    """接続プールを閉じる。timeout 秒以内に接続が返されなければ強制的に切断する"""
     global _global_pool
     if _global_pool is not None:
         try:
-            await _global_pool.close()
+            await asyncio.wait_for(_global_pool.close(), timeout)
             logging.info("✅ DB接続プール終了")
+        except asyncio.TimeoutError:
+            _global_pool.terminate()
+            logging.warning("⚠️ 使用中の接続が返されないため、DB接続プールを強制終了")
         except Exception as e:
             logging.error(f"⚠️ プール終了エラー: {e}")
         finally:
@@ -58,279 +272,1157 @@ async def close_pool():
 # ===========================
 
 async def init_db():
-    """テーブルを作成（v3: streak列・weekly_bumpsテーブル追加）"""
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        # usersテーブル（v3: streak追加）
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                bump_count INTEGER NOT NULL DEFAULT 0,
-                last_bump_date DATE,
-                current_streak INTEGER NOT NULL DEFAULT 0,
-                max_streak INTEGER NOT NULL DEFAULT 0
-            );
-        ''')
-
-        # v2からの移行: 既存テーブルにstreak列がなければ追加
-        await conn.execute('''
-            DO $$ BEGIN
-                ALTER TABLE users ADD COLUMN IF NOT EXISTS last_bump_date DATE;
-                ALTER TABLE users ADD COLUMN IF NOT EXISTS current_streak INTEGER NOT NULL DEFAULT 0;
-                ALTER TABLE users ADD COLUMN IF NOT EXISTS max_streak INTEGER NOT NULL DEFAULT 0;
-            EXCEPTION WHEN OTHERS THEN NULL;
-            END $$;
-        ''')
-
-        # 週間Bumpテーブル（v3新規）
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS weekly_bumps (
-                user_id BIGINT NOT NULL,
-                week_start DATE NOT NULL,
-                bump_count INTEGER NOT NULL DEFAULT 0,
-                PRIMARY KEY (user_id, week_start)
-            );
-        ''')
+    """スキーマを最新バージョンまで移行する（最新なら何もしない）"""
+    async with acquire('init_db') as conn:
+        version = await migrations.migrate(conn)
+        logging.info(f"スキーマバージョン: v{version}")
+        # 今月と来月のパーティションは先に作っておき、通常のBumpでDDLを走らせない
+        this_month = _month_start(datetime.datetime.now(datetime.timezone.utc))
+        await _ensure_event_partitions(conn, [this_month, _next_month(this_month)])
+        await _sync_rollup_timezone(conn)
+
+
+async def _sync_rollup_timezone(conn):
+    """日別・週別集計の日付がいまの BOT_TIMEZONE で作られていなければ作り直す"""
+    current = await conn.fetchval("SELECT value FROM settings WHERE key = 'rollup_timezone'")
+    if current == BOT_TIMEZONE_NAME:
+        return
+    # 切り離したパーティションのイベントは作り直せないので、その場合は集計をそのまま使う
+    archived = await conn.fetchval(
+        "SELECT COUNT(*) FROM pg_class WHERE relname LIKE 'bump\\_events\\_%\\_archived'"
+    )
+    if archived:
+        logging.warning(
+            f"集計のタイムゾーン({current})が設定({BOT_TIMEZONE_NAME})と違いますが、"
+            "切り離し済みのイベントログがあるため作り直しません"
+        )
+    else:
+        async with conn.transaction():
+            for statement in _REBUILD_ROLLUPS_SQL:
+                if '$1' in statement:
+                    await conn.execute(statement, BOT_TIMEZONE_NAME)
+                else:
+                    await conn.execute(statement)
+        logging.info(f"日別・週別集計を {BOT_TIMEZONE_NAME} の日付で作り直しました")
+    await conn.execute(
+        "INSERT INTO settings (key, value) VALUES ('rollup_timezone', $1) "
+        "ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value",
+        BOT_TIMEZONE_NAME
+    )
 
-        # リマインダー
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS reminders (
-                id SERIAL PRIMARY KEY,
-                channel_id BIGINT NOT NULL,
-                remind_at TIMESTAMP WITH TIME ZONE NOT NULL,
-                status TEXT NOT NULL DEFAULT 'waiting'
-            );
-        ''')
 
-        # 設定
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT
-            );
-        ''')
-        await conn.execute('''
-            INSERT INTO settings (key, value) VALUES ('scan_completed', 'false')
-            ON CONFLICT (key) DO NOTHING;
+async def detach_old_event_partitions(keep_months: int) -> list:
+    """
+    直近 keep_months か月より古い bump_events のパーティションを切り離す。
+    日別・週別の集計は残るので、ランキングや合計には影響しない。
+    切り離したテーブルは bump_events_YYYYMM_archived に改名して残す（不要なら手動でDROP）。
+    その月のBumpを後から再スキャンした場合、メッセージIDによる重複排除は効かない。
+    戻り値: 切り離したテーブル名の一覧
+    """
+    this_month = _month_start(datetime.datetime.now(datetime.timezone.utc))
+    cutoff = this_month
+    for _ in range(keep_months):
+        cutoff = (cutoff - datetime.timedelta(days=1)).replace(day=1)
+
+    detached = []
+    async with acquire('detach_old_event_partitions') as conn:
+        names = await conn.fetch('''
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'bump_events'::regclass
+            ORDER BY c.relname
         ''')
+        for row in names:
+            name = row['relname']
+            month = datetime.datetime.strptime(name[-6:], '%Y%m').date()
+            if month >= cutoff:
+                continue
+            # CONCURRENTLY なら親テーブルへの書き込みを止めない（トランザクション外で実行）
+            await conn.execute(f'ALTER TABLE bump_events DETACH PARTITION {name} CONCURRENTLY')
+            await conn.execute(f'ALTER TABLE {name} RENAME TO {name}_archived')
+            _event_partitions.discard(month)
+            detached.append(name)
+    return detached
 
 
 # ===========================
 # Bump記録（v3: streak・週間カウント対応）
 # ===========================
 
-async def record_bump(user_id: int) -> dict:
+# 連続日数・累計・週間カウントを1文で更新するSQL。
+# streak計算は users の現在値を使って ON CONFLICT 側で行うため、
+# SELECT → UPDATE/INSERT → 週間UPSERT → SELECT の4往復が1往復になる。
+# prev CTE は更新前のスナップショットを読むので、自己ベスト判定に使える。
+# $1/$2 は (user_id, 回数) の配列で、複数ユーザー分をまとめて1文で書き込める。
+# 同じ文で同一行を2回更新できないため、user_id は呼び出し側で重複排除しておくこと。
+_RECORD_BUMPS_SQL = '''
+    WITH input AS (
+        SELECT * FROM unnest($1::bigint[], $2::int[]) AS t(user_id, n)
+    ),
+    prev AS (
+        SELECT users.user_id, users.max_streak
+        FROM users JOIN input ON users.user_id = input.user_id
+    ),
+    upsert AS (
+        INSERT INTO users AS u (user_id, bump_count, last_bump_date, current_streak, max_streak)
+        SELECT user_id, n, $3, 1, 1 FROM input
+        ON CONFLICT (user_id) DO UPDATE SET
+            bump_count = u.bump_count + EXCLUDED.bump_count,
+            last_bump_date = EXCLUDED.last_bump_date,
+            current_streak = CASE
+                WHEN u.last_bump_date = EXCLUDED.last_bump_date THEN u.current_streak
+                WHEN u.last_bump_date = EXCLUDED.last_bump_date - 1 THEN u.current_streak + 1
+                ELSE 1
+            END,
+            max_streak = GREATEST(u.max_streak, CASE
+                WHEN u.last_bump_date = EXCLUDED.last_bump_date THEN u.current_streak
+                WHEN u.last_bump_date = EXCLUDED.last_bump_date - 1 THEN u.current_streak + 1
+                ELSE 1
+            END)
+        RETURNING user_id, bump_count, current_streak, max_streak
+    ),
+    weekly AS (
+        INSERT INTO weekly_bumps AS w (user_id, week_start, bump_count)
+        SELECT user_id, $4, n FROM input
+        ON CONFLICT (user_id, week_start) DO UPDATE
+        SET bump_count = w.bump_count + EXCLUDED.bump_count
+        RETURNING user_id, bump_count
+    )
+    SELECT upsert.user_id, upsert.bump_count, upsert.current_streak, upsert.max_streak,
+           weekly.bump_count AS weekly_count,
+           prev.max_streak AS prev_max_streak
+    FROM upsert
+    JOIN weekly ON weekly.user_id = upsert.user_id
+    LEFT JOIN prev ON prev.user_id = upsert.user_id
+'''
+
+
+# キャッシュ済みユーザー用: メモリ上で計算済みの値をそのまま書き込む（読み込みなし）
+_WRITE_USER_STATES_SQL = '''
+    WITH input AS (
+        SELECT * FROM unnest($1::bigint[], $2::int[], $3::int[], $4::int[], $5::int[])
+            AS t(user_id, bump_count, current_streak, max_streak, weekly_count)
+    ),
+    upsert AS (
+        INSERT INTO users (user_id, bump_count, last_bump_date, current_streak, max_streak)
+        SELECT user_id, bump_count, $6, current_streak, max_streak FROM input
+        ON CONFLICT (user_id) DO UPDATE SET
+            bump_count = EXCLUDED.bump_count,
+            last_bump_date = EXCLUDED.last_bump_date,
+            current_streak = EXCLUDED.current_streak,
+            max_streak = EXCLUDED.max_streak
+    )
+    INSERT INTO weekly_bumps (user_id, week_start, bump_count)
+    SELECT user_id, $7, weekly_count FROM input
+    ON CONFLICT (user_id, week_start) DO UPDATE
+    SET bump_count = EXCLUDED.bump_count
+'''
+
+
+def local_today() -> datetime.date:
+    """BOT_TIMEZONE での今日の日付"""
+    return datetime.datetime.now(BOT_TIMEZONE).date()
+
+
+def _current_week_start(today: datetime.date) -> datetime.date:
+    """週の開始日（月曜日基準）"""
+    return today - datetime.timedelta(days=today.weekday())
+
+
+def _advance_state(state: dict, n: int, today: datetime.date, week_start: datetime.date):
+    """キャッシュ上の状態にBump n回分を反映した新しい状態と、自己ベスト更新かを返す。
+    _RECORD_BUMPS_SQL と同じstreak計算をメモリ上で行う。
     """
-    Bumpを記録し、streak・週間カウントも更新する。
-    戻り値: {
-        'bump_count': int,      # 累計Bump回数
-        'current_streak': int,  # 現在の連続日数
-        'max_streak': int,      # 最大連続日数
-        'weekly_count': int,    # 今週のBump回数
-        'is_new_streak_record': bool  # 自己ベスト更新か
+    last_date = state['last_bump_date']
+    streak = state['current_streak']
+    if last_date == today:
+        pass  # 同じ日に複数回Bump → streakは変えない
+    elif last_date is not None and (today - last_date).days == 1:
+        streak += 1  # 昨日もBumpした → 連続日数+1
+    else:
+        streak = 1  # 2日以上空いた → リセット
+
+    weekly = state['weekly_count'] if state['week_start'] == week_start else 0
+    new_state = {
+        'bump_count': state['bump_count'] + n,
+        'last_bump_date': today,
+        'current_streak': streak,
+        'max_streak': max(streak, state['max_streak']),
+        'week_start': week_start,
+        'weekly_count': weekly + n,
     }
+    return new_state, streak > state['max_streak']
+
+
+def _bump_result(state: dict, is_new_record: bool) -> dict:
+    streak = state['current_streak']
+    return {
+        'bump_count': state['bump_count'],
+        'current_streak': streak,
+        'max_streak': state['max_streak'],
+        'weekly_count': state['weekly_count'] or 1,
+        'is_new_streak_record': is_new_record and streak > 1,
+    }
+
+
+# サーバー合計・週合計・サーバー(guild)別合計の集計カウンター
+# Bumpの書き込みと同じトランザクションで加算するので SUM() せずに読める
+_ADD_BUMP_COUNTERS_SQL = '''
+    INSERT INTO bump_counters AS c (scope, scope_key, total)
+    SELECT * FROM unnest($1::text[], $2::text[], $3::bigint[])
+    ON CONFLICT (scope, scope_key) DO UPDATE
+    SET total = c.total + EXCLUDED.total
+'''
+
+
+# Bumpイベントログ: DISBOARDのメッセージIDで一意。既に記録済みのIDは挿入されない。
+# 挿入できたイベントだけを日別・週別の集計テーブルに加算する（同じ文の中で行う）
+_INSERT_BUMP_EVENTS_SQL = '''
+    WITH input AS (
+        SELECT * FROM unnest($1::bigint[], $2::bigint[], $3::bigint[], $4::bigint[], $5::timestamptz[])
+            AS t(message_id, user_id, guild_id, channel_id, bumped_at)
+    ),
+    inserted AS (
+        INSERT INTO bump_events (message_id, user_id, guild_id, channel_id, bumped_at)
+        SELECT * FROM input
+        ON CONFLICT (message_id, bumped_at) DO NOTHING
+        RETURNING message_id, user_id, guild_id, bumped_at
+    ),
+    daily AS (
+        INSERT INTO bump_daily AS d (day, guild_id, user_id, bump_count)
+        SELECT (bumped_at AT TIME ZONE $6)::date, guild_id, user_id, COUNT(*) FROM inserted GROUP BY 1, 2, 3
+        ON CONFLICT (day, guild_id, user_id) DO UPDATE
+        SET bump_count = d.bump_count + EXCLUDED.bump_count
+    ),
+    weekly AS (
+        INSERT INTO bump_weekly AS w (week_start, guild_id, user_id, bump_count)
+        SELECT date_trunc('week', bumped_at AT TIME ZONE $6)::date, guild_id, user_id, COUNT(*)
+        FROM inserted GROUP BY 1, 2, 3
+        ON CONFLICT (week_start, guild_id, user_id) DO UPDATE
+        SET bump_count = w.bump_count + EXCLUDED.bump_count
+    ),
+    members AS (
+        -- いまBumpした人はそのサーバーに在籍している
+        INSERT INTO guild_members AS m (guild_id, user_id)
+        SELECT DISTINCT guild_id, user_id FROM inserted WHERE guild_id <> 0
+        ON CONFLICT (guild_id, user_id) DO UPDATE SET active = TRUE, left_at = NULL
+        WHERE NOT m.active
+    )
+    SELECT message_id, (bumped_at AT TIME ZONE $6)::date AS day FROM inserted
+'''
+
+# 日別集計を BOT_TIMEZONE の日付で作り直す（タイムゾーン設定が変わったとき用）
+_REBUILD_ROLLUPS_SQL = [
+    'TRUNCATE bump_daily, bump_weekly',
+    '''
+    INSERT INTO bump_daily (day, guild_id, user_id, bump_count)
+    SELECT (bumped_at AT TIME ZONE $1)::date, guild_id, user_id, COUNT(*)
+    FROM bump_events GROUP BY 1, 2, 3
+    ''',
+    '''
+    INSERT INTO bump_weekly (week_start, guild_id, user_id, bump_count)
+    SELECT date_trunc('week', bumped_at AT TIME ZONE $1)::date, guild_id, user_id, COUNT(*)
+    FROM bump_events GROUP BY 1, 2, 3
+    ''',
+]
+
+# 作成済みと分かっている bump_events の月別パーティション（月初の日付）
+_event_partitions = set()
+
+
+def _month_start(ts: datetime.datetime) -> datetime.date:
+    """パーティションの月（UTC）"""
+    return ts.astimezone(datetime.timezone.utc).date().replace(day=1)
+
+
+def _next_month(month: datetime.date) -> datetime.date:
+    return (month.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
+async def _ensure_event_partitions(conn, months):
+    """bump_events の月別パーティションがなければ作る。
+    親テーブルのロックを取るので、書き込みトランザクションの外で呼ぶこと。
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.transaction():
-            today = datetime.date.today()
+    for month in sorted(set(months) - _event_partitions):
+        await conn.execute(
+            f"CREATE TABLE IF NOT EXISTS bump_events_{month:%Y%m} PARTITION OF bump_events "
+            f"FOR VALUES FROM ('{month} 00:00+00') TO ('{_next_month(month)} 00:00+00')"
+        )
+        _event_partitions.add(month)
 
-            # 週の開始日（月曜日基準）
-            week_start = today - datetime.timedelta(days=today.weekday())
 
-            # ユーザーの現在データを取得
-            row = await conn.fetchrow(
-                'SELECT bump_count, last_bump_date, current_streak, max_streak FROM users WHERE user_id = $1',
-                user_id
+async def record_bump_events(events: list):
+    """
+    DISBOARDのメッセージ単位でBumpを記録する（1トランザクション）。
+    events: [{'message_id', 'user_id', 'guild_id', 'channel_id', 'bumped_at'}, ...]
+    戻り値: ({user_id: 統計dict（全件反映後の値）}, 記録済みだったメッセージIDのset)
+        統計dict: {
+            'bump_count': int,      # 累計Bump回数
+            'current_streak': int,  # 現在の連続日数
+            'max_streak': int,      # 最大連続日数
+            'weekly_count': int,    # 今週のBump回数
+            'is_new_streak_record': bool  # 自己ベスト更新か
+        }
+
+    bump_events に挿入できたメッセージだけを数えるので、同じメッセージを
+    何度渡しても（再接続・二重起動・再スキャン）二重に数えない。
+    キャッシュにいるユーザーはメモリ上で計算して書き込むだけ、
+    いないユーザーは _RECORD_BUMPS_SQL で計算させて結果をキャッシュに入れる。
+    キャッシュはコミットが成功してから更新する。
+    """
+    if not events:
+        return {}, set()
+
+    today = local_today()
+    week_start = _current_week_start(today)
+    async with acquire('record_bump_events') as conn:
+        await _ensure_event_partitions(conn, {_month_start(e['bumped_at']) for e in events})
+        async with conn.transaction():
+            rows = await conn.fetch(
+                _INSERT_BUMP_EVENTS_SQL,
+                [e['message_id'] for e in events],
+                [e['user_id'] for e in events],
+                [e['guild_id'] or 0 for e in events],
+                [e['channel_id'] for e in events],
+                [e['bumped_at'] for e in events],
+                BOT_TIMEZONE_NAME,
             )
+            inserted = {row['message_id'] for row in rows}
+
+            counts = {}
+            guild_counts = {}
+            for e in events:
+                if e['message_id'] not in inserted:
+                    continue
+                counts[e['user_id']] = counts.get(e['user_id'], 0) + 1
+                if e['guild_id']:
+                    guild_counts[e['guild_id']] = guild_counts.get(e['guild_id'], 0) + 1
+
+            new_states = {}
+            if counts:
+                new_states = await _write_bumps(conn, counts, guild_counts, today, week_start)
+
+    duplicates = {e['message_id'] for e in events} - inserted
+    for e in events:
+        if e['guild_id'] and e['message_id'] in inserted:
+            leaderboard.set_member(e['guild_id'], e['user_id'], True)
+    _invalidate_periods({row['day'] for row in rows})
+    return _publish_bumps(new_states, week_start), duplicates
+
+
+async def _write_bumps(conn, counts: dict, guild_counts: dict, today: datetime.date,
+                       week_start: datetime.date) -> dict:
+    """トランザクション内でBumpを書き込み、{user_id: (新しい状態, 自己ベスト更新か)} を返す"""
+    cached = {}
+    uncached = []
+    for user_id in counts:
+        state = _user_cache.get(user_id)
+        if state is None:
+            uncached.append(user_id)
+        else:
+            cached[user_id] = _advance_state(state, counts[user_id], today, week_start)
+
+    total = sum(counts.values())
+    scopes = ['server', 'week']
+    keys = ['', week_start.isoformat()]
+    totals = [total, total]
+    for guild_id, n in (guild_counts or {}).items():
+        scopes.append('guild')
+        keys.append(str(guild_id))
+        totals.append(n)
+
+    new_states = {}
+    if uncached:
+        rows = await conn.fetch(
+            _RECORD_BUMPS_SQL, uncached, [counts[u] for u in uncached], today, week_start
+        )
+        for row in rows:
+            state = {
+                'bump_count': row['bump_count'],
+                'last_bump_date': today,
+                'current_streak': row['current_streak'],
+                'max_streak': row['max_streak'],
+                'week_start': week_start,
+                'weekly_count': row['weekly_count'],
+            }
+            # 新規ユーザーは prev_max_streak が NULL → 0扱い（streak=1なので通知対象外）
+            is_new_record = row['current_streak'] > (row['prev_max_streak'] or 0)
+            new_states[row['user_id']] = (state, is_new_record)
 
-            if row:
-                old_count = row['bump_count']
-                last_date = row['last_bump_date']
-                streak = row['current_streak']
-                max_streak = row['max_streak']
-
-                # Streak計算
-                if last_date is not None:
-                    days_diff = (today - last_date).days
-                    if days_diff == 1:
-                        # 昨日もBumpした → 連続日数+1
-                        streak += 1
-                    elif days_diff == 0:
-                        # 同じ日に複数回Bump → streakは変えない
-                        pass
-                    else:
-                        # 2日以上空いた → リセット
-                        streak = 1
-                else:
-                    streak = 1
+    if cached:
+        user_ids = list(cached)
+        states = [cached[u][0] for u in user_ids]
+        await conn.execute(
+            _WRITE_USER_STATES_SQL,
+            user_ids,
+            [st['bump_count'] for st in states],
+            [st['current_streak'] for st in states],
+            [st['max_streak'] for st in states],
+            [st['weekly_count'] for st in states],
+            today, week_start,
+        )
+        new_states.update(cached)
 
-                new_count = old_count + 1
-                is_new_record = streak > max_streak
-                new_max = max(streak, max_streak)
+    await conn.execute(_ADD_BUMP_COUNTERS_SQL, scopes, keys, totals)
+    return new_states
 
-                await conn.execute('''
-                    UPDATE users SET
-                        bump_count = $1,
-                        last_bump_date = $2,
-                        current_streak = $3,
-                        max_streak = $4
-                    WHERE user_id = $5
-                ''', new_count, today, streak, new_max, user_id)
-
-            else:
-                # 新規ユーザー
-                new_count = 1
-                streak = 1
-                new_max = 1
-                is_new_record = True
 
-                await conn.execute('''
-                    INSERT INTO users (user_id, bump_count, last_bump_date, current_streak, max_streak)
-                    VALUES ($1, 1, $2, 1, 1)
-                ''', user_id, today)
+def _publish_bumps(new_states: dict, week_start: datetime.date) -> dict:
+    """コミット後にキャッシュ・ランキングへ反映し、record_bump_events の戻り値を作る"""
+    results = {}
+    for user_id, (state, is_new_record) in new_states.items():
+        _user_cache.put(user_id, state)
+        leaderboard.apply_bump(
+            user_id, state['bump_count'], state['current_streak'],
+            week_start, state['weekly_count'],
+        )
+        results[user_id] = _bump_result(state, is_new_record)
+    return results
 
-            # 週間Bumpカウントを更新
-            await conn.execute('''
-                INSERT INTO weekly_bumps (user_id, week_start, bump_count)
-                VALUES ($1, $2, 1)
-                ON CONFLICT (user_id, week_start) DO UPDATE
-                SET bump_count = weekly_bumps.bump_count + 1;
-            ''', user_id, week_start)
-
-            weekly_count = await conn.fetchval(
-                'SELECT bump_count FROM weekly_bumps WHERE user_id = $1 AND week_start = $2',
-                user_id, week_start
-            )
 
-            return {
-                'bump_count': new_count,
-                'current_streak': streak,
-                'max_streak': new_max,
-                'weekly_count': weekly_count or 1,
-                'is_new_streak_record': is_new_record and streak > 1,
-            }
+# ===========================
+# 過去ログの一括取り込み（メッセージの日時どおりに記録）
+# ===========================
+
+# COPYした取り込み分のうち、bump_events に新しく入ったものだけを bump_import_new に残す
+_IMPORT_EVENTS_SQL = [
+    '''
+    CREATE TEMP TABLE bump_import (
+        message_id BIGINT, user_id BIGINT, guild_id BIGINT, channel_id BIGINT,
+        bumped_at TIMESTAMP WITH TIME ZONE
+    ) ON COMMIT DROP
+    ''',
+    '''
+    CREATE TEMP TABLE bump_import_new (
+        message_id BIGINT, user_id BIGINT, guild_id BIGINT, day DATE, week_start DATE
+    ) ON COMMIT DROP
+    ''',
+]
+
+_IMPORT_INSERT_SQL = '''
+    WITH inserted AS (
+        INSERT INTO bump_events (message_id, user_id, guild_id, channel_id, bumped_at)
+        SELECT DISTINCT ON (message_id, bumped_at) * FROM bump_import
+        ON CONFLICT (message_id, bumped_at) DO NOTHING
+        RETURNING message_id, user_id, guild_id, bumped_at
+    )
+    INSERT INTO bump_import_new
+    SELECT message_id, user_id, guild_id,
+           (bumped_at AT TIME ZONE $1)::date,
+           date_trunc('week', bumped_at AT TIME ZONE $1)::date
+    FROM inserted
+'''
+
+_IMPORT_APPLY_SQL = [
+    # 日別・週別集計
+    '''
+    INSERT INTO bump_daily AS d (day, guild_id, user_id, bump_count)
+    SELECT day, guild_id, user_id, COUNT(*) FROM bump_import_new GROUP BY 1, 2, 3
+    ON CONFLICT (day, guild_id, user_id) DO UPDATE SET bump_count = d.bump_count + EXCLUDED.bump_count
+    ''',
+    '''
+    INSERT INTO bump_weekly AS w (week_start, guild_id, user_id, bump_count)
+    SELECT week_start, guild_id, user_id, COUNT(*) FROM bump_import_new GROUP BY 1, 2, 3
+    ON CONFLICT (week_start, guild_id, user_id) DO UPDATE SET bump_count = w.bump_count + EXCLUDED.bump_count
+    ''',
+    # 週間ランキング（Bumpした週に入れる）
+    '''
+    INSERT INTO weekly_bumps AS w (user_id, week_start, bump_count)
+    SELECT user_id, week_start, COUNT(*) FROM bump_import_new GROUP BY 1, 2
+    ON CONFLICT (user_id, week_start) DO UPDATE SET bump_count = w.bump_count + EXCLUDED.bump_count
+    ''',
+    # 集計カウンター
+    '''
+    INSERT INTO bump_counters AS c (scope, scope_key, total)
+    SELECT 'server', '', COUNT(*) FROM bump_import_new
+    UNION ALL
+    SELECT 'week', week_start::text, COUNT(*) FROM bump_import_new GROUP BY week_start
+    UNION ALL
+    SELECT 'guild', guild_id::text, COUNT(*) FROM bump_import_new WHERE guild_id <> 0 GROUP BY guild_id
+    ON CONFLICT (scope, scope_key) DO UPDATE SET total = c.total + EXCLUDED.total
+    ''',
+    'INSERT INTO users (user_id) SELECT DISTINCT user_id FROM bump_import_new ON CONFLICT (user_id) DO NOTHING',
+]
+
+# 連続日数を gaps-and-islands で数え直す。
+# Bumpした日 = 日別集計の日付 + 取り込み前の連続記録の日（イベントログ導入前の分を失わないため）。
+# 日付から連番を引いた値が同じ日は1つの連続区間になる。
+# 最後の区間が前日($1)より前に終わっていれば途切れているので current_streak は0（decay_streaks と同じ判定）
+_IMPORT_STREAKS_SQL = '''
+    WITH affected AS (
+        SELECT user_id, COUNT(*) AS n FROM bump_import_new GROUP BY user_id
+    ),
+    days AS (
+        SELECT d.user_id, d.day
+        FROM bump_daily d JOIN affected a ON a.user_id = d.user_id
+        UNION
+        SELECT u.user_id,
+               generate_series(u.last_bump_date - (u.current_streak - 1), u.last_bump_date, INTERVAL '1 day')::date
+        FROM users u JOIN affected a ON a.user_id = u.user_id
+        WHERE u.last_bump_date IS NOT NULL AND u.current_streak > 0
+    ),
+    islands AS (
+        SELECT user_id, day,
+               day - (ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY day))::int AS grp
+        FROM days
+    ),
+    runs AS (
+        SELECT user_id, MAX(day) AS last_day, COUNT(*)::int AS len
+        FROM islands GROUP BY user_id, grp
+    ),
+    summary AS (
+        SELECT user_id, MAX(last_day) AS last_day, MAX(len) AS max_len,
+               (ARRAY_AGG(len ORDER BY last_day DESC))[1] AS last_len
+        FROM runs GROUP BY user_id
+    )
+    UPDATE users u SET
+        bump_count = u.bump_count + a.n,
+        last_bump_date = s.last_day,
+        current_streak = CASE WHEN s.last_day >= $1 THEN s.last_len ELSE 0 END,
+        max_streak = GREATEST(u.max_streak, s.max_len)
+    FROM affected a JOIN summary s ON s.user_id = a.user_id
+    WHERE u.user_id = a.user_id
+'''
+
+
+async def import_bump_history(events: list, reload_leaderboards: bool = True) -> dict:
+    """
+    過去ログのBumpを、メッセージの日時どおりに一括で記録する（1トランザクション）。
+    events: record_bump_events と同じ形式のdictの一覧
+    reload_leaderboards: False ならメモリ上のランキングを読み直さない
+        （何回にも分けて取り込むときは、最後に1回だけ load_leaderboards を呼ぶ）
+    戻り値: {'recorded': 新しく記録した件数, 'duplicates': 記録済みだった件数, 'users': 対象人数}
+
+    COPYで一時テーブルに入れてから、イベントログ・集計・週間ランキング・カウンターを
+    まとめて加算し、連続日数は集合演算で数え直す。ユーザー状態キャッシュを捨て、
+    ランキングを読み直すので、ライブのBump書き込みと同時に実行しないこと
+    （ingest.BumpIngestQueue.exclusive() の中で呼ぶ）。
+    """
+    if not events:
+        return {'recorded': 0, 'duplicates': 0, 'users': 0}
+
+    async with acquire('import_bump_history') as conn:
+        await _ensure_event_partitions(conn, {_month_start(e['bumped_at']) for e in events})
+        async with conn.transaction():
+            for statement in _IMPORT_EVENTS_SQL:
+                await conn.execute(statement)
+            await conn.copy_records_to_table(
+                'bump_import',
+                records=[
+                    (e['message_id'], e['user_id'], e['guild_id'] or 0, e['channel_id'], e['bumped_at'])
+                    for e in events
+                ],
+                columns=['message_id', 'user_id', 'guild_id', 'channel_id', 'bumped_at'],
+            )
+            await conn.execute(_IMPORT_INSERT_SQL, BOT_TIMEZONE_NAME)
+            summary = await conn.fetchrow(
+                'SELECT COUNT(*) AS recorded, COUNT(DISTINCT user_id) AS users, '
+                'ARRAY_AGG(DISTINCT day) AS days FROM bump_import_new'
+            )
+            if summary['recorded']:
+                for statement in _IMPORT_APPLY_SQL:
+                    await conn.execute(statement)
+                await conn.execute(_IMPORT_STREAKS_SQL, local_today() - datetime.timedelta(days=1))
+
+    if summary['recorded']:
+        # SQLで直接書き換えたのでキャッシュとランキングを作り直す
+        _user_cache.invalidate()
+        _invalidate_periods(set(summary['days']))
+        if reload_leaderboards:
+            await load_leaderboards()
+    return {
+        'recorded': summary['recorded'],
+        'duplicates': len({e['message_id'] for e in events}) - summary['recorded'],
+        'users': summary['users'],
+    }
 
 
 # ===========================
 # ランキング
 # ===========================
 
-async def get_top_users(limit=10):
-    """累計ランキング（v3: デフォルト10位まで）"""
-    pool = await get_pool()
-    async with pool.acquire() as conn:
+async def load_leaderboards():
+    """メモリ上のランキングをDBから作り直す（起動時に1回）"""
+    week_start = _current_week_start(local_today())
+    async with acquire('load_leaderboards') as conn:
+        users = await conn.fetch(
+            'SELECT user_id, bump_count, current_streak FROM users WHERE bump_count > 0'
+        )
+        weekly = await conn.fetch(
+            '''SELECT w.user_id, w.bump_count, u.current_streak
+               FROM weekly_bumps w
+               JOIN users u ON w.user_id = u.user_id
+               WHERE w.week_start = $1 AND w.bump_count > 0''',
+            week_start
+        )
+        guild_members = await conn.fetch('SELECT guild_id, user_id FROM guild_members WHERE active')
+
+    leaderboard.all_time.load(
+        (r['user_id'], r['bump_count'], r['current_streak']) for r in users
+    )
+    leaderboard.reset_weekly(week_start)
+    leaderboard.weekly.load(
+        (r['user_id'], r['bump_count'], r['current_streak']) for r in weekly
+    )
+    leaderboard.load_members((r['guild_id'], r['user_id']) for r in guild_members)
+    _leaderboards_loaded.set()
+    logging.info(f"ランキング読み込み完了: 累計{len(users)}人 / 今週{len(weekly)}人")
+
+
+async def wait_leaderboards_loaded():
+    """起動時のランキング読み込みが終わるまで待つ"""
+    await _leaderboards_loaded.wait()
+
+
+def get_cached_top_users(guild_id, limit=10, offset=0):
+    """メモリ上の累計ランキング（guild_id の在籍者のみ。None なら全員）。未読み込みならNone"""
+    if not leaderboard.all_time.loaded:
+        return None
+    return leaderboard.all_time_for(guild_id).top(limit, offset)
+
+
+def get_cached_weekly_top_users(guild_id, limit=10, offset=0):
+    """メモリ上の今週のランキング（guild_id の在籍者のみ。None なら全員）。未読み込みならNone"""
+    if not leaderboard.all_time.loaded:
+        return None
+    leaderboard.reset_weekly(_current_week_start(local_today()))
+    return leaderboard.weekly_for(guild_id).top(limit, offset)
+
+
+def get_user_rank(user_id: int, guild_id=None):
+    """累計ランキングでの (順位, 人数)。guild_id を指定するとその在籍者の中で数える。
+    未読み込み・未登録なら None
+    """
+    if not leaderboard.all_time.loaded:
+        return None
+    board = leaderboard.all_time_for(guild_id)
+    rank = board.rank(user_id)
+    if rank is None:
+        return None
+    return rank, len(board)
+
+
+# ===========================
+# サーバー在籍状態（サーバーごと）
+# ===========================
+
+async def set_member_active(guild_id: int, user_id: int, active: bool):
+    """サーバーへの参加・退出を記録し、メモリ上の在籍者にも反映する"""
+    async with acquire('set_member_active') as conn:
+        await conn.execute(
+            '''INSERT INTO guild_members (guild_id, user_id, active, left_at)
+               VALUES ($1, $2, $3, CASE WHEN $3 THEN NULL ELSE CURRENT_TIMESTAMP END)
+               ON CONFLICT (guild_id, user_id) DO UPDATE SET
+                   active = EXCLUDED.active,
+                   left_at = EXCLUDED.left_at''',
+            guild_id, user_id, active
+        )
+    leaderboard.set_member(guild_id, user_id, active)
+    _clear_periods()
+
+
+async def sync_guild_members(guild_id: int, member_ids: list):
+    """サーバーのメンバー一覧で在籍状態をまとめて更新し、(参加扱いにした人数, 退出扱いにした人数) を返す。
+    起動・再接続のたびに呼び、停止中の参加・退出や過去ログ取り込みで増えたユーザーも合わせる
+    """
+    async with acquire('sync_guild_members') as conn:
+        row = await conn.fetchrow(
+            '''WITH joined AS (
+                   INSERT INTO guild_members AS m (guild_id, user_id)
+                   SELECT $1, unnest($2::bigint[])
+                   ON CONFLICT (guild_id, user_id) DO UPDATE SET active = TRUE, left_at = NULL
+                   WHERE NOT m.active
+                   RETURNING 1
+               ),
+               departed AS (
+                   UPDATE guild_members SET active = FALSE, left_at = CURRENT_TIMESTAMP
+                   WHERE guild_id = $1 AND active AND user_id <> ALL($2::bigint[])
+                   RETURNING 1
+               )
+               SELECT (SELECT COUNT(*) FROM joined) AS joined,
+                      (SELECT COUNT(*) FROM departed) AS departed''',
+            guild_id, member_ids
+        )
+    leaderboard.set_guild_members(guild_id, member_ids)
+    if row['joined'] or row['departed']:
+        _clear_periods()
+    return row['joined'], row['departed']
+
+
+async def decay_streaks() -> int:
+    """
+    前日もBumpしていない人の current_streak を0にする（1文の集合更新）。
+    BOT_TIMEZONE の日付で判定し、連続中の人だけの部分インデックスで対象を探す。
+    戻り値: リセットした人数
+    """
+    yesterday = local_today() - datetime.timedelta(days=1)
+    async with acquire('decay_streaks') as conn:
+        rows = await conn.fetch(
+            '''UPDATE users SET current_streak = 0
+               WHERE current_streak > 0 AND last_bump_date < $1
+               RETURNING user_id''',
+            yesterday
+        )
+    user_ids = [r['user_id'] for r in rows]
+    for user_id in user_ids:
+        _user_cache.invalidate(user_id)
+    leaderboard.reset_streaks(user_ids)
+    if user_ids:
+        # 期間ランキングは current_streak も返すので、リセットした人を含む結果を捨てる
+        _clear_periods()
+    return len(user_ids)
+
+
+# guild_id が NULL なら絞り込まない（DMなど）
+_IN_GUILD_SQL = '''($1::bigint IS NULL OR EXISTS (
+    SELECT 1 FROM guild_members m WHERE m.guild_id = $1 AND m.user_id = u.user_id AND m.active
+))'''
+
+
+async def get_top_users(guild_id, limit=10, offset=0):
+    """累計ランキング（guild_id の在籍者のみ）"""
+    async with acquire('get_top_users') as conn:
         return await conn.fetch(
-            'SELECT user_id, bump_count, current_streak, max_streak FROM users ORDER BY bump_count DESC LIMIT $1',
-            limit
+            f'''SELECT u.user_id, u.bump_count, u.current_streak, u.max_streak FROM users u
+               WHERE u.bump_count > 0 AND {_IN_GUILD_SQL}
+               ORDER BY u.bump_count DESC, u.user_id LIMIT $2 OFFSET $3''',
+            guild_id, limit, offset
         )
 
 
-async def get_weekly_top_users(limit=10):
-    """今週のランキング"""
-    pool = await get_pool()
-    today = datetime.date.today()
-    week_start = today - datetime.timedelta(days=today.weekday())
-    async with pool.acquire() as conn:
+async def get_weekly_top_users(guild_id, limit=10, offset=0):
+    """今週のランキング（guild_id の在籍者のみ）"""
+    week_start = _current_week_start(local_today())
+    async with acquire('get_weekly_top_users') as conn:
         return await conn.fetch(
-            '''SELECT w.user_id, w.bump_count, u.current_streak
+            f'''SELECT w.user_id, w.bump_count, u.current_streak
                FROM weekly_bumps w
                JOIN users u ON w.user_id = u.user_id
-               WHERE w.week_start = $1
-               ORDER BY w.bump_count DESC LIMIT $2''',
-            week_start, limit
+               WHERE w.week_start = $4 AND w.bump_count > 0 AND {_IN_GUILD_SQL}
+               ORDER BY w.bump_count DESC, w.user_id LIMIT $2 OFFSET $3''',
+            guild_id, limit, offset, week_start
         )
 
 
+# 期間ランキングのキャッシュ: (start, end) -> {キー: 結果}
+# その期間にBumpが記録されたら丸ごと捨てる（_invalidate_periods）
+_period_cache = {}
+_PERIOD_CACHE_SIZE = 256  # 任意期間の指定で増えすぎないよう、古い期間から捨てる
+
+# 読み込み中（await中）に捨てられた結果を入れ直さないための世代番号。
+# 捨てるたびに進め、日付ごとに最後に捨てた世代を覚えておく（UserStateCache と同じ考え方）
+_period_clock = 0
+_period_changed = {}        # day -> 最後に捨てた世代（古い日付から _PERIOD_CACHE_SIZE 件まで）
+_period_changed_floor = 0   # _period_changed から押し出した日付の世代の最大
+_period_cleared_at = 0      # 丸ごと捨てた世代
+
+
+def _period_entry(start: datetime.date, end: datetime.date) -> dict:
+    entry = _period_cache.get((start, end))
+    if entry is None:
+        if len(_period_cache) >= _PERIOD_CACHE_SIZE:
+            del _period_cache[next(iter(_period_cache))]
+        entry = _period_cache[(start, end)] = {}
+    return entry
+
+
+def _period_store(start: datetime.date, end: datetime.date, key, value, since: int):
+    """since（読み込み前の _period_clock）以降にこの期間が捨てられていなければキャッシュする"""
+    if _period_cleared_at > since or _period_changed_floor > since:
+        return
+    if any(gen > since and start <= day < end for day, gen in _period_changed.items()):
+        return
+    _period_entry(start, end)[key] = value
+
+
+def _invalidate_periods(days):
+    """days のいずれかを含む期間のキャッシュを捨てる"""
+    global _period_clock, _period_changed_floor
+    if not days:
+        return
+    _period_clock += 1
+    for day in days:
+        _period_changed.pop(day, None)
+        _period_changed[day] = _period_clock
+    while len(_period_changed) > _PERIOD_CACHE_SIZE:
+        oldest = next(iter(_period_changed))
+        _period_changed_floor = max(_period_changed_floor, _period_changed.pop(oldest))
+    for start, end in list(_period_cache):
+        if any(start <= day < end for day in days):
+            del _period_cache[(start, end)]
+
+
+def _clear_periods():
+    """期間のキャッシュを丸ごと捨てる（連続記録のリセットや在籍状態の変更で、どの期間の結果も変わりうるとき）"""
+    global _period_clock, _period_cleared_at
+    _period_clock += 1
+    _period_cleared_at = _period_clock
+    _period_cache.clear()
+
+
+async def get_period_top_users(guild_id, start: datetime.date, end: datetime.date,
+                               limit=10, offset=0):
+    """
+    期間ランキング（guild_id の在籍者のみ）。start 以上 end 未満の日別集計を合計する。
+    日別集計はユーザーごとに1日1行なので、1年分でも1人あたり最大365行の合計で済む。
+    """
+    cached = _period_cache.get((start, end), {})
+    key = ('top', guild_id, limit, offset)
+    if key in cached:
+        return cached[key]
+
+    since = _period_clock
+    async with acquire('get_period_top_users') as conn:
+        rows = await conn.fetch(
+            f'''SELECT d.user_id, SUM(d.bump_count)::int AS bump_count, u.current_streak
+               FROM bump_daily d
+               JOIN users u ON d.user_id = u.user_id
+               WHERE d.day >= $4 AND d.day < $5 AND {_IN_GUILD_SQL}
+               GROUP BY d.user_id, u.current_streak
+               ORDER BY bump_count DESC, d.user_id LIMIT $2 OFFSET $3''',
+            guild_id, limit, offset, start, end
+        )
+    result = [dict(r) for r in rows]
+    _period_store(start, end, key, result, since)
+    return result
+
+
+async def get_period_total_bumps(start: datetime.date, end: datetime.date, guild_id=None) -> int:
+    """期間（start 以上 end 未満）の合計Bump回数（guild_id を指定するとそのサーバーでのBumpだけ）"""
+    cached = _period_cache.get((start, end), {})
+    key = ('total', guild_id)
+    if key in cached:
+        return cached[key]
+
+    since = _period_clock
+    async with acquire('get_period_total_bumps') as conn:
+        total = await conn.fetchval(
+            '''SELECT COALESCE(SUM(bump_count), 0) FROM bump_daily
+               WHERE day >= $1 AND day < $2 AND ($3::bigint IS NULL OR guild_id = $3)''',
+            start, end, guild_id
+        )
+    _period_store(start, end, key, total, since)
+    return total
+
+
+async def _load_user_state(user_id: int):
+    """ユーザー状態をキャッシュから取得。なければDBから読み込んでキャッシュする"""
+    state = _user_cache.get(user_id)
+    if state is not None:
+        return state
+
+    week_start = _current_week_start(local_today())
+    since = _user_cache.snapshot()
+    async with acquire('_load_user_state') as conn:
+        row = await conn.fetchrow(
+            '''SELECT u.bump_count, u.last_bump_date, u.current_streak, u.max_streak,
+                      COALESCE(w.bump_count, 0) AS weekly_count
+               FROM users u
+               LEFT JOIN weekly_bumps w ON w.user_id = u.user_id AND w.week_start = $2
+               WHERE u.user_id = $1''',
+            user_id, week_start
+        )
+    if row is None:
+        return None
+
+    state = {
+        'bump_count': row['bump_count'],
+        'last_bump_date': row['last_bump_date'],
+        'current_streak': row['current_streak'],
+        'max_streak': row['max_streak'],
+        'week_start': week_start,
+        'weekly_count': row['weekly_count'],
+    }
+    # 読み込み中にBumpの書き込みなどが終わっていたら、古いかもしれないのでキャッシュしない
+    _user_cache.put_loaded(user_id, state, since)
+    return state
+
+
 async def get_user_count(user_id: int) -> int:
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        count = await conn.fetchval('SELECT bump_count FROM users WHERE user_id = $1', user_id)
-        return count or 0
+    state = await _load_user_state(user_id)
+    return state['bump_count'] if state else 0
 
 
 async def get_user_stats(user_id: int) -> dict:
     """ユーザーの詳細統計を取得"""
-    pool = await get_pool()
-    today = datetime.date.today()
-    week_start = today - datetime.timedelta(days=today.weekday())
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow(
-            'SELECT bump_count, current_streak, max_streak FROM users WHERE user_id = $1',
-            user_id
-        )
-        weekly = await conn.fetchval(
-            'SELECT bump_count FROM weekly_bumps WHERE user_id = $1 AND week_start = $2',
-            user_id, week_start
+    state = await _load_user_state(user_id)
+    if state:
+        week_start = _current_week_start(local_today())
+        return {
+            'bump_count': state['bump_count'],
+            'current_streak': state['current_streak'],
+            'max_streak': state['max_streak'],
+            'weekly_count': state['weekly_count'] if state['week_start'] == week_start else 0,
+        }
+    return {'bump_count': 0, 'current_streak': 0, 'max_streak': 0, 'weekly_count': 0}
+
+
+def get_user_cache_stats() -> dict:
+    """ユーザー状態キャッシュのヒット率など（チューニング用）"""
+    return _user_cache.stats()
+
+
+async def _get_counter(scope: str, scope_key: str) -> int:
+    async with acquire('_get_counter') as conn:
+        total = await conn.fetchval(
+            'SELECT total FROM bump_counters WHERE scope = $1 AND scope_key = $2',
+            scope, scope_key
         )
-        if row:
-            return {
-                'bump_count': row['bump_count'],
-                'current_streak': row['current_streak'],
-                'max_streak': row['max_streak'],
-                'weekly_count': weekly or 0,
-            }
-        return {'bump_count': 0, 'current_streak': 0, 'max_streak': 0, 'weekly_count': 0}
+        return total or 0
 
 
 async def get_total_bumps() -> int:
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        total = await conn.fetchval('SELECT SUM(bump_count) FROM users')
-        return total or 0
+    """サーバー全体の累計Bump回数（集計カウンターから読む）"""
+    return await _get_counter('server', '')
+
+
+async def get_weekly_total_bumps(guild_id=None) -> int:
+    """今週の合計Bump回数（guild_id を指定するとそのサーバーでのBumpだけ。週別集計から数える）"""
+    week_start = _current_week_start(local_today())
+    if guild_id is None:
+        return await _get_counter('week', week_start.isoformat())
+    async with acquire('get_weekly_total_bumps') as conn:
+        return await conn.fetchval(
+            '''SELECT COALESCE(SUM(bump_count), 0)::bigint FROM bump_weekly
+               WHERE week_start = $1 AND guild_id = $2''',
+            week_start, guild_id
+        )
+
+
+async def get_guild_total_bumps(guild_id: int) -> int:
+    """サーバー(guild)別の合計Bump回数（集計開始後の分のみ）"""
+    return await _get_counter('guild', str(guild_id))
+
+
+async def reconcile_counters() -> list:
+    """
+    集計カウンターを元データ（users / weekly_bumps）から数え直して修正する。
+    戻り値: ずれていたカウンターの一覧 [{'scope', 'scope_key', 'stored', 'actual'}, ...]
+    guild別カウンターは元データにサーバーの区別がないため対象外。
+    """
+    async with acquire('reconcile_counters') as conn:
+        async with conn.transaction():
+            # 数え直し中に Bumpの書き込みが加算すると二重になるので、終わるまで待たせる
+            await conn.execute('LOCK TABLE bump_counters IN EXCLUSIVE MODE')
+            drift = await conn.fetch('''
+                WITH actual AS (
+                    SELECT 'server'::text AS scope, ''::text AS scope_key,
+                           COALESCE(SUM(bump_count), 0)::bigint AS total
+                    FROM users
+                    UNION ALL
+                    SELECT 'week', week_start::text, SUM(bump_count)::bigint
+                    FROM weekly_bumps GROUP BY week_start
+                ),
+                stored AS (
+                    SELECT scope, scope_key, total FROM bump_counters
+                    WHERE scope IN ('server', 'week')
+                )
+                SELECT COALESCE(a.scope, s.scope) AS scope,
+                       COALESCE(a.scope_key, s.scope_key) AS scope_key,
+                       COALESCE(s.total, 0) AS stored,
+                       COALESCE(a.total, 0) AS actual
+                FROM actual a
+                FULL OUTER JOIN stored s ON s.scope = a.scope AND s.scope_key = a.scope_key
+                WHERE COALESCE(s.total, 0) <> COALESCE(a.total, 0)
+            ''')
+            if drift:
+                await conn.execute('''
+                    INSERT INTO bump_counters AS c (scope, scope_key, total)
+                    SELECT * FROM unnest($1::text[], $2::text[], $3::bigint[])
+                    ON CONFLICT (scope, scope_key) DO UPDATE SET total = EXCLUDED.total
+                ''', [r['scope'] for r in drift], [r['scope_key'] for r in drift],
+                    [r['actual'] for r in drift])
+
+    for r in drift:
+        logging.warning(
+            f"集計カウンターのずれを修正: {r['scope']}:{r['scope_key']} {r['stored']} → {r['actual']}"
+        )
+    return [dict(r) for r in drift]
 
 
 # ===========================
 # リマインダー
 # ===========================
 
-async def set_reminder(channel_id: int, remind_time: datetime.datetime):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        await conn.execute('DELETE FROM reminders')
-        await conn.execute(
-            'INSERT INTO reminders (channel_id, remind_at) VALUES ($1, $2)',
-            channel_id, remind_time
+# 期限の来たリマインダーをまとめて送信権ごと確保するSQL。
+# FOR UPDATE SKIP LOCKED なので、複数プロセスで同時に呼んでも同じ行は1回しか返らない。
+# 1回目(waiting)は notified_1st に進め、2回目(notified_1st)は行を削除する。
+# remind_at <= $1 の範囲条件で idx_reminders_remind_at を使う。
+_CLAIM_DUE_REMINDERS_SQL = '''
+    WITH due AS (
+        SELECT id, status FROM reminders
+        WHERE remind_at <= $1
+          AND (status = 'waiting' OR remind_at <= $1 - $2::interval)
+        ORDER BY remind_at
+        LIMIT $3
+        FOR UPDATE SKIP LOCKED
+    ),
+    advanced AS (
+        UPDATE reminders r SET status = 'notified_1st'
+        FROM due WHERE r.id = due.id AND due.status = 'waiting'
+        RETURNING r.id, r.guild_id, r.channel_id, r.remind_at, 'waiting'::text AS status
+    ),
+    finished AS (
+        DELETE FROM reminders r USING due
+        WHERE r.id = due.id AND due.status = 'notified_1st'
+        RETURNING r.id, r.guild_id, r.channel_id, r.remind_at, 'notified_1st'::text AS status
+    )
+    SELECT * FROM advanced
+    UNION ALL
+    SELECT * FROM finished
+'''
+
+
+async def set_reminder(guild_id: int, channel_id: int, remind_time: datetime.datetime):
+    """
+    リマインダーを登録し、登録した行を返す（スケジューラーに渡す用）。
+    DISBOARDのクールダウンはサーバー単位なので、同じサーバーの他チャンネルの分は消す。
+    """
+    async with acquire('set_reminder') as conn:
+        async with conn.transaction():
+            await conn.execute(
+                'DELETE FROM reminders WHERE guild_id = $1 AND channel_id <> $2',
+                guild_id, channel_id
+            )
+            return await conn.fetchrow(
+                '''INSERT INTO reminders (guild_id, channel_id, remind_at) VALUES ($1, $2, $3)
+                   ON CONFLICT (guild_id, channel_id) DO UPDATE
+                   SET remind_at = EXCLUDED.remind_at, status = 'waiting'
+                   RETURNING id, guild_id, channel_id, remind_at, status''',
+                guild_id, channel_id, remind_time
+            )
+
+
+async def get_reminder(guild_id: int):
+    """サーバーの次のリマインダー"""
+    async with acquire('get_reminder') as conn:
+        return await conn.fetchrow(
+            '''SELECT channel_id, remind_at, status FROM reminders
+               WHERE guild_id = $1 ORDER BY remind_at LIMIT 1''',
+            guild_id
         )
 
 
-async def get_reminder():
-    pool = await get_pool()
-    async with pool.acquire() as conn:
+async def get_pending_reminders():
+    """未送信のリマインダー一覧（起動時にスケジューラーへ読み込む用）"""
+    async with acquire('get_pending_reminders') as conn:
+        return await conn.fetch(
+            'SELECT id, guild_id, channel_id, remind_at, status FROM reminders ORDER BY remind_at'
+        )
+
+
+async def claim_due_reminders(second_delay: datetime.timedelta, limit: int = 100):
+    """
+    期限の来たリマインダーを確保して返す。
+    各行の status は確保前の段階（'waiting' なら1回目、'notified_1st' なら2回目を送る）。
+    """
+    now_utc = datetime.datetime.now(datetime.timezone.utc)
+    async with acquire('claim_due_reminders') as conn:
+        return await conn.fetch(_CLAIM_DUE_REMINDERS_SQL, now_utc, second_delay, limit)
+
+
+async def release_reminder(reminder: dict):
+    """
+    送信に失敗したリマインダーを確保前の段階に戻し、戻した行を返す。
+    確保後に同じサーバーで新しいリマインダーが登録されていたら戻さずにNoneを返す。
+    """
+    async with acquire('release_reminder') as conn:
+        if reminder['status'] == 'waiting':
+            # 1回目: notified_1st に進めた行を waiting に戻す
+            return await conn.fetchrow(
+                '''UPDATE reminders SET status = 'waiting'
+                   WHERE id = $1 AND status = 'notified_1st' AND remind_at = $2
+                   RETURNING id, guild_id, channel_id, remind_at, status''',
+                reminder['id'], reminder['remind_at']
+            )
+        # 2回目: 削除した行を入れ直す
         return await conn.fetchrow(
-            'SELECT channel_id, remind_at, status FROM reminders ORDER BY remind_at LIMIT 1'
+            '''INSERT INTO reminders (id, guild_id, channel_id, remind_at, status)
+               SELECT $1, $2, $3, $4, 'notified_1st'
+               WHERE NOT EXISTS (SELECT 1 FROM reminders WHERE guild_id = $2)
+               ON CONFLICT DO NOTHING
+               RETURNING id, guild_id, channel_id, remind_at, status''',
+            reminder['id'], reminder['guild_id'], reminder['channel_id'], reminder['remind_at']
         )
 
 
-async def update_reminder_status(channel_id: int, new_status: str):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
+# ===========================
+# カウントアップ
+# ===========================
+
+async def add_countdown(guild_id: int, channel_id: int, message_id: int, start_at: datetime.datetime):
+    async with acquire('add_countdown') as conn:
         await conn.execute(
-            'UPDATE reminders SET status = $1 WHERE channel_id = $2',
-            new_status, channel_id
+            '''INSERT INTO countdowns (message_id, guild_id, channel_id, start_at) VALUES ($1, $2, $3, $4)
+               ON CONFLICT (message_id) DO NOTHING''',
+            message_id, guild_id, channel_id, start_at
         )
 
 
-async def clear_reminder():
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        await conn.execute('DELETE FROM reminders')
+async def get_countdowns():
+    async with acquire('get_countdowns') as conn:
+        return await conn.fetch('SELECT message_id, guild_id, channel_id, start_at FROM countdowns')
+
+
+async def remove_countdown(message_id: int):
+    async with acquire('remove_countdown') as conn:
+        await conn.execute('DELETE FROM countdowns WHERE message_id = $1', message_id)
 
 
 # ===========================
 # スキャン管理
 # ===========================
 
-async def is_scan_completed() -> bool:
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        record = await conn.fetchrow("SELECT value FROM settings WHERE key = 'scan_completed'")
-        return record and record['value'] == 'true'
+async def get_setting(key: str):
+    async with acquire('get_setting') as conn:
+        return await conn.fetchval('SELECT value FROM settings WHERE key = $1', key)
+
+
+async def set_setting(key: str, value: str):
+    async with acquire('set_setting') as conn:
+        await conn.execute('''
+            INSERT INTO settings (key, value) VALUES ($1, $2)
+            ON CONFLICT (key) DO UPDATE SET value = $2;
+        ''', key, value)
+
+
+# ===========================
+# 過去ログ取り込みの再開位置
+# ===========================
+
+async def get_backfill_checkpoints(channel_ids: list) -> dict:
+    """{channel_id: checkpoint record}（保存がないチャンネルは含まない）"""
+    async with acquire('get_backfill_checkpoints') as conn:
+        rows = await conn.fetch(
+            'SELECT * FROM backfill_checkpoints WHERE channel_id = ANY($1::bigint[])', channel_ids
+        )
+    return {row['channel_id']: row for row in rows}
+
+
+async def save_backfill_checkpoint(channel_id: int, guild_id: int, before_id, scanned: int,
+                                   found: int, completed: bool):
+    async with acquire('save_backfill_checkpoint') as conn:
+        await conn.execute('''
+            INSERT INTO backfill_checkpoints (channel_id, guild_id, before_id, scanned, found, completed)
+            VALUES ($1, $2, $3, $4, $5, $6)
+            ON CONFLICT (channel_id) DO UPDATE SET
+                before_id = EXCLUDED.before_id,
+                scanned = EXCLUDED.scanned,
+                found = EXCLUDED.found,
+                completed = EXCLUDED.completed,
+                updated_at = CURRENT_TIMESTAMP
+        ''', channel_id, guild_id, before_id, scanned, found, completed)
+
+
+async def reset_backfill_checkpoints(channel_ids: list):
+    async with acquire('reset_backfill_checkpoints') as conn:
+        await conn.execute(
+            'DELETE FROM backfill_checkpoints WHERE channel_id = ANY($1::bigint[])', channel_ids
+        )
 
 
 async def mark_scan_as_completed():
-    pool = await get_pool()
-    async with pool.acquire() as conn:
+    async with acquire('mark_scan_as_completed') as conn:
         await conn.execute("UPDATE settings SET value = 'true' WHERE key = 'scan_completed'")
 
 
@@ -339,8 +1431,7 @@ async def mark_scan_as_completed():
 # ===========================
 
 async def init_intro_bot_db():
-    pool = await get_pool()
-    async with pool.acquire() as conn:
+    async with acquire('init_intro_bot_db') as conn:
         await conn.execute('''
             CREATE TABLE IF NOT EXISTS introductions (
                 user_id BIGINT PRIMARY KEY,
@@ -351,8 +1442,7 @@ async def init_intro_bot_db():
 
 
 async def save_intro(user_id, channel_id, message_id):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
+    async with acquire('save_intro') as conn:
         await conn.execute('''
             INSERT INTO introductions (user_id, channel_id, message_id) VALUES ($1, $2, $3)
             ON CONFLICT (user_id) DO UPDATE SET channel_id = $2, message_id = $3;
@@ -360,8 +1450,7 @@ async def save_intro(user_id, channel_id, message_id):
 
 
 async def get_intro_ids(user_id):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
+    async with acquire('get_intro_ids') as conn:
         return await conn.fetchrow(
             "SELECT channel_id, message_id FROM introductions WHERE user_id = $1", user_id
         )
@@ -372,8 +1461,7 @@ async def get_intro_ids(user_id):
 # ===========================
 
 async def init_shugoshin_db():
-    pool = await get_pool()
-    async with pool.acquire() as conn:
+    async with acquire('init_shugoshin_db') as conn:
         await conn.execute('''
             CREATE TABLE IF NOT EXISTS reports (
                 report_id SERIAL PRIMARY KEY, guild_id BIGINT, message_id BIGINT,
@@ -398,8 +1486,7 @@ async def init_shugoshin_db():
 
 
 async def setup_guild(guild_id, report_channel_id, urgent_role_id):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
+    async with acquire('setup_guild') as conn:
         await conn.execute('''
             INSERT INTO guild_settings (guild_id, report_channel_id, urgent_role_id)
             VALUES ($1, $2, $3)
@@ -408,8 +1495,7 @@ async def setup_guild(guild_id, report_channel_id, urgent_role_id):
 
 
 async def get_guild_settings(guild_id):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
+    async with acquire('get_guild_settings') as conn:
         return await conn.fetchrow(
             "SELECT report_channel_id, urgent_role_id FROM guild_settings WHERE guild_id = $1",
             guild_id
@@ -417,8 +1503,7 @@ async def get_guild_settings(guild_id):
 
 
 async def check_cooldown(user_id, cooldown_seconds):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
+    async with acquire('check_cooldown') as conn:
         async with conn.transaction():
             record = await conn.fetchrow(
                 "SELECT last_report_at FROM report_cooldowns WHERE user_id = $1", user_id
@@ -436,8 +1521,7 @@ async def check_cooldown(user_id, cooldown_seconds):
 
 
 async def create_report(guild_id, target_user_id, violated_rule, details, message_link, urgency):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
+    async with acquire('create_report') as conn:
         return await conn.fetchval(
             '''INSERT INTO reports (guild_id, target_user_id, violated_rule, details, message_link, urgency)
                VALUES ($1, $2, $3, $4, $5, $6) RETURNING report_id''',
@@ -446,42 +1530,37 @@ async def create_report(guild_id, target_user_id, violated_rule, details, messag
 
 
 async def update_report_message_id(report_id, message_id):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
+    async with acquire('update_report_message_id') as conn:
         await conn.execute(
             "UPDATE reports SET message_id = $1 WHERE report_id = $2", message_id, report_id
         )
 
 
 async def update_report_status(report_id, new_status):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
+    async with acquire('update_report_status') as conn:
         await conn.execute(
             "UPDATE reports SET status = $1 WHERE report_id = $2", new_status, report_id
         )
 
 
 async def get_report(report_id):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
+    async with acquire('get_report') as conn:
         return await conn.fetchrow("SELECT * FROM reports WHERE report_id = $1", report_id)
 
 
 async def list_reports(status_filter=None):
-    pool = await get_pool()
     query = "SELECT report_id, target_user_id, status FROM reports"
     params = []
     if status_filter and status_filter != 'all':
         query += " WHERE status = $1"
         params.append(status_filter)
     query += " ORDER BY report_id DESC LIMIT 20"
-    async with pool.acquire() as conn:
+    async with acquire('list_reports') as conn:
         return await conn.fetch(query, *params)
 
 
 async def get_report_stats():
-    pool = await get_pool()
-    async with pool.acquire() as conn:
+    async with acquire('get_report_stats') as conn:
         stats = await conn.fetch('''
             SELECT status, COUNT(*) as count FROM reports GROUP BY status
         ''')
@@ -0,0 +1,181 @@
+# ingest.py - Bump書き込みキュー（ユーザーごとにまとめて一括書き込み）
+
+import asyncio
+import contextlib
+import logging
+from collections import OrderedDict
+import database as db
+from config import BUMP_FLUSH_MAX_BATCH, BUMP_FLUSH_INTERVAL_SECONDS, BUMP_DEDUP_WINDOW
+
+
+class BumpIngestQueue:
+    """Bumpを溜めておき、件数か時間のどちらかを満たしたら db.record_bump_events で一括記録する。
+
+    呼び出し側には1件ごとのFutureを返し、書き込み完了後にそのBump時点の
+    カウントで解決する（Embed表示用）。記録済みのメッセージだった場合は None で解決する。
+
+    同じDISBOARDメッセージが二重に届いても（再接続・二重起動・再スキャン）数えないよう、
+    直近のメッセージIDをメモリに覚えておき、DB側でもメッセージIDの一意制約で弾く。
+    """
+
+    def __init__(self, max_batch: int = BUMP_FLUSH_MAX_BATCH,
+                 max_delay: float = BUMP_FLUSH_INTERVAL_SECONDS,
+                 dedup_window: int = BUMP_DEDUP_WINDOW):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.dedup_window = dedup_window
+        self._pending = []  # [(イベントdict, Future)]（到着順）
+        self._seen = OrderedDict()  # 直近に受け付けたメッセージID（LRU）
+        self._timer = None
+        self._flush_lock = asyncio.Lock()
+        self._flush_tasks = set()
+        self.duplicates = 0
+
+    def claim(self, message_id: int) -> bool:
+        """メッセージIDを処理済みとして登録する。直近に登録済みなら False"""
+        if message_id in self._seen:
+            self._seen.move_to_end(message_id)
+            self.duplicates += 1
+            return False
+        self._seen[message_id] = None
+        if len(self._seen) > self.dedup_window:
+            self._seen.popitem(last=False)
+        return True
+
+    def release(self, message_id: int):
+        """書き込みに失敗したメッセージIDを忘れ、再処理できるようにする"""
+        self._seen.pop(message_id, None)
+
+    def enqueue(self, user_id: int, guild_id: int, channel_id: int, message_id: int,
+                bumped_at) -> asyncio.Future:
+        """Bumpを1件キューに積み、記録後の統計dict（重複ならNone）で解決するFutureを返す。
+        message_id は先に claim() しておくこと。
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        event = {
+            'message_id': message_id,
+            'user_id': user_id,
+            'guild_id': guild_id,
+            'channel_id': channel_id,
+            'bumped_at': bumped_at,
+        }
+        self._pending.append((event, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._start_flush)
+        return future
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        task = asyncio.create_task(self.flush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def flush(self):
+        """溜まっているBumpを書き込む。書き込みは直列化して順序を保つ"""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            batch, self._pending = self._pending, []
+            events = [event for event, _ in batch]
+
+            try:
+                results, duplicates = await db.record_bump_events(events)
+            except Exception as e:
+                logging.error(f"Bump一括書き込みエラー: {e}", exc_info=True)
+                for event, future in batch:
+                    self.release(event['message_id'])
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+            self.duplicates += len(duplicates)
+            if len(batch) > 1 or duplicates:
+                logging.info(
+                    f"Bump一括書き込み: {len(batch) - len(duplicates)}件 / {len(results)}人"
+                    f" (記録済みでスキップ: {len(duplicates)}件)"
+                )
+
+            totals = {}
+            for event, _ in batch:
+                if event['message_id'] not in duplicates:
+                    totals[event['user_id']] = totals.get(event['user_id'], 0) + 1
+
+            done = {}
+            for event, future in batch:
+                if event['message_id'] in duplicates:
+                    if not future.done():
+                        future.set_result(None)
+                    continue
+                user_id = event['user_id']
+                i = done.get(user_id, 0)
+                done[user_id] = i + 1
+                if future.done():
+                    continue
+                # まとめた i 件目の時点の値に戻す（同じ日なのでstreakは変わらない）
+                final = results[user_id]
+                behind = totals[user_id] - 1 - i
+                future.set_result({
+                    'bump_count': final['bump_count'] - behind,
+                    'current_streak': final['current_streak'],
+                    'max_streak': final['max_streak'],
+                    'weekly_count': max(final['weekly_count'] - behind, 1),
+                    'is_new_streak_record': final['is_new_streak_record'] and i == 0,
+                })
+
+    @contextlib.asynccontextmanager
+    async def exclusive(self):
+        """溜まっているBumpを書き出したうえで、抜けるまで次の書き込みを止める。
+        db.import_bump_history のようにユーザー状態をSQLで直接書き換える処理を、
+        キャッシュからの書き込みと重ねないために使う。
+        """
+        await self.flush()
+        async with self._flush_lock:
+            yield
+
+    async def close(self):
+        """残っているBumpをすべて書き込む"""
+        await self.flush()
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+
+
+_queue = None
+
+
+def get_queue() -> BumpIngestQueue:
+    """グローバルの書き込みキューを取得または作成"""
+    global _queue
+    if _queue is None:
+        _queue = BumpIngestQueue()
+    return _queue
+
+
+def claim(message_id: int) -> bool:
+    """メッセージIDを処理済みとして登録する。直近に処理済みなら False"""
+    return get_queue().claim(message_id)
+
+
+async def record_bump(user_id: int, guild_id: int, channel_id: int, message_id: int,
+                      bumped_at) -> dict:
+    """claim() 済みのBumpメッセージをキュー経由で記録する（重複ならNone）"""
+    return await get_queue().enqueue(user_id, guild_id, channel_id, message_id, bumped_at)
+
+
+async def close_queue():
+    """キューを書き出して破棄する"""
+    global _queue
+    if _queue is not None:
+        try:
+            await _queue.close()
+        finally:
+            _queue = None
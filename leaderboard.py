@@ -0,0 +1,255 @@
+# leaderboard.py - メモリ上のランキング（起動時に1回読み込み、Bumpごとに差分更新）
+
+import bisect
+
+
+class Leaderboard:
+    """Bump回数ごとの人数をFenwick木で持つランキング。
+
+    順位 = 自分より回数が多い人数 + 同じ回数の中での位置（user_id昇順）+ 1。
+    上位N件・指定ユーザーの順位・前後の順位をDBに問い合わせずに返せる。
+    更新・順位・k位の検索はいずれも O(log 最大回数)（同数内の挿入を除く）。
+    """
+
+    def __init__(self):
+        self._size = 1024  # Fenwick木が扱える最大回数（超えたら倍に広げる）
+        self._tree = [0] * (self._size + 1)
+        self._buckets = {}  # 回数 -> user_id の昇順リスト
+        self._counts = {}   # user_id -> 回数
+        self._streaks = {}  # user_id -> 現在の連続日数（表示用）
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._counts)
+
+    # --- Fenwick木 ---
+
+    def _add(self, index: int, delta: int):
+        while index <= self._size:
+            self._tree[index] += delta
+            index += index & -index
+
+    def _prefix(self, index: int) -> int:
+        """回数が index 以下の人数"""
+        total = 0
+        index = min(index, self._size)
+        while index > 0:
+            total += self._tree[index]
+            index -= index & -index
+        return total
+
+    def _grow(self, count: int):
+        while self._size < count:
+            self._size *= 2
+        self._tree = [0] * (self._size + 1)
+        for c, users in self._buckets.items():
+            self._add(c, len(users))
+
+    def _find(self, j: int) -> int:
+        """下から j 番目の人がいる回数（prefix(c) >= j となる最小の c）"""
+        pos = 0
+        step = 1 << self._size.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= self._size and self._tree[nxt] < j:
+                pos = nxt
+                j -= self._tree[nxt]
+            step >>= 1
+        return pos + 1
+
+    # --- 更新 ---
+
+    def clear(self):
+        self.__init__()
+
+    def load(self, rows):
+        """(user_id, 回数, 連続日数) の一覧で丸ごと作り直す"""
+        self.clear()
+        for user_id, count, streak in rows:
+            self.update(user_id, count, streak)
+        self.loaded = True
+
+    def update(self, user_id: int, count: int, streak: int = None):
+        """ユーザーの回数を更新する（0以下なら削除）"""
+        old = self._counts.get(user_id)
+        if streak is not None:
+            self._streaks[user_id] = streak
+        if old == count:
+            return
+        if old is not None:
+            bucket = self._buckets[old]
+            del bucket[bisect.bisect_left(bucket, user_id)]
+            if not bucket:
+                del self._buckets[old]
+            self._add(old, -1)
+            del self._counts[user_id]
+
+        if count <= 0:
+            self._streaks.pop(user_id, None)
+            return
+        if count > self._size:
+            self._grow(count)
+        bisect.insort(self._buckets.setdefault(count, []), user_id)
+        self._add(count, 1)
+        self._counts[user_id] = count
+
+    def remove(self, user_id: int):
+        self.update(user_id, 0)
+
+    # --- 参照 ---
+
+    def count_of(self, user_id: int) -> int:
+        return self._counts.get(user_id, 0)
+
+    def streak_of(self, user_id: int) -> int:
+        return self._streaks.get(user_id, 0)
+
+    def rank(self, user_id: int):
+        """順位（1始まり）。ランキングにいなければNone"""
+        count = self._counts.get(user_id)
+        if count is None:
+            return None
+        above = len(self._counts) - self._prefix(count)
+        return above + bisect.bisect_left(self._buckets[count], user_id) + 1
+
+    def at(self, rank: int):
+        """rank位のユーザーを record 形式のdictで返す"""
+        total = len(self._counts)
+        if rank < 1 or rank > total:
+            return None
+        count = self._find(total - rank + 1)
+        above = total - self._prefix(count)
+        user_id = self._buckets[count][rank - above - 1]
+        return self._entry(user_id)
+
+    def top(self, n: int, offset: int = 0) -> list:
+        """上位 offset+1 位から n 件"""
+        last = min(offset + n, len(self._counts))
+        return [self.at(r) for r in range(offset + 1, last + 1)]
+
+    def around(self, user_id: int, radius: int = 2) -> list:
+        """指定ユーザーの前後 radius 件（自分を含む）"""
+        r = self.rank(user_id)
+        if r is None:
+            return []
+        first = max(1, r - radius)
+        last = min(len(self._counts), r + radius)
+        return [self.at(i) for i in range(first, last + 1)]
+
+    def _entry(self, user_id: int) -> dict:
+        # DBの record と同じキーで返し、ランキング表示側をそのまま使えるようにする
+        return {
+            'user_id': user_id,
+            'bump_count': self._counts[user_id],
+            'current_streak': self._streaks.get(user_id, 0),
+        }
+
+
+# 累計ランキングと今週のランキング（全サーバー共通）
+all_time = Leaderboard()
+weekly = Leaderboard()
+weekly_start = None  # weekly が集計している週の開始日
+
+# サーバー別のランキング: guild_id -> その在籍者だけの Leaderboard。
+# 全体のランキングと同じ更新を在籍者の分だけ反映し、サーバー内の順位・上位N件も O(log) で返す
+guild_all_time = {}
+guild_weekly = {}
+
+# サーバーごとの在籍者（guild_members.active と同じ内容）と、その逆引き
+members = {}       # guild_id -> user_id の集合
+user_guilds = {}   # user_id -> guild_id の集合
+
+
+def _guild_board(boards: dict, guild_id: int) -> Leaderboard:
+    board = boards.get(guild_id)
+    if board is None:
+        board = boards[guild_id] = Leaderboard()
+        board.loaded = True
+    return board
+
+
+def all_time_for(guild_id: int = None) -> Leaderboard:
+    """累計ランキング（guild_id を指定するとそのサーバーの在籍者だけ）"""
+    return all_time if guild_id is None else guild_all_time.get(guild_id) or Leaderboard()
+
+
+def weekly_for(guild_id: int = None) -> Leaderboard:
+    """今週のランキング（guild_id を指定するとそのサーバーの在籍者だけ）"""
+    return weekly if guild_id is None else guild_weekly.get(guild_id) or Leaderboard()
+
+
+def load_members(rows):
+    """(guild_id, user_id) の一覧で在籍者とサーバー別のランキングを丸ごと作り直す"""
+    members.clear()
+    user_guilds.clear()
+    guild_all_time.clear()
+    guild_weekly.clear()
+    for guild_id, user_id in rows:
+        set_member(guild_id, user_id, True)
+
+
+def set_guild_members(guild_id: int, user_ids):
+    """サーバーのメンバー一覧で在籍者を置き換える（差分だけ反映する）"""
+    user_ids = set(user_ids)
+    current = members.get(guild_id, set())
+    for user_id in current - user_ids:
+        set_member(guild_id, user_id, False)
+    for user_id in user_ids - current:
+        set_member(guild_id, user_id, True)
+
+
+def set_member(guild_id: int, user_id: int, active: bool):
+    """在籍状態を変え、サーバー別のランキングに全体の値を写す・外す"""
+    if active:
+        if user_id in members.get(guild_id, ()):
+            return
+        members.setdefault(guild_id, set()).add(user_id)
+        user_guilds.setdefault(user_id, set()).add(guild_id)
+        for board, boards in ((all_time, guild_all_time), (weekly, guild_weekly)):
+            count = board.count_of(user_id)
+            if count:
+                _guild_board(boards, guild_id).update(user_id, count, board.streak_of(user_id))
+    else:
+        if user_id not in members.get(guild_id, ()):
+            return
+        members[guild_id].discard(user_id)
+        user_guilds[user_id].discard(guild_id)
+        if not user_guilds[user_id]:
+            del user_guilds[user_id]
+        for boards in (guild_all_time, guild_weekly):
+            if guild_id in boards:
+                boards[guild_id].remove(user_id)
+
+
+def reset_weekly(week_start):
+    """週が変わったら今週のランキングを空にする"""
+    global weekly_start
+    if weekly_start != week_start:
+        weekly.clear()
+        weekly.loaded = True
+        guild_weekly.clear()
+        weekly_start = week_start
+
+
+def apply_bump(user_id: int, bump_count: int, current_streak: int,
+               week_start, weekly_count: int):
+    """Bumpの書き込み結果をランキングに反映する"""
+    if not all_time.loaded:
+        return
+    all_time.update(user_id, bump_count, current_streak)
+    reset_weekly(week_start)
+    weekly.update(user_id, weekly_count, current_streak)
+    for guild_id in user_guilds.get(user_id, ()):
+        _guild_board(guild_all_time, guild_id).update(user_id, bump_count, current_streak)
+        _guild_board(guild_weekly, guild_id).update(user_id, weekly_count, current_streak)
+
+
+def reset_streaks(user_ids):
+    """連続記録が途切れたユーザーの表示用streakを0にする"""
+    for user_id in user_ids:
+        boards = [all_time, weekly]
+        for guild_id in user_guilds.get(user_id, ()):
+            boards += [guild_all_time.get(guild_id), guild_weekly.get(guild_id)]
+        for board in boards:
+            if board is not None and board.count_of(user_id):
+                board.update(user_id, board.count_of(user_id), 0)
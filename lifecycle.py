@@ -0,0 +1,66 @@
+# lifecycle.py - 終了処理のための「処理中の仕事」の管理
+#
+# 終了時は 新しい仕事の受け付けを止める → 処理中の仕事を（時間制限つきで）待つ
+# → 書き込みキュー・送信キューを書き出す → DBとゲートウェイを閉じる の順に進める。
+# 全体の流れは main.py の BumpkunBot.close() にある。
+
+import asyncio
+import collections
+import contextlib
+import logging
+
+
+class Lifecycle:
+    """処理中の仕事（Bump処理・リマインダー送信・カウントアップ編集）を種類ごとに数える"""
+
+    def __init__(self):
+        self.draining = False
+        self._inflight = collections.Counter()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def accepting(self) -> bool:
+        """新しい仕事を始めてよいか（終了処理に入ったら False）"""
+        return not self.draining
+
+    @contextlib.contextmanager
+    def track(self, kind: str):
+        """with の間を処理中の仕事として数える"""
+        self._inflight[kind] += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self._inflight[kind] -= 1
+            if not self._inflight[kind]:
+                del self._inflight[kind]
+            if not self._inflight:
+                self._idle.set()
+
+    def inflight(self) -> dict:
+        return dict(self._inflight)
+
+    def begin_drain(self):
+        self.draining = True
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """処理中の仕事がなくなるまで最大 timeout 秒待つ。待ちきれなければ False"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), max(timeout, 0))
+            return True
+        except asyncio.TimeoutError:
+            remaining = " / ".join(f"{kind}: {n}" for kind, n in self._inflight.items())
+            logging.warning(f"終了処理: 処理中の仕事を待ちきれませんでした（{remaining}）")
+            return False
+
+
+_lifecycle = None
+
+
+def get_lifecycle() -> Lifecycle:
+    """グローバルの Lifecycle を取得または作成"""
+    global _lifecycle
+    if _lifecycle is None:
+        _lifecycle = Lifecycle()
+    return _lifecycle
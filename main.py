@@ -2,16 +2,23 @@
 
 import os
 import signal
-import sys
 import asyncio
-import threading
+import contextlib
+import hashlib
+import json
 import logging
+import time
 import discord
 from discord.ext import commands
-from flask import Flask
 
 import database as db
-from config import TOKEN, PORT
+import ingest
+import lifecycle
+import metrics
+import outbound
+import profiling
+from config import TOKEN, PORT, SHUTDOWN_DRAIN_TIMEOUT_SECONDS
+from webserver import WebServer
 
 logging.basicConfig(level=logging.INFO)
 
@@ -21,105 +28,208 @@ COG_MODULES = [
     "cogs.ranking",
     "cogs.reminder",
     "cogs.admin",
+    "cogs.members",
+    "cogs.maintenance",
 ]
 
 
+# 起動にかかった時間（on_ready までを含む）を測る起点
+_PROCESS_STARTED = time.perf_counter()
+
+# コマンド定義のハッシュを保存する settings のキー
+COMMAND_TREE_HASH_KEY = 'command_tree_hash'
+
+
+class _StartupPhases:
+    """起動の段階ごとの所要時間を記録し、最後にまとめてログに出す"""
+
+    def __init__(self):
+        self.phases = {}
+
+    @contextlib.asynccontextmanager
+    async def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = (time.perf_counter() - started) * 1000
+
+    def summary(self) -> str:
+        parts = [f"{name} {ms:.0f}ms" for name, ms in self.phases.items()]
+        return " / ".join(parts) + f" (合計 {sum(self.phases.values()):.0f}ms)"
+
+
 # --- Bot本体 ---
 class BumpkunBot(commands.Bot):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._drain_task = None
+
     async def setup_hook(self) -> None:
         """起動時に1回だけ実行される初期化処理"""
+        startup = _StartupPhases()
         try:
-            await db.init_db()
+            # 終了シグナルで即座に落とさず、処理中の仕事を待ってから閉じる
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                with contextlib.suppress(NotImplementedError):  # Windows では使えない
+                    loop.add_signal_handler(sig, self._on_signal, sig)
+
+            # ヘルスチェックに応答できるよう、Webサーバーを最初に起動する
+            async with startup.phase("web"):
+                self.web = WebServer(self, PORT)
+                await self.web.start()
+
+            # コマンド・リスナーごとの Discord REST 時間を数えられるようにする
+            profiling.install_rest_timing(self)
+
+            async with startup.phase("db_init"):
+                await db.init_db()
             logging.info("DB初期化完了")
 
-            for cog in COG_MODULES:
-                await self.load_extension(cog)
-                logging.info(f"Cog読み込み: {cog}")
+            # 接続の事前確立・ランキングの読み込み・Cogの読み込みは同時に行う。
+            # Cog同士も読み込み時に他のCogを参照しない（get_cog は実行時にだけ使う）。
+            # 起動時の連続記録リセット（MaintenanceCog）はランキングの読み込みを待ってから実行する
+            async with startup.phase("warm_cogs"):
+                results = await asyncio.gather(
+                    db.warm_pool(),
+                    db.load_leaderboards(),
+                    *(self._load_cog(cog) for cog in COG_MODULES),
+                )
+            logging.info(f"DB接続の事前確立: {results[0]}本")
 
-            await self.tree.sync()
-            logging.info("スラッシュコマンド同期完了")
+            async with startup.phase("command_sync"):
+                await self._sync_commands()
 
         except Exception as e:
             logging.error(f"!!! 起動エラー: {e}", exc_info=True)
+        finally:
+            logging.info(f"起動時間: {startup.summary()}")
+
+    # --- 終了処理 ---
+
+    def _on_signal(self, sig):
+        if self._drain_task is not None:
+            logging.info(f"終了シグナル受信: {sig.name}（終了処理中）")
+            return
+        logging.info(f"終了シグナル受信: {sig.name}")
+        self._drain_task = asyncio.create_task(self._drain_and_close())
+
+    async def close(self) -> None:
+        """新しいBumpの受け付けを止め、処理中の仕事と書き込みを待ってからDBとゲートウェイを閉じる"""
+        if self._drain_task is None:
+            self._drain_task = asyncio.create_task(self._drain_and_close())
+        await asyncio.shield(self._drain_task)
+
+    async def _drain_and_close(self):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        deadline = loop.time() + SHUTDOWN_DRAIN_TIMEOUT_SECONDS
+
+        def remaining() -> float:
+            # 時間切れでも書き込みの書き出しなどには最低限の時間を残す
+            return max(deadline - loop.time(), 1.0)
+
+        life = lifecycle.get_lifecycle()
+        life.begin_drain()
+        if self.is_ready():  # ログイン前（起動失敗時など）はイベントを流せない
+            self.dispatch('drain')
+        logging.info(f"終了処理開始: 処理中 {life.inflight() or 'なし'}")
+
+        # 1. 処理中のBump・リマインダー送信・カウントアップ編集を待つ
+        await life.wait_idle(deadline - loop.time())
+        # 2. 溜まっているBumpを書き込む
+        try:
+            await asyncio.wait_for(ingest.close_queue(), remaining())
+            logging.info("Bump書き込みキュー終了完了")
+        except Exception as e:
+            logging.error(f"Bump書き込みキュー終了エラー: {e!r}")
+        # 3. 送信キューに残っている送信・編集を送る
+        try:
+            await outbound.get_dispatcher().drain(timeout=remaining())
+            logging.info("送信キュー終了完了")
+        except Exception as e:
+            logging.error(f"送信キュー終了エラー: {e!r}")
+        # 4. Webサーバー・DB・ゲートウェイを閉じる
+        try:
+            web = getattr(self, 'web', None)
+            if web is not None:
+                await web.stop()
+                logging.info("Webサーバー終了完了")
+        except Exception as e:
+            logging.error(f"Webサーバー終了エラー: {e}")
+        await db.close_pool(timeout=remaining())
+        try:
+            await super().close()
+            logging.info(f"Bot終了完了 ({(time.perf_counter() - started) * 1000:.0f}ms)")
+        except Exception as e:
+            logging.error(f"Bot終了エラー: {e}")
+
+    async def _load_cog(self, cog: str):
+        await self.load_extension(cog)
+        logging.info(f"Cog読み込み: {cog}")
+
+    def _command_tree_hash(self) -> str:
+        """登録するスラッシュコマンドの定義（Discordに送る内容そのもの）のハッシュ"""
+        payload = sorted(
+            (command.to_dict(self.tree) for command in self.tree.get_commands()),
+            key=lambda c: c['name'],
+        )
+        data = json.dumps([self.application_id, payload], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    async def _sync_commands(self):
+        """コマンド定義が前回の同期から変わったときだけ同期する（tree.sync はレート制限が厳しい）"""
+        current = self._command_tree_hash()
+        if await db.get_setting(COMMAND_TREE_HASH_KEY) == current:
+            logging.info("スラッシュコマンド同期: 変更なしのためスキップ")
+            return
+        await self.tree.sync()
+        await db.set_setting(COMMAND_TREE_HASH_KEY, current)
+        logging.info("スラッシュコマンド同期完了")
 
 
 intents = discord.Intents.default()
 intents.messages = True
 intents.message_content = True
 intents.guilds = True
+intents.members = True  # 参加・退出の追跡用（Developer Portalで Server Members Intent を有効にすること）
 
 bot = BumpkunBot(command_prefix='/', intents=intents)
 
 
+_ready_logged = False
+
+
 @bot.event
 async def on_ready():
+    global _ready_logged
     logging.info(f"------\nBot起動完了: {bot.user.name}\n------")
+    # 再接続でも呼ばれるので、プロセス起動からの時間は最初の1回だけ出す
+    if not _ready_logged:
+        _ready_logged = True
+        logging.info(f"起動からreadyまで: {(time.perf_counter() - _PROCESS_STARTED) * 1000:.0f}ms")
 
 
 @bot.event
 async def on_disconnect():
-    try:
-        logging.info("Bot切断 - DBプール終了中...")
-        await db.close_pool()
-    except Exception as e:
-        logging.error(f"切断時エラー: {e}")
-
-
-# --- Webサーバー（スリープ対策） ---
-app = Flask(__name__)
-
-
-@app.route('/')
-def index():
-    return "BUMPくん v3 is running!", 200
-
+    # 一時的な切断はライブラリが再接続・RESUMEする。DBプールは閉じない
+    # （閉じると再開直後のBumpが全接続の張り直しを待つことになる）
+    logging.warning("ゲートウェイ切断（自動で再接続します）")
 
-@app.route('/health')
-def health_check():
-    return "OK", 200
 
-
-def run_web_server():
-    app.run(host='0.0.0.0', port=PORT)
-
-
-# --- シグナルハンドラー ---
-def signal_handler(sig, frame):
-    logging.info("終了シグナル受信...")
-    try:
-        loop = asyncio.get_event_loop()
-        if loop.is_running():
-            asyncio.create_task(_shutdown())
-        else:
-            asyncio.run(_shutdown())
-    except Exception as e:
-        logging.error(f"終了処理エラー: {e}")
-    finally:
-        sys.exit(0)
-
-
-async def _shutdown():
-    try:
-        await db.close_pool()
-        logging.info("DB終了完了")
-    except Exception as e:
-        logging.error(f"DB終了エラー: {e}")
-    try:
-        await bot.close()
-        logging.info("Bot終了完了")
-    except Exception as e:
-        logging.error(f"Bot終了エラー: {e}")
+@bot.event
+async def on_resumed():
+    logging.info("ゲートウェイ再開")
 
 
-signal.signal(signal.SIGINT, signal_handler)
-signal.signal(signal.SIGTERM, signal_handler)
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    metrics.COMMANDS.inc(command.qualified_name)
 
 
 # --- 起動 ---
 def main():
-    web_thread = threading.Thread(target=run_web_server, daemon=True)
-    web_thread.start()
-
     if TOKEN:
         try:
             bot.run(TOKEN)
@@ -127,12 +237,6 @@ def main():
             logging.info("Bot停止 (KeyboardInterrupt)")
         except Exception as e:
             logging.error(f"!!! FATAL: {e}", exc_info=True)
-        finally:
-            try:
-                asyncio.run(db.close_pool())
-                logging.info("最終クリーンアップ完了")
-            except Exception as e:
-                logging.error(f"最終クリーンアップエラー: {e}")
     else:
         logging.error("!!! FATAL: DISCORD_BOT_TOKEN が設定されていません")
 
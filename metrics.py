@@ -0,0 +1,138 @@
+# metrics.py - Prometheus形式のメトリクス（/metrics で公開する）
+#
+# 外部ライブラリを増やさないよう、必要な分だけの最小実装。
+# 値の記録はイベントループ上からのみ行う前提（ロックなし）。
+
+import math
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(label: str, value, extra: str = "") -> str:
+    parts = []
+    if label is not None:
+        parts.append(f'{label}="{_escape(value)}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and math.isnan(value):
+        return "NaN"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """増えるだけの値（ラベルは1種類まで）"""
+
+    def __init__(self, name: str, help_text: str, label: str = None):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._values = {}
+
+    def inc(self, label_value=None, amount: float = 1):
+        self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for value, total in sorted(self._values.items(), key=lambda kv: str(kv[0])):
+            lines.append(f"{self.name}{_labels(self.label, value)} {_number(total)}")
+        return lines
+
+
+class Gauge:
+    """出力のたびに fn() で読む値。fn は数値か {ラベル値: 数値} を返す"""
+
+    def __init__(self, name: str, help_text: str, fn, label: str = None):
+        self.name = name
+        self.help_text = help_text
+        self.fn = fn
+        self.label = label
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        value = self.fn()
+        if isinstance(value, dict):
+            for key, v in value.items():
+                lines.append(f"{self.name}{_labels(self.label, key)} {_number(v)}")
+        elif value is not None:
+            lines.append(f"{self.name} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    """所要時間などの分布（累積バケット）"""
+
+    def __init__(self, name: str, help_text: str, buckets, label: str = None):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = sorted(buckets)
+        self.label = label
+        self._series = {}  # ラベル値 -> [バケットごとの件数..., 合計, 件数]
+
+    def observe(self, value: float, label_value=None):
+        series = self._series.get(label_value)
+        if series is None:
+            series = self._series[label_value] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for value, series in sorted(self._series.items(), key=lambda kv: str(kv[0])):
+            for bound, count in zip(self.buckets, series):
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label, value, le)} {count}")
+            inf = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.label, value, inf)} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.label, value)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.label, value)} {series[-1]}")
+        return lines
+
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# --- 記録する側から使うメトリクス ---
+BUMP_STAGE_SECONDS = Histogram(
+    "bumpkun_bump_stage_seconds",
+    "Seconds from bump detection until each processing stage finished.",
+    (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    label="stage",
+)
+BUMPS = Counter("bumpkun_bumps_total", "Bumps processed, by slot animation mode.", label="mode")
+DB_ACQUIRE_WAIT_SECONDS = Histogram(
+    "bumpkun_db_acquire_wait_seconds",
+    "Seconds spent waiting for a connection from the asyncpg pool.",
+    _LATENCY_BUCKETS,
+)
+DB_QUERY_SECONDS = Histogram(
+    "bumpkun_db_query_seconds",
+    "Seconds spent executing each named database query.",
+    _LATENCY_BUCKETS,
+    label="query",
+)
+COMMANDS = Counter("bumpkun_commands_total", "Slash commands completed, by command.", label="command")
+
+_registry = [BUMP_STAGE_SECONDS, BUMPS, DB_ACQUIRE_WAIT_SECONDS, DB_QUERY_SECONDS, COMMANDS]
+
+
+def register(metric):
+    """出力対象に追加する（Gaugeなど、Botやプールに依存するものは起動時に登録する）"""
+    _registry.append(metric)
+    return metric
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,369 @@
+# migrations.py - バージョン管理付きスキーマ移行
+#
+# 起動時に schema_version の最大値だけを確認し、最新なら何もしない。
+# 新しいスキーマ変更は MIGRATIONS の末尾にバージョンを増やして追加すること
+# （既存のステップは書き換えない）。
+
+import logging
+import time
+
+# 複数プロセスが同時に起動しても移行が1回だけ走るようにするためのロックキー
+_MIGRATION_LOCK_KEY = 0x42554D50  # "BUMP"
+
+# CREATE INDEX CONCURRENTLY は大きなテーブルで時間がかかるので長めに待つ
+_MIGRATION_TIMEOUT = 600
+
+# version: 昇順・欠番なし / transactional: False のステップはトランザクション外で
+# 1文ずつ実行する（CREATE INDEX CONCURRENTLY はトランザクション内で実行できない）。
+# トランザクション外のステップは途中失敗しても再実行できるように書くこと。
+MIGRATIONS = [
+    {
+        "version": 1,
+        "name": "v3の基本テーブル",
+        "transactional": True,
+        "statements": [
+            '''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id BIGINT PRIMARY KEY,
+                bump_count INTEGER NOT NULL DEFAULT 0,
+                last_bump_date DATE,
+                current_streak INTEGER NOT NULL DEFAULT 0,
+                max_streak INTEGER NOT NULL DEFAULT 0
+            );
+            ''',
+            # v2からの移行: 既存テーブルにstreak列がなければ追加
+            'ALTER TABLE users ADD COLUMN IF NOT EXISTS last_bump_date DATE;',
+            'ALTER TABLE users ADD COLUMN IF NOT EXISTS current_streak INTEGER NOT NULL DEFAULT 0;',
+            'ALTER TABLE users ADD COLUMN IF NOT EXISTS max_streak INTEGER NOT NULL DEFAULT 0;',
+            '''
+            CREATE TABLE IF NOT EXISTS weekly_bumps (
+                user_id BIGINT NOT NULL,
+                week_start DATE NOT NULL,
+                bump_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, week_start)
+            );
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS reminders (
+                id SERIAL PRIMARY KEY,
+                channel_id BIGINT NOT NULL,
+                remind_at TIMESTAMP WITH TIME ZONE NOT NULL,
+                status TEXT NOT NULL DEFAULT 'waiting'
+            );
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            ''',
+            '''
+            INSERT INTO settings (key, value) VALUES ('scan_completed', 'false')
+            ON CONFLICT (key) DO NOTHING;
+            ''',
+        ],
+    },
+    {
+        "version": 2,
+        "name": "ランキング・リマインダー用インデックス",
+        "transactional": False,
+        "statements": [
+            # 前回の CONCURRENTLY が途中で失敗すると INVALID なインデックスが残るため、
+            # 作り直せるように先に DROP する
+            'DROP INDEX CONCURRENTLY IF EXISTS idx_users_bump_count;',
+            'CREATE INDEX CONCURRENTLY idx_users_bump_count ON users (bump_count DESC);',
+            'DROP INDEX CONCURRENTLY IF EXISTS idx_weekly_bumps_week_count;',
+            'CREATE INDEX CONCURRENTLY idx_weekly_bumps_week_count ON weekly_bumps (week_start, bump_count DESC);',
+            'DROP INDEX CONCURRENTLY IF EXISTS idx_reminders_remind_at;',
+            'CREATE INDEX CONCURRENTLY idx_reminders_remind_at ON reminders (remind_at);',
+        ],
+    },
+    {
+        "version": 3,
+        "name": "集計カウンター（サーバー合計・週合計・サーバー別合計）",
+        "transactional": True,
+        "statements": [
+            '''
+            CREATE TABLE IF NOT EXISTS bump_counters (
+                scope TEXT NOT NULL,
+                scope_key TEXT NOT NULL,
+                total BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (scope, scope_key)
+            );
+            ''',
+            # 既存データから初期値を入れる（guild別は元データがないので0から）
+            '''
+            INSERT INTO bump_counters (scope, scope_key, total)
+            SELECT 'server', '', COALESCE(SUM(bump_count), 0) FROM users
+            ON CONFLICT (scope, scope_key) DO NOTHING;
+            ''',
+            '''
+            INSERT INTO bump_counters (scope, scope_key, total)
+            SELECT 'week', week_start::text, SUM(bump_count) FROM weekly_bumps GROUP BY week_start
+            ON CONFLICT (scope, scope_key) DO NOTHING;
+            ''',
+        ],
+    },
+    {
+        "version": 4,
+        "name": "サーバー在籍状態（users.active / left_at）",
+        "transactional": True,
+        "statements": [
+            'ALTER TABLE users ADD COLUMN IF NOT EXISTS active BOOLEAN NOT NULL DEFAULT TRUE;',
+            'ALTER TABLE users ADD COLUMN IF NOT EXISTS left_at TIMESTAMP WITH TIME ZONE;',
+        ],
+    },
+    {
+        "version": 5,
+        "name": "在籍者だけの累計ランキング用インデックス",
+        "transactional": False,
+        "statements": [
+            'DROP INDEX CONCURRENTLY IF EXISTS idx_users_active_bump_count;',
+            'CREATE INDEX CONCURRENTLY idx_users_active_bump_count ON users (bump_count DESC) WHERE active;',
+        ],
+    },
+    {
+        "version": 6,
+        "name": "リマインダーをサーバー・チャンネル単位に",
+        "transactional": True,
+        "statements": [
+            # 既存の1件はサーバー不明(0)として残す
+            'ALTER TABLE reminders ADD COLUMN IF NOT EXISTS guild_id BIGINT NOT NULL DEFAULT 0;',
+            '''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_reminders_guild_channel
+            ON reminders (guild_id, channel_id);
+            ''',
+        ],
+    },
+    {
+        "version": 7,
+        "name": "カウントアップ中のメッセージ",
+        "transactional": True,
+        "statements": [
+            '''
+            CREATE TABLE IF NOT EXISTS countdowns (
+                message_id BIGINT PRIMARY KEY,
+                guild_id BIGINT NOT NULL DEFAULT 0,
+                channel_id BIGINT NOT NULL,
+                start_at TIMESTAMP WITH TIME ZONE NOT NULL
+            );
+            ''',
+        ],
+    },
+    {
+        "version": 8,
+        "name": "Bumpイベントログ（DISBOARDのメッセージIDで重複排除）",
+        "transactional": True,
+        "statements": [
+            '''
+            CREATE TABLE IF NOT EXISTS bump_events (
+                message_id BIGINT PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                guild_id BIGINT NOT NULL DEFAULT 0,
+                channel_id BIGINT NOT NULL,
+                bumped_at TIMESTAMP WITH TIME ZONE NOT NULL
+            );
+            ''',
+            # イベントログ導入前にスキャン済みのBumpはログに載っていないので、
+            # 再スキャンで二重に数えないよう印を残しておく
+            '''
+            INSERT INTO settings (key, value)
+            SELECT 'scan_before_event_log', value FROM settings WHERE key = 'scan_completed'
+            ON CONFLICT (key) DO NOTHING;
+            ''',
+        ],
+    },
+    {
+        "version": 9,
+        "name": "Bumpイベントログを月別パーティションに / 日別・週別の集計テーブル",
+        "transactional": True,
+        "statements": [
+            # パーティションテーブルの主キーには分割キーを含める必要がある。
+            # bumped_at はメッセージIDから決まる時刻なので、(message_id, bumped_at) でも重複排除できる
+            'ALTER TABLE bump_events RENAME TO bump_events_v8;',
+            'ALTER INDEX bump_events_pkey RENAME TO bump_events_v8_pkey;',
+            '''
+            CREATE TABLE bump_events (
+                message_id BIGINT NOT NULL,
+                user_id BIGINT NOT NULL,
+                guild_id BIGINT NOT NULL DEFAULT 0,
+                channel_id BIGINT NOT NULL,
+                bumped_at TIMESTAMP WITH TIME ZONE NOT NULL,
+                PRIMARY KEY (message_id, bumped_at)
+            ) PARTITION BY RANGE (bumped_at);
+            ''',
+            # 既存イベントのある月のパーティションを作る（境界はUTCの月初）
+            '''
+            DO $$
+            DECLARE
+                month DATE;
+            BEGIN
+                FOR month IN
+                    SELECT DISTINCT date_trunc('month', bumped_at AT TIME ZONE 'UTC')::date
+                    FROM bump_events_v8
+                LOOP
+                    EXECUTE format(
+                        'CREATE TABLE IF NOT EXISTS %I PARTITION OF bump_events '
+                        'FOR VALUES FROM (%L) TO (%L)',
+                        'bump_events_' || to_char(month, 'YYYYMM'),
+                        month::text || ' 00:00+00',
+                        (month + INTERVAL '1 month')::date::text || ' 00:00+00'
+                    );
+                END LOOP;
+            END
+            $$;
+            ''',
+            'INSERT INTO bump_events SELECT message_id, user_id, guild_id, channel_id, bumped_at FROM bump_events_v8;',
+            'DROP TABLE bump_events_v8;',
+            '''
+            CREATE TABLE IF NOT EXISTS bump_daily (
+                day DATE NOT NULL,
+                guild_id BIGINT NOT NULL,
+                user_id BIGINT NOT NULL,
+                bump_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, guild_id, user_id)
+            );
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS bump_weekly (
+                week_start DATE NOT NULL,
+                guild_id BIGINT NOT NULL,
+                user_id BIGINT NOT NULL,
+                bump_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (week_start, guild_id, user_id)
+            );
+            ''',
+            '''
+            INSERT INTO bump_daily (day, guild_id, user_id, bump_count)
+            SELECT bumped_at::date, guild_id, user_id, COUNT(*)
+            FROM bump_events GROUP BY 1, 2, 3;
+            ''',
+            '''
+            INSERT INTO bump_weekly (week_start, guild_id, user_id, bump_count)
+            SELECT date_trunc('week', bumped_at)::date, guild_id, user_id, COUNT(*)
+            FROM bump_events GROUP BY 1, 2, 3;
+            ''',
+        ],
+    },
+    {
+        "version": 10,
+        "name": "過去ログ取り込みの再開位置",
+        "transactional": True,
+        "statements": [
+            '''
+            CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+                channel_id BIGINT PRIMARY KEY,
+                guild_id BIGINT NOT NULL DEFAULT 0,
+                before_id BIGINT,
+                scanned BIGINT NOT NULL DEFAULT 0,
+                found BIGINT NOT NULL DEFAULT 0,
+                completed BOOLEAN NOT NULL DEFAULT FALSE,
+                updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+            );
+            ''',
+        ],
+    },
+    {
+        "version": 11,
+        "name": "連続記録リセット用インデックス",
+        "transactional": False,
+        "statements": [
+            # 連続中(current_streak > 0)の人だけを最終Bump日順に持つ。
+            # リセットされた行はインデックスから外れるので、毎晩の処理は途切れた人だけを読む
+            'DROP INDEX CONCURRENTLY IF EXISTS idx_users_streak_last_bump_date;',
+            'CREATE INDEX CONCURRENTLY idx_users_streak_last_bump_date ON users (last_bump_date) WHERE current_streak > 0;',
+        ],
+    },
+    {
+        "version": 12,
+        "name": "サーバーごとの在籍状態（guild_members）",
+        "transactional": True,
+        "statements": [
+            # users.active は全サーバー共通の1フラグで、どこか1つを抜けると全サーバーのランキングから
+            # 消えていた。以後は (guild_id, user_id) 単位で持つ
+            '''
+            CREATE TABLE IF NOT EXISTS guild_members (
+                guild_id BIGINT NOT NULL,
+                user_id BIGINT NOT NULL,
+                active BOOLEAN NOT NULL DEFAULT TRUE,
+                left_at TIMESTAMP WITH TIME ZONE,
+                PRIMARY KEY (guild_id, user_id)
+            );
+            ''',
+            # 起動時のメンバー同期までのつなぎとして、Bumpしたことのあるサーバーに旧フラグの状態で入れておく
+            '''
+            INSERT INTO guild_members (guild_id, user_id, active, left_at)
+            SELECT DISTINCT d.guild_id, d.user_id, u.active, u.left_at
+            FROM bump_daily d JOIN users u ON u.user_id = d.user_id
+            WHERE d.guild_id <> 0
+            ON CONFLICT (guild_id, user_id) DO NOTHING;
+            ''',
+            # 旧フラグと v5 のインデックスは使わなくなったので消す
+            'DROP INDEX IF EXISTS idx_users_active_bump_count;',
+            'ALTER TABLE users DROP COLUMN IF EXISTS active, DROP COLUMN IF EXISTS left_at;',
+        ],
+    },
+]
+
+LATEST_VERSION = MIGRATIONS[-1]["version"]
+
+
+async def get_schema_version(conn) -> int:
+    """適用済みの最新バージョン（未作成なら0）"""
+    exists = await conn.fetchval("SELECT to_regclass('schema_version') IS NOT NULL")
+    if not exists:
+        return 0
+    return await conn.fetchval('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+
+
+async def migrate(conn) -> int:
+    """未適用のステップを順番に適用し、適用後のバージョンを返す"""
+    # 最新なら何もしない（通常の起動はここで終わる）
+    current = await get_schema_version(conn)
+    if current >= LATEST_VERSION:
+        return current
+
+    await conn.execute('SELECT pg_advisory_lock($1)', _MIGRATION_LOCK_KEY)
+    try:
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+            );
+        ''')
+        # ロック待ちの間に別プロセスが適用済みの可能性があるので読み直す
+        current = await get_schema_version(conn)
+
+        for step in MIGRATIONS:
+            if step["version"] <= current:
+                continue
+
+            started = time.perf_counter()
+            logging.info(f"スキーマ移行 v{step['version']}: {step['name']}")
+
+            if step["transactional"]:
+                async with conn.transaction():
+                    for statement in step["statements"]:
+                        await conn.execute(statement, timeout=_MIGRATION_TIMEOUT)
+                    await _mark_applied(conn, step)
+            else:
+                for statement in step["statements"]:
+                    await conn.execute(statement, timeout=_MIGRATION_TIMEOUT)
+                await _mark_applied(conn, step)
+
+            current = step["version"]
+            logging.info(
+                f"スキーマ移行 v{current} 完了 ({time.perf_counter() - started:.2f}秒)"
+            )
+    finally:
+        await conn.execute('SELECT pg_advisory_unlock($1)', _MIGRATION_LOCK_KEY)
+
+    return current
+
+
+async def _mark_applied(conn, step):
+    await conn.execute(
+        'INSERT INTO schema_version (version, name) VALUES ($1, $2) ON CONFLICT (version) DO NOTHING',
+        step["version"], step["name"]
+    )
@@ -0,0 +1,213 @@
+# outbound.py - Discordへの送信・編集をまとめて捌く送信キュー（チャンネル単位のレート制御）
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+import profiling
+
+# 優先度（小さいほど先に送る）
+PRIORITY_BUMP = 0       # Bump結果（スロット・Embed・お祝い）
+PRIORITY_REMINDER = 1   # リマインダー
+PRIORITY_COUNTDOWN = 2  # カウントアップの編集
+
+PRIORITY_NAMES = {
+    PRIORITY_BUMP: "bump",
+    PRIORITY_REMINDER: "reminder",
+    PRIORITY_COUNTDOWN: "countdown",
+}
+
+# Discordのメッセージ送信・編集はチャンネルごとにおよそ5回/5秒まで
+CHANNEL_BUCKET_CAPACITY = 5
+CHANNEL_BUCKET_PER_SECOND = 1.0
+
+
+class _ChannelBucket:
+    """チャンネルごとのレート制限をトークンバケットで見積もる"""
+
+    def __init__(self):
+        self.tokens = float(CHANNEL_BUCKET_CAPACITY)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            CHANNEL_BUCKET_CAPACITY,
+            self.tokens + (now - self.updated) * CHANNEL_BUCKET_PER_SECOND,
+        )
+        self.updated = now
+
+    def remaining(self) -> float:
+        self._refill()
+        return self.tokens
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / CHANNEL_BUCKET_PER_SECOND)
+
+
+class _Job:
+    __slots__ = ("priority", "kind", "target", "kwargs", "futures")
+
+    def __init__(self, priority, kind, target, kwargs, future):
+        self.priority = priority
+        self.kind = kind        # "send" / "edit"
+        self.target = target    # send: チャンネル / edit: メッセージ
+        self.kwargs = kwargs
+        self.futures = [future]
+
+
+class OutboundDispatcher:
+    """全Cogの channel.send / message.edit を受け付け、チャンネルごとに優先度順で実行する。
+
+    - 同じチャンネルのジョブは優先度順（同じ優先度なら受付順）に1つずつ実行する
+    - 同じメッセージへの未実行の編集は最新の内容1回にまとめる
+    - チャンネルごとのレート制限はトークンバケットで見積もって待つ
+    """
+
+    def __init__(self):
+        self._queues = {}    # channel_id -> [(priority, 連番, job)]
+        self._edits = {}     # message_id -> 未実行の編集ジョブ（まとめる用）
+        self._buckets = {}   # channel_id -> _ChannelBucket
+        self._workers = {}   # channel_id -> Task
+        self._seq = itertools.count()
+        self.sent = 0
+        self.edited = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    # --- 受付 ---
+
+    def send(self, channel, priority: int = PRIORITY_BUMP, **kwargs) -> asyncio.Future:
+        """channel.send(**kwargs) を予約する。送信したMessageで解決するFutureを返す"""
+        return self._submit(channel.id, _Job(priority, "send", channel, kwargs, self._future()))
+
+    def edit(self, message, priority: int = PRIORITY_BUMP, **kwargs) -> asyncio.Future:
+        """message.edit(**kwargs) を予約する。未実行の編集があれば内容を差し替える"""
+        pending = self._edits.get(message.id)
+        if pending is not None:
+            pending.kwargs.update(kwargs)
+            pending.futures.append(self._future())
+            if priority < pending.priority:
+                pending.priority = priority
+                self._requeue(message.channel.id)
+            self.coalesced += 1
+            return pending.futures[-1]
+
+        job = _Job(priority, "edit", message, kwargs, self._future())
+        self._edits[message.id] = job
+        return self._submit(message.channel.id, job)
+
+    def remaining(self, channel_id: int) -> float:
+        """チャンネルのレート制限の残り（見積もり）。未使用なら満タン"""
+        bucket = self._buckets.get(channel_id)
+        return bucket.remaining() if bucket else float(CHANNEL_BUCKET_CAPACITY)
+
+    def queue_depth(self, channel_id: int = None) -> int:
+        if channel_id is not None:
+            return len(self._queues.get(channel_id, ()))
+        return sum(len(q) for q in self._queues.values())
+
+    def stats(self) -> dict:
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for queue in self._queues.values():
+            for _, _, job in queue:
+                depth[PRIORITY_NAMES.get(job.priority, str(job.priority))] += 1
+        return {
+            'depth': depth,
+            'channels': len(self._workers),
+            'sent': self.sent,
+            'edited': self.edited,
+            'coalesced': self.coalesced,
+            'failed': self.failed,
+        }
+
+    def _future(self):
+        return asyncio.get_running_loop().create_future()
+
+    def _submit(self, channel_id: int, job: _Job) -> asyncio.Future:
+        queue = self._queues.setdefault(channel_id, [])
+        heapq.heappush(queue, (job.priority, next(self._seq), job))
+        if channel_id not in self._workers:
+            self._workers[channel_id] = asyncio.create_task(self._run(channel_id))
+        return job.futures[0]
+
+    def _requeue(self, channel_id: int):
+        """優先度を上げたジョブがあるので並べ直す。
+        ワーカーが同じリストを持ったまま待っているので、差し替えずにその場で並べ直す
+        """
+        queue = self._queues.get(channel_id)
+        if queue:
+            queue[:] = [(job.priority, seq, job) for _, seq, job in queue]
+            heapq.heapify(queue)
+
+    # --- 実行 ---
+
+    async def _run(self, channel_id: int):
+        # ワーカーは最初に送った処理のコンテキストを引き継ぐが、後続の送信は別の処理のもの
+        profiling.detach()
+        bucket = self._buckets.setdefault(channel_id, _ChannelBucket())
+        try:
+            while self._queues.get(channel_id):
+                await bucket.acquire()
+                _, _, job = heapq.heappop(self._queues[channel_id])
+                if job.kind == "edit":
+                    self._edits.pop(job.target.id, None)
+                await self._execute(job)
+        finally:
+            self._workers.pop(channel_id, None)
+            if not self._queues.get(channel_id):
+                self._queues.pop(channel_id, None)
+
+    async def _execute(self, job: _Job):
+        try:
+            if job.kind == "send":
+                result = await job.target.send(**job.kwargs)
+                self.sent += 1
+            else:
+                result = await job.target.edit(**job.kwargs)
+                self.edited += 1
+        except Exception as e:
+            self.failed += 1
+            for future in job.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future in job.futures:
+            if not future.done():
+                future.set_result(result)
+
+    async def drain(self, timeout: float = None):
+        """予約済みのジョブがすべて終わるまで待つ"""
+        workers = list(self._workers.values())
+        if not workers:
+            return
+        done, pending = await asyncio.wait(workers, timeout=timeout)
+        if pending:
+            logging.warning(f"送信キュー: {self.queue_depth()}件を残して終了")
+            for task in pending:
+                task.cancel()
+
+
+_dispatcher = None
+
+
+def get_dispatcher() -> OutboundDispatcher:
+    """グローバルの送信キューを取得または作成"""
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = OutboundDispatcher()
+    return _dispatcher
+
+
+def send(channel, priority: int = PRIORITY_BUMP, **kwargs) -> asyncio.Future:
+    return profiling.track_future(get_dispatcher().send(channel, priority, **kwargs))
+
+
+def edit(message, priority: int = PRIORITY_BUMP, **kwargs) -> asyncio.Future:
+    return profiling.track_future(get_dispatcher().edit(message, priority, **kwargs))
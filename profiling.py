@@ -0,0 +1,184 @@
+# profiling.py - リスナー・コマンド・定期タスクの所要時間の内訳（Discord REST / DB / その他）
+#
+# @profiled("名前") を付けた処理の1回ごとに Span を作り、その処理（と処理から作られたタスク）の
+# 中で発生した Discord REST の待ち時間と DB の時間を contextvars 経由で加算する。
+# PROFILE_SLOW_MS を超えた回は内訳付きでログに残す。
+
+import asyncio
+import contextvars
+import cProfile
+import functools
+import io
+import logging
+import pstats
+import time
+from config import PROFILE_SLOW_MS
+
+_current = contextvars.ContextVar("profile_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "started", "rest", "db")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.rest = 0.0  # Discord REST（送信キューの待ちを含む）
+        self.db = 0.0    # DB（接続待ち + 実行）
+
+
+class _Totals:
+    __slots__ = ("calls", "errors", "wall", "rest", "db", "max_wall", "slow")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.wall = 0.0
+        self.rest = 0.0
+        self.db = 0.0
+        self.max_wall = 0.0
+        self.slow = 0
+
+
+_totals = {}  # 名前 -> _Totals
+
+
+def add_rest(seconds: float):
+    span = _current.get()
+    if span is not None:
+        span.rest += seconds
+
+
+def add_db(seconds: float):
+    span = _current.get()
+    if span is not None:
+        span.db += seconds
+
+
+def detach():
+    """この先（このタスク内）の時間をどの処理にも数えない。
+    送信キューのワーカーのように、別の処理から作られて長く動き続けるタスク用。
+    """
+    _current.set(None)
+
+
+def track_future(future: asyncio.Future) -> asyncio.Future:
+    """Futureが完了するまでの時間を、いまの処理の Discord REST 時間に数える"""
+    span = _current.get()
+    if span is not None:
+        started = time.perf_counter()
+
+        def _done(_):
+            span.rest += time.perf_counter() - started
+
+        future.add_done_callback(_done)
+    return future
+
+
+def profiled(name: str, slow_ms: float = PROFILE_SLOW_MS):
+    """async関数の1回ごとの所要時間と内訳を記録するデコレーター。
+    Cog.listener / app_commands.command / tasks.loop の内側（関数の直上）に付ける。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            span = Span(name)
+            token = _current.set(span)
+            error = False
+            try:
+                return await func(*args, **kwargs)
+            except BaseException:
+                error = True
+                raise
+            finally:
+                _current.reset(token)
+                _finish(span, error, slow_ms)
+        return wrapper
+    return decorator
+
+
+def _finish(span: Span, error: bool, slow_ms: float):
+    wall = time.perf_counter() - span.started
+    totals = _totals.get(span.name)
+    if totals is None:
+        totals = _totals[span.name] = _Totals()
+    totals.calls += 1
+    totals.errors += error
+    totals.wall += wall
+    totals.rest += span.rest
+    totals.db += span.db
+    totals.max_wall = max(totals.max_wall, wall)
+    if wall * 1000 >= slow_ms:
+        totals.slow += 1
+        # 並行して動くタスクの分も足すので、REST + DB が全体を超えることがある
+        other = max(wall - span.rest - span.db, 0.0)
+        logging.warning(
+            f"遅い処理: {span.name} {wall * 1000:.0f}ms "
+            f"(Discord REST {span.rest * 1000:.0f}ms / DB {span.db * 1000:.0f}ms / その他 {other * 1000:.0f}ms)"
+        )
+
+
+def stats() -> list:
+    """処理ごとの平均・最大（平均全体時間の長い順）"""
+    rows = []
+    for name, t in _totals.items():
+        rows.append({
+            'name': name,
+            'calls': t.calls,
+            'errors': t.errors,
+            'slow': t.slow,
+            'avg_ms': t.wall / t.calls * 1000,
+            'max_ms': t.max_wall * 1000,
+            'avg_rest_ms': t.rest / t.calls * 1000,
+            'avg_db_ms': t.db / t.calls * 1000,
+        })
+    rows.sort(key=lambda r: r['avg_ms'], reverse=True)
+    return rows
+
+
+def _timed_request(original):
+    @functools.wraps(original)
+    async def request(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await original(*args, **kwargs)
+        finally:
+            add_rest(time.perf_counter() - started)
+    return request
+
+
+def install_rest_timing(bot):
+    """Discord REST の呼び出し口を包み、1回ごとの時間をいまの処理に数える。
+    通常のAPI（HTTPClient）と、interactionの応答・followup（Webhookアダプター）の両方。
+    """
+    from discord.webhook.async_ import AsyncWebhookAdapter
+
+    bot.http.request = _timed_request(bot.http.request)
+    if not getattr(AsyncWebhookAdapter.request, '_profiled', False):
+        AsyncWebhookAdapter.request = _timed_request(AsyncWebhookAdapter.request)
+        AsyncWebhookAdapter.request._profiled = True
+
+
+_profile_lock = asyncio.Lock()
+
+
+async def sample(seconds: float, limit: int = 60) -> str:
+    """seconds 秒間 cProfile を有効にし、累積時間の上位 limit 関数をテキストで返す。
+    イベントループのスレッドで有効にするので、その間に動いたすべての処理が対象になる。
+    """
+    if _profile_lock.locked():
+        raise RuntimeError("プロファイラーは実行中です")
+    async with _profile_lock:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+
+    out = io.StringIO()
+    out.write(f"# {seconds}秒間のプロファイル（累積時間順・上位{limit}件）\n")
+    pstats.Stats(profiler, stream=out).strip_dirs().sort_stats("cumulative").print_stats(limit)
+    out.write(f"\n# 自身の時間順・上位{limit}件\n")
+    pstats.Stats(profiler, stream=out).strip_dirs().sort_stats("tottime").print_stats(limit)
+    return out.getvalue()
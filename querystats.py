@@ -0,0 +1,113 @@
+# querystats.py - DBクエリごとの所要時間の集計（接続待ち・実行時間・遅いクエリの記録）
+
+import collections
+import time
+from config import QUERY_STATS_WINDOW, SLOW_QUERY_PLAN_INTERVAL_SECONDS
+
+
+def _percentile(sorted_values: list, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class _QueryEntry:
+    __slots__ = ("calls", "errors", "total_ms", "max_ms", "exec_ms", "wait_ms",
+                 "slow", "last_sql", "last_args", "plan", "plan_at", "plan_requested_at")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.exec_ms = collections.deque(maxlen=QUERY_STATS_WINDOW)  # 直近の実行時間
+        self.wait_ms = collections.deque(maxlen=QUERY_STATS_WINDOW)  # 直近の接続待ち時間
+        self.slow = 0
+        self.last_sql = None   # 最後に遅かったSQL
+        self.last_args = ()    # そのときのパラメーター（実行計画を取り直すときに渡す）
+        self.plan = None       # その実行計画（database.capture_plan の結果）
+        self.plan_at = None
+        self.plan_requested_at = None
+
+
+class QueryStats:
+    """クエリ名ごとに直近 QUERY_STATS_WINDOW 回の時間を持ち、パーセンタイルを出す"""
+
+    def __init__(self):
+        self._entries = {}
+        self.started = time.time()
+
+    def _entry(self, name: str) -> _QueryEntry:
+        entry = self._entries.get(name)
+        if entry is None:
+            entry = self._entries[name] = _QueryEntry()
+        return entry
+
+    def record_wait(self, name: str, ms: float):
+        self._entry(name).wait_ms.append(ms)
+
+    def record(self, name: str, ms: float, error: bool = False):
+        entry = self._entry(name)
+        entry.calls += 1
+        entry.total_ms += ms
+        entry.max_ms = max(entry.max_ms, ms)
+        entry.exec_ms.append(ms)
+        if error:
+            entry.errors += 1
+
+    def mark_slow(self, name: str, sql: str, args=()) -> bool:
+        """遅かったクエリを記録し、実行計画を取り直すべきなら True を返す"""
+        entry = self._entry(name)
+        entry.slow += 1
+        entry.last_sql = sql
+        entry.last_args = tuple(args)
+        now = time.monotonic()
+        if entry.plan_requested_at is not None and now - entry.plan_requested_at < SLOW_QUERY_PLAN_INTERVAL_SECONDS:
+            return False
+        entry.plan_requested_at = now
+        return True
+
+    def set_plan(self, name: str, plan: str):
+        entry = self._entry(name)
+        entry.plan = plan
+        entry.plan_at = time.time()
+
+    def get_plan(self, name: str):
+        entry = self._entries.get(name)
+        return (entry.last_sql, entry.last_args, entry.plan) if entry else (None, (), None)
+
+    def summary(self, name: str) -> dict:
+        entry = self._entries[name]
+        exec_ms = sorted(entry.exec_ms)
+        wait_ms = sorted(entry.wait_ms)
+        return {
+            'name': name,
+            'calls': entry.calls,
+            'errors': entry.errors,
+            'slow': entry.slow,
+            'avg_ms': entry.total_ms / entry.calls if entry.calls else 0.0,
+            'max_ms': entry.max_ms,
+            'p50_ms': _percentile(exec_ms, 50),
+            'p95_ms': _percentile(exec_ms, 95),
+            'p99_ms': _percentile(exec_ms, 99),
+            'wait_p95_ms': _percentile(wait_ms, 95),
+            'has_plan': entry.plan is not None,
+        }
+
+    def top(self, n: int = 10, key: str = 'p95_ms') -> list:
+        """key の大きい順に n 件"""
+        rows = [self.summary(name) for name, entry in self._entries.items() if entry.calls]
+        rows.sort(key=lambda r: r[key], reverse=True)
+        return rows[:n]
+
+
+_stats = None
+
+
+def get_stats() -> QueryStats:
+    """グローバルのクエリ統計を取得または作成"""
+    global _stats
+    if _stats is None:
+        _stats = QueryStats()
+    return _stats
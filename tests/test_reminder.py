@@ -0,0 +1,54 @@
+# tests/test_reminder.py - リマインダースケジューラー（DBと送信は差し替えて確認する）
+
+import asyncio
+import datetime
+import types
+
+from cogs import reminder as reminder_cog
+
+
+def _reminder(remind_at):
+    return {'id': 1, 'guild_id': 10, 'channel_id': 20, 'remind_at': remind_at, 'status': 'waiting'}
+
+
+def test_claim_failure_is_retried(monkeypatch):
+    """確保が一度失敗しても、RETRY_DELAY 後に確保し直して送る"""
+    async def scenario():
+        now = datetime.datetime.now(datetime.timezone.utc)
+        row = _reminder(now - datetime.timedelta(seconds=1))
+        claims = []
+        sent = []
+
+        async def claim_due_reminders(second_delay, limit):
+            claims.append(limit)
+            if len(claims) == 1:
+                raise ConnectionError("一時的な接続エラー")
+            return [row] if len(claims) == 2 else []
+
+        def send(channel, priority, **kwargs):
+            sent.append((channel.id, kwargs['content']))
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(types.SimpleNamespace(id=99, channel=channel))
+            return future
+
+        monkeypatch.setattr(reminder_cog.db, 'claim_due_reminders', claim_due_reminders)
+        monkeypatch.setattr(reminder_cog.outbound, 'send', send)
+        monkeypatch.setattr(reminder_cog, 'RETRY_DELAY', datetime.timedelta(milliseconds=50))
+
+        bot = types.SimpleNamespace(get_channel=lambda channel_id: types.SimpleNamespace(id=channel_id))
+        cog = reminder_cog.ReminderCog(bot)
+        try:
+            cog.schedule(dict(row))
+            for _ in range(100):
+                if sent:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await cog.cog_unload()
+
+        assert len(claims) >= 2
+        assert sent and sent[0][0] == 20
+        # 1回目を送ったので2回目が予約されている
+        assert cog._scheduled[1][0] == row['remind_at'] + reminder_cog.SECOND_REMINDER_DELAY
+
+    asyncio.run(scenario())
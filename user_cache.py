@@ -0,0 +1,90 @@
+# user_cache.py - ユーザー状態のLRUキャッシュ（Bump書き込み時の読み込みを省く）
+
+from collections import OrderedDict
+
+
+class UserStateCache:
+    """users / weekly_bumps の1ユーザー分の状態を保持するLRUキャッシュ。
+
+    usersテーブルに書き込むのはこのBotだけなので、書き込み成功時に
+    キャッシュも更新すればDBと一致し続ける（write-through）。
+    SQLでusersを直接書き換える処理は invalidate() を呼ぶこと。
+
+    DBから読んだ状態は put_loaded() で入れる。読み込み中に書き込み・破棄があった
+    ユーザーは入れない（古い値が残ると、次のBumpでその値から計算した絶対値を書き込んでしまう）。
+
+    状態dict: bump_count, last_bump_date, current_streak, max_streak,
+              week_start, weekly_count
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # 書き込み・破棄のたびに進める時刻。読み込み開始時の値と比べて割り込みを検出する
+        self._clock = 0
+        self._written = OrderedDict()  # user_id -> 最後に書き込み・破棄した時刻（直近 max_size 人分）
+        self._written_floor = 0        # _written から押し出した分の最大の時刻
+        self._cleared_at = 0           # 全員分を破棄した時刻
+
+    def get(self, user_id: int):
+        """状態を返す。なければNone"""
+        state = self._entries.get(user_id)
+        if state is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(user_id)
+        return state
+
+    def put(self, user_id: int, state: dict):
+        """書き込み（コミット済み）の結果を入れる"""
+        self._touch(user_id)
+        self._store(user_id, state)
+
+    def snapshot(self) -> int:
+        """DBから読み込む直前に取り、put_loaded() に渡す"""
+        return self._clock
+
+    def put_loaded(self, user_id: int, state: dict, since: int) -> bool:
+        """DBから読んだ状態を入れる。since 以降にこのユーザーへの書き込み・破棄があれば入れない"""
+        last = max(self._written.get(user_id, self._written_floor), self._cleared_at)
+        if last > since:
+            return False
+        self._store(user_id, state)
+        return True
+
+    def invalidate(self, user_id: int = None):
+        """指定ユーザー（省略時は全員）のキャッシュを捨てる"""
+        if user_id is None:
+            self._clock += 1
+            self._cleared_at = self._clock
+            self._entries.clear()
+        else:
+            self._touch(user_id)
+            self._entries.pop(user_id, None)
+
+    def _store(self, user_id: int, state: dict):
+        self._entries[user_id] = state
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _touch(self, user_id: int):
+        self._clock += 1
+        self._written[user_id] = self._clock
+        self._written.move_to_end(user_id)
+        while len(self._written) > self.max_size:
+            _, written_at = self._written.popitem(last=False)
+            self._written_floor = max(self._written_floor, written_at)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': len(self._entries),
+            'max_size': self.max_size,
+        }
@@ -0,0 +1,101 @@
+# webserver.py - ヘルスチェック・メトリクス用のWebサーバー（Botと同じイベントループで動く）
+#
+#   /         稼働確認（スリープ対策）
+#   /health   プロセスが応答するか（liveness）
+#   /ready    ゲートウェイ接続とDBが使えて、終了処理中でないか（readiness。NGなら503）
+#   /metrics  Prometheus形式のメトリクス
+
+import logging
+import math
+from aiohttp import web
+import database as db
+import ingest
+import lifecycle
+import metrics
+import outbound
+
+
+class WebServer:
+    def __init__(self, bot, port: int):
+        self.bot = bot
+        self.port = port
+        self._runner = None
+        self._register_gauges()
+
+    def _register_gauges(self):
+        bot = self.bot
+
+        def latency():
+            # 未接続のときは inf になるので出さない
+            return bot.latency if math.isfinite(bot.latency) else None
+
+        def pool(key):
+            def read():
+                stats = db.get_pool_stats()
+                return stats[key] if stats else 0
+            return read
+
+        def countdowns_active():
+            # ReminderCog の読み込み前は出さない
+            reminder = bot.get_cog("ReminderCog")
+            return reminder.countdowns.stats()['active'] if reminder is not None else None
+
+        metrics.register(metrics.Gauge(
+            "bumpkun_gateway_latency_seconds", "Discord gateway heartbeat latency.", latency))
+        metrics.register(metrics.Gauge(
+            "bumpkun_gateway_connected", "1 if the gateway session is ready.",
+            lambda: 1 if bot.is_ready() and not bot.is_closed() else 0))
+        metrics.register(metrics.Gauge(
+            "bumpkun_db_pool_size", "Open connections in the asyncpg pool.", pool('size')))
+        metrics.register(metrics.Gauge(
+            "bumpkun_db_pool_in_use", "Connections currently checked out of the pool.", pool('in_use')))
+        metrics.register(metrics.Gauge(
+            "bumpkun_db_pool_max_size", "Maximum size of the asyncpg pool.", pool('max_size')))
+        metrics.register(metrics.Gauge(
+            "bumpkun_outbound_queue_depth", "Pending Discord sends/edits, by priority.",
+            lambda: outbound.get_dispatcher().stats()['depth'], label="priority"))
+        metrics.register(metrics.Gauge(
+            "bumpkun_inflight_work", "Bump handlers, reminder sends and countdown edits in progress.",
+            lambda: lifecycle.get_lifecycle().inflight(), label="kind"))
+        metrics.register(metrics.Gauge(
+            "bumpkun_bump_duplicates", "Bumps dropped as already recorded since startup.",
+            lambda: ingest.get_queue().duplicates))
+        metrics.register(metrics.Gauge(
+            "bumpkun_countdowns_active", "Second-reminder countdown messages being updated every minute.",
+            countdowns_active))
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/', self.index)
+        app.router.add_get('/health', self.health)
+        app.router.add_get('/ready', self.ready)
+        app.router.add_get('/metrics', self.metrics_endpoint)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, '0.0.0.0', self.port).start()
+        logging.info(f"Webサーバー起動: ポート{self.port}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def index(self, request):
+        return web.Response(text="BUMPくん v3 is running!")
+
+    async def health(self, request):
+        return web.Response(text="OK")
+
+    async def ready(self, request):
+        gateway = self.bot.is_ready() and not self.bot.is_closed() and math.isfinite(self.bot.latency)
+        database = await db.ping()
+        draining = lifecycle.get_lifecycle().draining
+        body = {'gateway': gateway, 'database': database, 'draining': draining}
+        ok = gateway and database and not draining
+        return web.json_response(body, status=200 if ok else 503)
+
+    async def metrics_endpoint(self, request):
+        return web.Response(
+            body=metrics.render().encode('utf-8'),
+            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'},
+        )